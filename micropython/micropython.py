@@ -12,6 +12,20 @@ ONEWIRE-ID2 TEMPERATURE2
 
 When a sensor has problems reading, it sends as temperature 9001.
 
+If the host sends the line `MODE BIN1`, the firmware answers `OK BIN1` and
+switches to the binary framing described in tempermonitor/protocol.py:
+an id table frame listing the one wire ids, followed by one data frame per
+round with the temperatures as 1/100 degrees indexed into that table.
+The id table is repeated every IDS_INTERVAL rounds. `MODE TEXT` switches back.
+
+Every 1-wire pin in BUSES is a separate bus with its own resolution. All buses
+convert in parallel and independently: a bus is read as soon as its sensors
+report the conversion as done (or the maximum conversion time of the resolution
+has passed) and immediately starts the next conversion while the other buses
+are still converting or being read. A round is sent once every bus has
+delivered, but not more often than every ROUND_INTERVAL ms. The loop never
+waits for a conversion, so host commands are handled in between.
+
 New sensors are only detected upon powerup, so you have to reboot in order to
 extend the sensor network.
 
@@ -23,27 +37,170 @@ import machine
 import time
 import onewire, ds18x20
 import ubinascii
+import ustruct
+import uselect
+import sys
 
-class reader:
+MAGIC = b'\xa5\x5a'
+FRAME_IDS = ord('I')
+FRAME_DATA = ord('D')
+READ_ERROR = 0x7fff
+IDS_INTERVAL = 60
 
-    def __init__(self):
+# (pin, resolution in bits) of every 1-wire bus
+BUSES = [(13, 12)]
+# minimum time between two rounds in ms, 0 sends as fast as the sensors allow
+ROUND_INTERVAL = 0
+# maximum conversion time of the DS18B20 per resolution in ms
+CONVERSION_MS = {9: 94, 10: 188, 11: 375, 12: 750}
+# alarm thresholds written together with the resolution (power-on defaults)
+ALARM_HIGH = 75
+ALARM_LOW = 70
+# longer host lines are truncated, they are no known command anyway
+MAX_HOST_LINE = 32
 
-        self.di = machine.Pin(13)
 
-        self.ds = ds18x20.DS18X20(onewire.OneWire(self.di))
+class bus:
+    """
+    The sensors on one pin, converting independently of the other buses
+    """
+
+    def __init__(self, pin, resolution):
+        self.ow = onewire.OneWire(machine.Pin(pin))
+        self.ds = ds18x20.DS18X20(self.ow)
+        self.conversion_ms = CONVERSION_MS[resolution]
 
         #scan for sensors
         self.roms = self.ds.scan()
 
+        config = ((resolution - 9) << 5) | 0x1f
+        for rom in self.roms:
+            try:
+                self.ds.write_scratchpad(rom, bytes([ALARM_HIGH, ALARM_LOW, config]))
+            except:
+                pass
+
+        self.converting = False
+        self.deadline = 0
+        # the values of the last conversion, until they have been sent
+        self.temperatures = None
+
+    def start(self):
+        """
+        Start a conversion on all sensors of the bus
+        """
+        self.ds.convert_temp()
+        self.converting = True
+        self.deadline = time.ticks_add(time.ticks_ms(), self.conversion_ms)
+
+    def poll(self):
+        """
+        Read the sensors if the conversion is done, returns if new values are available
+        """
+        if not self.converting:
+            return False
+        # the sensors answer read slots with 0 while they are converting
+        if not self.ow.readbit() and time.ticks_diff(self.deadline, time.ticks_ms()) > 0:
+            return False
+        self.converting = False
+        temperatures = []
+        for rom in self.roms:
+            try:
+                temperatures.append(self.ds.read_temp(rom))
+            except:
+                temperatures.append(None)
+        self.temperatures = temperatures
+        return True
+
+
+class reader:
+
+    def __init__(self, buses=BUSES):
+
+        self.buses = [bus(pin, resolution) for pin, resolution in buses]
+        self.roms = [rom for b in self.buses for rom in b.roms]
+
+        self.binary = False
+        self.seq = 0
+        self.rounds = 0
+        self.poll = uselect.poll()
+        self.poll.register(sys.stdin, uselect.POLLIN)
+        self.line = ''
+
+    def check_host(self):
+        """
+        Handle the protocol negotiation lines sent by the host, never blocks:
+        only the characters already received are read, a command is handled
+        once its line is complete
+        """
+        while self.poll.poll(0):
+            char = sys.stdin.read(1)
+            if not char:
+                break
+            if char != '\n':
+                if len(self.line) < MAX_HOST_LINE:
+                    self.line += char
+                continue
+            line, self.line = self.line.strip(), ''
+            if line == 'MODE BIN1':
+                print('OK BIN1')
+                self.binary = True
+                self.send_ids()
+            elif line == 'MODE TEXT':
+                self.binary = False
+
+    def send_frame(self, frame_type, payload):
+        header = ustruct.pack('<BH', frame_type, len(payload))
+        crc = ubinascii.crc32(header + payload)
+        sys.stdout.buffer.write(MAGIC + header + payload + ustruct.pack('<I', crc))
+        self.seq = (self.seq + 1) & 0xffff
+
+    def send_ids(self):
+        payload = ustruct.pack('<HH', self.seq, len(self.roms)) + b''.join(self.roms)
+        self.send_frame(FRAME_IDS, payload)
+
+    def send_data(self, temperatures):
+        payload = bytearray(ustruct.pack('<HIH', self.seq, time.ticks_ms() & 0xffffffff,
+                                         len(temperatures)))
+        for index, temp in enumerate(temperatures):
+            if temp is None or not -327 < temp < 327:
+                value = READ_ERROR
+            else:
+                value = int(round(temp * 100))
+            payload += ustruct.pack('<Hh', index, value)
+        self.send_frame(FRAME_DATA, payload)
+
+    def send_round(self, temperatures):
+        if self.binary:
+            self.rounds += 1
+            if self.rounds % IDS_INTERVAL == 0:
+                self.send_ids()
+            self.send_data(temperatures)
+            return
+
+        for rom, temp in zip(self.roms, temperatures):
+            print(ubinascii.hexlify(rom).decode('utf-8'), end=' ')
+            print(9001 if temp is None else temp)
+        print()
+
     def run(self):
+        next_round = time.ticks_ms()
         while 1:
-            time.sleep_ms(240)
-            self.ds.convert_temp()
-            time.sleep_ms(750)
-            for rom in self.roms:
-                print(ubinascii.hexlify(rom).decode('utf-8'), end=' ')
-                try:
-                    print(self.ds.read_temp(rom))
-                except:
-                    print(9001)
-            print()
+            self.check_host()
+            busy = False
+            for b in self.buses:
+                if b.temperatures is None and b.poll():
+                    busy = True
+                if not b.converting and \
+                   time.ticks_diff(next_round, time.ticks_ms()) <= b.conversion_ms:
+                    # convert the next round while the other buses are read
+                    b.start()
+
+            if all(b.temperatures is not None for b in self.buses) and \
+               time.ticks_diff(time.ticks_ms(), next_round) >= 0:
+                self.send_round([temp for b in self.buses for temp in b.temperatures])
+                for b in self.buses:
+                    b.temperatures = None
+                next_round = time.ticks_add(time.ticks_ms(), ROUND_INTERVAL)
+            elif not busy:
+                time.sleep_ms(1)
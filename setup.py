@@ -30,6 +30,15 @@ setup(
         'tempermonitor',
         'tempermonitor.plugins'
     ],
+    entry_points={
+        'tempermonitor.plugins': [
+            'api = tempermonitor.plugins.api:Api',
+            'collectd = tempermonitor.plugins.collectd:Collectd',
+            'mail = tempermonitor.plugins.mail:Mail',
+            'prometheus = tempermonitor.plugins.prometheus:Prometheus',
+            'warnings = tempermonitor.plugins.warnings:Warnings',
+        ],
+    },
     include_package_data=True,
     zip_safe=False
 )
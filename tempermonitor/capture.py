@@ -0,0 +1,77 @@
+"""
+File format of recorded serial captures.
+
+A capture is a sequence of records of raw bytes as they were received from a
+serial bus, each with the host time of reception:
+
+    header: b"TMCAP1\\n"
+    record: timestamp (f64) | length (u32) | length bytes of data
+
+with all integers little endian. Capture files may be gzip compressed.
+"""
+
+import gzip
+import struct
+
+CAPTURE_MAGIC = b"TMCAP1\n"
+RECORD = struct.Struct('<dI')
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def encode_records(records):
+    """
+    Serialize (timestamp, data) records without the capture header
+    """
+    return b"".join(RECORD.pack(timestamp, len(data)) + data
+                    for timestamp, data in records)
+
+
+def decode_records(buffer):
+    """
+    Iterate over the (timestamp, data) records serialized in buffer
+    """
+    offset = 0
+    while offset + RECORD.size <= len(buffer):
+        timestamp, length = RECORD.unpack_from(buffer, offset)
+        offset += RECORD.size
+        if offset + length > len(buffer):
+            return
+        yield timestamp, bytes(buffer[offset:offset + length])
+        offset += length
+
+
+def open_capture(path):
+    """
+    Open a capture file for reading, compressed or not
+    """
+    with open(path, 'rb') as capture:
+        compressed = capture.read(2) == GZIP_MAGIC
+    if compressed:
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def read_records(stream):
+    """
+    Iterate over the (timestamp, data) records of an open capture stream.
+    A truncated last record (e.g. after a crash) is ignored.
+    """
+    if stream.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+        raise RuntimeError("Not a tempermonitor capture")
+    while True:
+        header = stream.read(RECORD.size)
+        if len(header) < RECORD.size:
+            return
+        timestamp, length = RECORD.unpack(header)
+        data = stream.read(length)
+        if len(data) < length:
+            return
+        yield timestamp, data
+
+
+def iter_capture(path):
+    """
+    Iterate over all (timestamp, data) records of a capture file
+    """
+    with open_capture(path) as stream:
+        yield from read_records(stream)
@@ -0,0 +1,282 @@
+"""
+The binary network protocol of collectd.
+
+Instead of one PUTVAL round trip per value over the local unix socket, the
+values are packed into UDP datagrams for the network plugin of a (possibly
+remote) collectd. A datagram is a sequence of parts
+
+    type (u16) | length (u16, including this header) | payload
+
+with all integers big endian. The parts used here:
+
+* 0x0000 host, 0x0002 plugin, 0x0003 plugin instance, 0x0004 type,
+  0x0005 type instance: null terminated strings
+* 0x0008 time, 0x0009 interval: u64 in 2^-30 seconds
+* 0x0006 values: count (u16), count * data source type (u8), count * values.
+  A gauge (type 1) is a little endian double.
+* 0x0200 signature: HMAC-SHA256 (32 bytes) followed by the username, it
+  must be the first part and covers the username and the rest of the datagram
+
+The receiver keeps the host, plugin, ... of the previous values part within a
+datagram, so they are only repeated when they change.
+
+Encryption (0x0210) would need an AES implementation and is not supported.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import struct
+
+PART_HOST = 0x0000
+PART_PLUGIN = 0x0002
+PART_PLUGIN_INSTANCE = 0x0003
+PART_TYPE = 0x0004
+PART_TYPE_INSTANCE = 0x0005
+PART_VALUES = 0x0006
+PART_TIME_HR = 0x0008
+PART_INTERVAL_HR = 0x0009
+PART_SIGN_SHA256 = 0x0200
+
+STRING_PARTS = (PART_HOST, PART_PLUGIN, PART_PLUGIN_INSTANCE, PART_TYPE, PART_TYPE_INSTANCE)
+
+DS_TYPE_GAUGE = 1
+
+PART_HEADER = struct.Struct('!HH')
+NUMBER_PART = struct.Struct('!HHQ')
+GAUGE_PART = struct.Struct('!HHHB')
+GAUGE = struct.Struct('<d')
+SIGNATURE_SIZE = 32
+
+DEFAULT_PORT = 25826
+# the default buffer size of collectd, fits into one ethernet frame
+DEFAULT_PACKET_SIZE = 1452
+
+
+def split_identifier(identifier):
+    """
+    Split `plugin[-instance]/type[-instance]` into its four fields
+    """
+    plugin, _, type_ = identifier.partition('/')
+    plugin, _, plugin_instance = plugin.partition('-')
+    type_, _, type_instance = type_.partition('-')
+    return plugin, plugin_instance, type_, type_instance
+
+
+def hr_time(seconds):
+    return int(seconds * 2 ** 30)
+
+
+def encode_part(part_type, value):
+    """
+    Encode a string or number part
+    """
+    if part_type in STRING_PARTS:
+        data = value.encode('utf-8') + b'\0'
+        return PART_HEADER.pack(part_type, PART_HEADER.size + len(data)) + data
+    return NUMBER_PART.pack(part_type, NUMBER_PART.size, value)
+
+
+def encode_gauge(value):
+    return GAUGE_PART.pack(PART_VALUES, GAUGE_PART.size + GAUGE.size, 1, DS_TYPE_GAUGE) + \
+        GAUGE.pack(value)
+
+
+def sign(payload, username, password):
+    """
+    Prepend the signature part to the payload
+    """
+    user = username.encode('utf-8')
+    mac = hmac.new(password.encode('utf-8'), user + payload, hashlib.sha256).digest()
+    return PART_HEADER.pack(PART_SIGN_SHA256, PART_HEADER.size + SIGNATURE_SIZE + len(user)) + \
+        mac + user + payload
+
+
+class PacketEncoder:
+    """
+    Pack gauge values into datagrams of at most `max_size` bytes, signed if a
+    username is given
+    """
+
+    def __init__(self, hostname, max_size=DEFAULT_PACKET_SIZE, username=None, password=None):
+        self.hostname = hostname
+        self.max_size = max_size
+        self.username = username
+        self.password = password or ''
+        self._reserved = 0
+        if username:
+            self._reserved = PART_HEADER.size + SIGNATURE_SIZE + len(username.encode('utf-8'))
+
+    def _parts(self, state, identifier, interval, timestamp):
+        """
+        The parts that changed compared to the state of the datagram
+        """
+        fields = zip(STRING_PARTS + (PART_TIME_HR, PART_INTERVAL_HR),
+                     (self.hostname,) + split_identifier(identifier) +
+                     (hr_time(timestamp), hr_time(interval)))
+        return [(part_type, value) for part_type, value in fields
+                if state.get(part_type) != value]
+
+    def encode(self, values):
+        """
+        Encode (identifier, interval, timestamp, value) tuples, returns the
+        datagrams
+        """
+        packets = []
+        chunks = []
+        size = self._reserved
+        state = {}
+        for identifier, interval, timestamp, value in values:
+            changed = self._parts(state, identifier, interval, timestamp)
+            data = b"".join(encode_part(*part) for part in changed) + encode_gauge(value)
+            if chunks and size + len(data) > self.max_size:
+                packets.append(self._finish(chunks))
+                chunks = []
+                size = self._reserved
+                state = {}
+                changed = self._parts(state, identifier, interval, timestamp)
+                data = b"".join(encode_part(*part) for part in changed) + encode_gauge(value)
+            state.update(changed)
+            chunks.append(data)
+            size += len(data)
+        if chunks:
+            packets.append(self._finish(chunks))
+        return packets
+
+    def _finish(self, chunks):
+        payload = b"".join(chunks)
+        if self.username:
+            return sign(payload, self.username, self.password)
+        return payload
+
+
+def decode(packet, users=None):
+    """
+    Decode a datagram into (host, identifier, time, interval, values) tuples.
+    If `users` (username -> password) is given, the datagram must be signed by
+    one of them.
+    """
+    position = 0
+    part_type, length = PART_HEADER.unpack_from(packet, 0)
+    if part_type != PART_SIGN_SHA256 and users is not None:
+        raise ValueError("Datagram is not signed")
+    if part_type == PART_SIGN_SHA256:
+        mac = packet[PART_HEADER.size:PART_HEADER.size + SIGNATURE_SIZE]
+        user = packet[PART_HEADER.size + SIGNATURE_SIZE:length]
+        if users is not None:
+            password = users.get(user.decode('utf-8'))
+            expected = hmac.new((password or '').encode('utf-8'), user + packet[length:],
+                                hashlib.sha256).digest()
+            if password is None or not hmac.compare_digest(mac, expected):
+                raise ValueError("Invalid signature of {}".format(user.decode('utf-8')))
+        position = length
+
+    state = {}
+    values = []
+    while position < len(packet):
+        part_type, length = PART_HEADER.unpack_from(packet, position)
+        if length < PART_HEADER.size or position + length > len(packet):
+            raise ValueError("Invalid part length {} at {}".format(length, position))
+        payload = packet[position + PART_HEADER.size:position + length]
+        position += length
+        if part_type in STRING_PARTS:
+            state[part_type] = payload.rstrip(b'\0').decode('utf-8')
+        elif part_type in (PART_TIME_HR, PART_INTERVAL_HR):
+            state[part_type] = struct.unpack('!Q', payload)[0] / 2 ** 30
+        elif part_type == PART_VALUES:
+            count = struct.unpack_from('!H', payload)[0]
+            types = payload[2:2 + count]
+            data = payload[2 + count:]
+            parsed = []
+            for index, ds_type in enumerate(types):
+                raw = data[index * 8:index * 8 + 8]
+                if ds_type == DS_TYPE_GAUGE:
+                    parsed.append(GAUGE.unpack(raw)[0])
+                else:
+                    parsed.append(struct.unpack('!Q', raw)[0])
+            plugin = state.get(PART_PLUGIN, '')
+            if state.get(PART_PLUGIN_INSTANCE):
+                plugin += '-' + state[PART_PLUGIN_INSTANCE]
+            type_ = state.get(PART_TYPE, '')
+            if state.get(PART_TYPE_INSTANCE):
+                type_ += '-' + state[PART_TYPE_INSTANCE]
+            values.append((state.get(PART_HOST), plugin + '/' + type_,
+                           state.get(PART_TIME_HR), state.get(PART_INTERVAL_HR), parsed))
+    return values
+
+
+def network_settings(conf):
+    """
+    The address and the encoder configured in `[collectd]`
+    """
+    address = (conf.get('server', 'localhost'), int(conf.get('server_port', DEFAULT_PORT)))
+    security_level = conf.get('security_level', 'none').lower()
+    if security_level not in ('none', 'sign'):
+        raise RuntimeError("Unsupported security_level {}, use none or sign".format(
+            security_level))
+    username = None
+    if security_level == 'sign':
+        username = conf.get('username')
+        if not username or 'password' not in conf:
+            raise RuntimeError("security_level=sign needs a username and a password")
+    encoder = PacketEncoder(conf['hostname'],
+                            int(conf.get('max_packet_size', DEFAULT_PACKET_SIZE)),
+                            username, conf.get('password'))
+    return address, encoder
+
+
+class NetworkClient:
+    """
+    Send the datagrams to the network plugin of collectd over UDP. There are no
+    acks, the values are sent as soon as the datagrams are written.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.address = None
+        self.encoder = None
+        self._transport = None
+
+        self.packets = 0
+        self.bytes = 0
+        self.errors = 0
+
+    def configure(self, conf):
+        """
+        Read the settings of `[collectd]`, a changed address is used from the
+        next send on
+        """
+        address, self.encoder = network_settings(conf)
+        if address != self.address:
+            self.close()
+        self.address = address
+
+    async def connect(self):
+        client = self
+
+        class Protocol(asyncio.DatagramProtocol):
+            def error_received(self, exc):
+                # e.g. port unreachable for an earlier datagram
+                print("Collectd network error: {}".format(exc))
+                client.errors += 1
+
+        self._transport, _ = await self.loop.create_datagram_endpoint(
+            Protocol, remote_addr=self.address)
+
+    async def send(self, values):
+        """
+        Encode the values and send them, returns the number of datagrams
+        """
+        if self._transport is None:
+            await self.connect()
+        packets = self.encoder.encode(values)
+        for packet in packets:
+            self._transport.sendto(packet)
+            self.packets += 1
+            self.bytes += len(packet)
+        return len(packets)
+
+    def close(self):
+        if self._transport:
+            self._transport.close()
+            self._transport = None
@@ -0,0 +1,41 @@
+"""
+Suppress exports of values that have not changed noticeably.
+
+A value is exported when it differs by more than its deadband from the last
+exported value of the same series, or when the last export is older than the
+heartbeat. A deadband of None exports every value.
+"""
+
+from collections import Counter
+
+
+class Deadband:
+    """
+    Remember the last exported value of every series
+    """
+
+    def __init__(self, heartbeat):
+        self.heartbeat = heartbeat
+        # series -> (time, value) of the last export
+        self._last = {}
+        self.emitted = Counter()
+        self.suppressed = Counter()
+
+    def check(self, series, timestamp, value, deadband, kind):
+        """
+        Returns if the value should be exported, kind is only used for counting
+        """
+        last = self._last.get(series)
+        if deadband is not None and last is not None and \
+           abs(value - last[1]) <= deadband and timestamp - last[0] < self.heartbeat:
+            self.suppressed[kind] += 1
+            return False
+        self._last[series] = (timestamp, value)
+        self.emitted[kind] += 1
+        return True
+
+    def reset(self):
+        """
+        Export every series with its next value
+        """
+        self._last.clear()
@@ -0,0 +1,218 @@
+"""
+Deliver plugin calls without ever blocking the serial ingest.
+
+Every plugin gets its own bounded queue and worker task. Emitting an event only
+puts it into the queues of the plugins implementing the call, the workers then
+execute them one after another with a timeout. If a queue is full, the
+configured drop policy decides which event is lost:
+
+* drop_oldest: discard the oldest queued event to make room for the new one
+* drop_newest: discard the new event
+
+The defaults are configured in `[general]` (`plugin_queue_size`,
+`plugin_timeout`, `plugin_drop_policy`) and can be overridden in the plugins
+own section (`queue_size`, `timeout`, `drop_policy`).
+
+The time events wait in the queue and the duration of every call are kept as
+histograms per plugin.
+
+The optional async `start()` of a plugin is run by its worker before the first
+event, so all plugins start in parallel and the events emitted meanwhile are
+queued.
+"""
+
+import asyncio
+import time
+
+from .metrics import Metric
+from .timing import Histogram
+
+DROP_POLICIES = ('drop_oldest', 'drop_newest')
+
+
+class PluginWorker:
+    """
+    Queue and worker task of a single plugin
+    """
+
+    def __init__(self, plugin, loop, queue_size, timeout, drop_policy):
+        if drop_policy not in DROP_POLICIES:
+            raise RuntimeError(f"Invalid drop policy for {plugin.name}: {drop_policy}")
+
+        self.plugin = plugin
+        self.name = plugin.name
+        self.timeout = timeout
+        self.drop_policy = drop_policy
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+        self.handled = 0
+        self.dropped = 0
+        self.timeouts = 0
+        self.errors = 0
+        # call -> Histogram of its durations
+        self.durations = {}
+        self.queue_wait = Histogram()
+        self.start_duration = None
+
+        self._task = loop.create_task(self.run())
+
+    def put(self, call, args, kwargs):
+        """
+        Queue the call if the plugin implements it, never waits
+        """
+        func = getattr(self.plugin, call, None)
+        if not func:
+            return
+
+        if self.queue.full():
+            self.dropped += 1
+            if self.drop_policy == 'drop_newest':
+                print(f"Plugin {self.name} is congested, dropping {call}")
+                return
+            dropped_call = self.queue.get_nowait()[0]
+            self.queue.task_done()
+            print(f"Plugin {self.name} is congested, dropping {dropped_call}")
+
+        self.queue.put_nowait((call, func, args, kwargs, time.perf_counter()))
+
+    async def run(self):
+        """
+        Start the plugin, then execute the queued calls one after another
+        """
+        start = getattr(self.plugin, 'start', None)
+        if start:
+            began = time.perf_counter()
+            try:
+                await asyncio.wait_for(start(), timeout=self.timeout)
+            except Exception as exc:
+                self.errors += 1
+                print(f"Plugin {self.name} failed to start: {exc!r}")
+            self.start_duration = time.perf_counter() - began
+
+        while True:
+            call, func, args, kwargs, queued = await self.queue.get()
+            start = time.perf_counter()
+            self.queue_wait.observe(start - queued)
+            try:
+                if asyncio.iscoroutinefunction(func):
+                    await asyncio.wait_for(func(*args, **kwargs), timeout=self.timeout)
+                else:
+                    func(*args, **kwargs)
+                self.handled += 1
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                print(f"Plugin {self.name}: {call} timed out after {self.timeout}s")
+            except Exception as exc:
+                self.errors += 1
+                print(f"Plugin {self.name}: {call} failed: {exc!r}")
+            finally:
+                duration = self.durations.get(call)
+                if duration is None:
+                    duration = self.durations[call] = Histogram()
+                duration.observe(time.perf_counter() - start)
+                self.queue.task_done()
+
+    async def stop(self):
+        """
+        Terminate the worker, queued events are discarded
+        """
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+class EventBus:
+    """
+    Fan out plugin calls to the per plugin workers
+    """
+
+    def __init__(self, monitor):
+        self.monitor = monitor
+        self.workers = {}
+
+        general = monitor.config['general']
+        self.queue_size = int(general.get('plugin_queue_size', 100))
+        self.timeout = float(general.get('plugin_timeout', 30))
+        self.drop_policy = general.get('plugin_drop_policy', 'drop_oldest')
+
+    def add_plugin(self, plugin):
+        """
+        Create the queue and worker for a plugin
+        """
+        conf = {}
+        if plugin.name in self.monitor.config:
+            conf = self.monitor.config[plugin.name]
+
+        self.workers[plugin.name] = PluginWorker(
+            plugin,
+            self.monitor.loop,
+            queue_size=int(conf.get('queue_size', self.queue_size)),
+            timeout=float(conf.get('timeout', self.timeout)),
+            drop_policy=conf.get('drop_policy', self.drop_policy))
+
+    async def remove_plugin(self, name):
+        """
+        Stop the worker of a plugin
+        """
+        worker = self.workers.pop(name, None)
+        if worker:
+            await worker.stop()
+
+    def emit(self, call, *args, **kwargs):
+        """
+        Queue the call for every plugin implementing it
+        """
+        for worker in list(self.workers.values()):
+            worker.put(call, args, kwargs)
+
+    async def join(self):
+        """
+        Wait until all queued events have been handled
+        """
+        for worker in list(self.workers.values()):
+            await worker.queue.join()
+
+    async def teardown(self):
+        """
+        Stop all workers
+        """
+        for name in list(self.workers):
+            await self.remove_plugin(name)
+
+    def metrics(self):
+        """
+        Queue depths and event counters of all workers
+        """
+        for worker in self.workers.values():
+            labels = {'plugin': worker.name}
+            yield Metric('tempermonitor_plugin_queue_depth',
+                         "Events waiting in the plugin queue", 'gauge',
+                         labels, worker.queue.qsize())
+            yield Metric('tempermonitor_plugin_queue_size',
+                         "Capacity of the plugin queue", 'gauge',
+                         labels, worker.queue.maxsize)
+            yield Metric('tempermonitor_plugin_events_handled',
+                         "Events handled by the plugin", 'counter',
+                         labels, worker.handled)
+            yield Metric('tempermonitor_plugin_events_dropped',
+                         "Events dropped because the plugin queue was full", 'counter',
+                         labels, worker.dropped)
+            yield Metric('tempermonitor_plugin_events_timeout',
+                         "Events aborted because the plugin exceeded its timeout", 'counter',
+                         labels, worker.timeouts)
+            yield Metric('tempermonitor_plugin_events_failed',
+                         "Events that raised an exception in the plugin", 'counter',
+                         labels, worker.errors)
+            if worker.start_duration is not None:
+                yield Metric('tempermonitor_plugin_start_seconds',
+                             "Time the plugin took to start", 'gauge',
+                             labels, worker.start_duration)
+            yield Metric('tempermonitor_plugin_queue_wait_seconds',
+                         "Time events waited in the plugin queue", 'histogram',
+                         labels, worker.queue_wait)
+            for call, duration in worker.durations.items():
+                yield Metric('tempermonitor_plugin_call_seconds',
+                             "Duration of the plugin calls", 'histogram',
+                             dict(labels, call=call), duration)
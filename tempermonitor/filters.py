@@ -0,0 +1,238 @@
+"""
+Streaming filters to reject glitches before they reach the sensor.
+
+Every sensor has a chain of filter stages, each sample runs through them before
+`Sensor.update`. A stage either returns the (possibly smoothed) value or None to
+reject the sample. Every stage has constant cost per sample, except median
+which is O(median_window) per sample.
+
+The stages are configured in the `[filter]` section, every option can be
+overridden in the section of a single sensor:
+
+* stages: comma separated list of stages in the order they are applied
+  (default: none)
+* max_rejects: after this many consecutive rejected samples the filter is reset,
+  so a real step change does not get stuck. If even the fresh filter rejects the
+  sample, the sensor is reported as a problem sensor (default 5)
+
+Stages:
+
+* poweron: reject the DS18B20 power-on value 85.0 unless the previous value was
+  within `poweron_tolerance` (default 2.0) of it
+* rate: reject samples changing faster than `max_rate` degrees per second
+  (default 1.0)
+* outlier: reject samples more than `outlier_sigma` (default 4) rolling standard
+  deviations away from the rolling mean of the last `outlier_window` (default 30)
+  samples. The standard deviation is at least `outlier_min_stddev` (default 0.5).
+* median: replace the sample by the rolling median of the last `median_window`
+  (default 3) samples
+* ewma: exponentially weighted moving average with `ewma_alpha` (default 0.5)
+"""
+
+from bisect import bisect_left, insort
+from collections import Counter, deque
+
+POWERON_VALUE = 85.0
+
+
+class PowerOnFilter:
+    """
+    Reject the power-on reset value of the DS18B20
+    """
+    name = 'poweron'
+
+    def __init__(self, conf):
+        self.tolerance = float(conf('poweron_tolerance', 2.0))
+        self.last = None
+
+    def process(self, timestamp, value):
+        if value == POWERON_VALUE and (
+                self.last is None or abs(self.last - POWERON_VALUE) > self.tolerance):
+            return None
+        self.last = value
+        return value
+
+    def reset(self):
+        self.last = None
+
+
+class RateFilter:
+    """
+    Reject samples that change faster than physically plausible
+    """
+    name = 'rate'
+
+    def __init__(self, conf):
+        self.max_rate = float(conf('max_rate', 1.0))
+        self.last = None
+
+    def process(self, timestamp, value):
+        if self.last is not None:
+            last_timestamp, last_value = self.last
+            elapsed = max(timestamp - last_timestamp, 1.0)
+            if abs(value - last_value) / elapsed > self.max_rate:
+                return None
+        self.last = (timestamp, value)
+        return value
+
+    def reset(self):
+        self.last = None
+
+
+class OutlierFilter:
+    """
+    Reject samples far outside the rolling standard deviation
+    """
+    name = 'outlier'
+
+    def __init__(self, conf):
+        self.window = int(conf('outlier_window', 30))
+        self.sigma = float(conf('outlier_sigma', 4))
+        self.min_stddev = float(conf('outlier_min_stddev', 0.5))
+        self.reset()
+
+    def process(self, timestamp, value):
+        count = len(self.samples)
+        if count >= self.window // 2:
+            mean = self.total / count
+            variance = max(self.total_sq / count - mean * mean, 0.0)
+            stddev = max(variance ** 0.5, self.min_stddev)
+            if abs(value - mean) > self.sigma * stddev:
+                return None
+
+        self.samples.append(value)
+        self.total += value
+        self.total_sq += value * value
+        if len(self.samples) > self.window:
+            old = self.samples.popleft()
+            self.total -= old
+            self.total_sq -= old * old
+        return value
+
+    def reset(self):
+        self.samples = deque()
+        self.total = 0.0
+        self.total_sq = 0.0
+
+
+class MedianFilter:
+    """
+    Rolling median over a small, fixed window. Inserting into and removing
+    from the sorted list shifts its elements, O(window) per sample.
+    """
+    name = 'median'
+
+    def __init__(self, conf):
+        self.window = int(conf('median_window', 3))
+        self.reset()
+
+    def process(self, timestamp, value):
+        self.samples.append(value)
+        insort(self.ordered, value)
+        if len(self.samples) > self.window:
+            old = self.samples.popleft()
+            del self.ordered[bisect_left(self.ordered, old)]
+        return self.ordered[len(self.ordered) // 2]
+
+    def reset(self):
+        self.samples = deque()
+        self.ordered = []
+
+
+class EwmaFilter:
+    """
+    Exponentially weighted moving average
+    """
+    name = 'ewma'
+
+    def __init__(self, conf):
+        self.alpha = float(conf('ewma_alpha', 0.5))
+        self.value = None
+
+    def process(self, timestamp, value):
+        if self.value is None:
+            self.value = value
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+    def reset(self):
+        self.value = None
+
+
+STAGES = {
+    stage.name: stage
+    for stage in [PowerOnFilter, RateFilter, OutlierFilter, MedianFilter, EwmaFilter]
+}
+
+
+class SensorFilter:
+    """
+    The filter chain of one sensor
+    """
+
+    def __init__(self, config, owid):
+        def conf(key, default):
+            if owid in config and key in config[owid]:
+                return config[owid][key]
+            if 'filter' in config:
+                return config['filter'].get(key, default)
+            return default
+
+        self.stages = []
+        for stage in conf('stages', '').split(','):
+            stage = stage.strip()
+            if not stage:
+                continue
+            if stage not in STAGES:
+                raise RuntimeError(f"Invalid filter stage for {owid}: {stage}")
+            self.stages.append(STAGES[stage](conf))
+
+        self.max_rejects = int(conf('max_rejects', 5))
+        self.consecutive_rejects = 0
+        # set if even a freshly reset filter rejects the sensor
+        self.persistent = False
+        self.accepted = 0
+        self.rejected = Counter()
+
+    def process(self, timestamp, value):
+        """
+        Run the sample through all stages.
+        Returns (value, None) or (None, name of the rejecting stage)
+        """
+        result, rejected_by = self._run_stages(timestamp, value)
+        if rejected_by and self.consecutive_rejects >= self.max_rejects:
+            # The sensor persistently disagrees - start over and trust it again
+            # unless even a fresh filter rejects the sample
+            print(f"Filter {rejected_by} rejected {self.consecutive_rejects} samples, resetting")
+            for stage in self.stages:
+                stage.reset()
+            result, rejected_by = self._run_stages(timestamp, value, count=False)
+            self.persistent = rejected_by is not None
+
+        if rejected_by:
+            return None, rejected_by
+
+        self.persistent = False
+        self.consecutive_rejects = 0
+        self.accepted += 1
+        return result, None
+
+    def _run_stages(self, timestamp, value, count=True):
+        for stage in self.stages:
+            value = stage.process(timestamp, value)
+            if value is None:
+                if count:
+                    self.rejected[stage.name] += 1
+                    self.consecutive_rejects += 1
+                return None, stage.name
+        return value, None
+
+    def reset(self):
+        """
+        Forget the state of all stages
+        """
+        for stage in self.stages:
+            stage.reset()
+        self.consecutive_rejects = 0
+        self.persistent = False
@@ -0,0 +1,174 @@
+"""
+Bounded in-memory history of the measurements of a sensor.
+
+Every sensor keeps its last `history_size` samples in a ring buffer backed by
+two arrays of doubles, 16 bytes per sample. The arrays grow with the samples
+up to the capacity, so a sensor never needs more than 16 bytes per sample of
+the capacity, regardless of how long the daemon is running.
+
+Without `history_size` in `[general]` the capacity covers `history_seconds`
+(default 3600, the longest window the daemon queries) at one sample per
+`history_interval` seconds (default 1, the usual block interval). Longer
+periods are kept by the rollups.
+
+The timestamps are wall clock times. If the clock steps back, the samples
+that are newer than the new sample are dropped, so the timestamps stay
+ascending and the binary search over them stays valid.
+
+All queries work in place on the buffer, nothing is copied.
+"""
+
+from array import array
+import math
+
+DEFAULT_HISTORY_SECONDS = 3600
+DEFAULT_HISTORY_INTERVAL = 1
+DEFAULT_HISTORY_SIZE = DEFAULT_HISTORY_SECONDS // DEFAULT_HISTORY_INTERVAL
+# samples allocated at first, doubled when full
+INITIAL_SIZE = 64
+
+
+def history_size(config):
+    """
+    The capacity configured in `[general]`
+    """
+    conf = config['general']
+    if 'history_size' in conf:
+        return int(conf['history_size'])
+    seconds = float(conf.get('history_seconds', DEFAULT_HISTORY_SECONDS))
+    interval = float(conf.get('history_interval', DEFAULT_HISTORY_INTERVAL))
+    return max(1, math.ceil(seconds / interval))
+
+
+class History:
+    """
+    Ring buffer of (timestamp, value) samples with ascending timestamps
+    """
+
+    def __init__(self, capacity=DEFAULT_HISTORY_SIZE):
+        if capacity < 1:
+            raise RuntimeError(f"Invalid history size: {capacity}")
+        self.capacity = capacity
+        size = min(capacity, INITIAL_SIZE)
+        self._times = array('d', bytes(8 * size))
+        self._values = array('d', bytes(8 * size))
+        self._start = 0
+        self._len = 0
+        # samples dropped because the clock stepped back
+        self.dropped = 0
+
+    def __len__(self):
+        return self._len
+
+    def _pos(self, index):
+        """
+        Position in the arrays of the index-th oldest sample
+        """
+        return (self._start + index) % self.capacity
+
+    def append(self, timestamp, value):
+        """
+        Add a new sample, replacing the oldest one if the buffer is full
+        """
+        if self._len and timestamp < self._times[self._pos(self._len - 1)]:
+            # the clock stepped back, the newer samples are in the future now
+            keep = self._first_index(timestamp)
+            self.dropped += self._len - keep
+            self._len = keep
+        allocated = len(self._times)
+        if self._len == allocated < self.capacity:
+            # not wrapped yet, so the samples start at position 0
+            grow = bytes(8 * (min(self.capacity, 2 * allocated) - allocated))
+            self._times.frombytes(grow)
+            self._values.frombytes(grow)
+        pos = self._pos(self._len)
+        self._times[pos] = timestamp
+        self._values[pos] = value
+        if self._len == self.capacity:
+            self._start = (self._start + 1) % self.capacity
+        else:
+            self._len += 1
+
+    def latest(self):
+        """
+        The newest sample as (timestamp, value), or None if there is none
+        """
+        if not self._len:
+            return None
+        pos = self._pos(self._len - 1)
+        return self._times[pos], self._values[pos]
+
+    def _first_index(self, timestamp):
+        """
+        Index of the oldest sample not older than timestamp
+        """
+        low, high = 0, self._len
+        while low < high:
+            mid = (low + high) // 2
+            if self._times[self._pos(mid)] < timestamp:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def _iter(self, first, last):
+        for index in range(first, last):
+            pos = self._pos(index)
+            yield self._times[pos], self._values[pos]
+
+    def last(self, count):
+        """
+        Iterate over the newest count samples, oldest first
+        """
+        return self._iter(max(0, self._len - count), self._len)
+
+    def range(self, start, end=None):
+        """
+        Iterate over all samples with start <= timestamp < end, oldest first
+        """
+        first = self._first_index(start)
+        last = self._len if end is None else self._first_index(end)
+        return self._iter(first, last)
+
+    def window(self, seconds, now=None):
+        """
+        Iterate over the samples of the last seconds, relative to now or to the
+        newest sample
+        """
+        if now is None:
+            latest = self.latest()
+            if latest is None:
+                return iter(())
+            now = latest[0]
+        return self.range(now - seconds)
+
+    def stats(self, seconds, now=None):
+        """
+        (count, min, max, mean) of the samples of the last seconds.
+        min, max and mean are None if there are no samples in the window.
+        """
+        count = 0
+        total = 0.0
+        minimum = maximum = None
+        for _, value in self.window(seconds, now):
+            count += 1
+            total += value
+            if minimum is None or value < minimum:
+                minimum = value
+            if maximum is None or value > maximum:
+                maximum = value
+        if not count:
+            return 0, None, None, None
+        return count, minimum, maximum, total / count
+
+    def min(self, seconds, now=None):
+        """ Minimum over the last seconds """
+        return self.stats(seconds, now)[1]
+
+    def max(self, seconds, now=None):
+        """ Maximum over the last seconds """
+        return self.stats(seconds, now)[2]
+
+    def mean(self, seconds, now=None):
+        """ Average over the last seconds """
+        return self.stats(seconds, now)[3]
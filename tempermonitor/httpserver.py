@@ -0,0 +1,164 @@
+"""
+Minimal HTTP/1.1 server running inside the daemons event loop.
+
+It only supports what the metrics and API endpoints need: GET and HEAD requests
+without body, keep-alive connections and a fixed routing table.
+
+A route handler receives the Request and returns a Response. It is called
+directly in the event loop, so it must not block. A handler may also be a
+coroutine function.
+"""
+
+import asyncio
+import time
+from urllib.parse import urlsplit, parse_qs
+
+from .timing import STAGES
+
+REASONS = {
+    200: "OK",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    431: "Request Header Fields Too Large",
+    500: "Internal Server Error",
+}
+
+
+class Request:
+    """
+    A parsed HTTP request
+    """
+
+    def __init__(self, method, target, headers):
+        self.method = method
+        url = urlsplit(target)
+        self.path = url.path
+        self.query = parse_qs(url.query)
+        # header names are lower case
+        self.headers = headers
+
+
+class Response:
+    """
+    The answer of a route handler
+    """
+
+    def __init__(self, body=b"", status=200, content_type="text/plain; charset=utf-8",
+                 headers=None):
+        self.body = body
+        self.status = status
+        self.headers = {'Content-Type': content_type}
+        if headers:
+            self.headers.update(headers)
+
+
+class HTTPServer:
+    """
+    Serve the given routes (path -> handler) on host:port or a unix socket
+    """
+
+    def __init__(self, routes, host='localhost', port=None, path=None):
+        self.routes = routes
+        self.host = host
+        self.port = port
+        self.path = path
+        self._server = None
+        self.requests = 0
+
+    async def start(self):
+        """
+        Start listening
+        """
+        if self.path:
+            self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+            print(f"started http server on {self.path}")
+        else:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+            print(f"started http server on {self.host}:{self.port}")
+
+    async def stop(self):
+        """
+        Stop listening
+        """
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                start = time.perf_counter()
+                response = await self._dispatch(request)
+                keep_alive = request.headers.get('connection', '').lower() != 'close'
+                self._write_response(writer, request, response, keep_alive)
+                await writer.drain()
+                STAGES.observe('http_request', time.perf_counter() - start)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader):
+        try:
+            line = await reader.readline()
+        except ValueError:
+            # readline turns a line longer than the stream limit into ValueError
+            return Request('TOO_LARGE', '/', {'connection': 'close'})
+        if not line:
+            return None
+        try:
+            method, target, _ = line.decode('ascii').split(' ', 2)
+        except (UnicodeError, ValueError):
+            return Request('INVALID', '/', {})
+
+        headers = {}
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:
+                return Request('TOO_LARGE', '/', {'connection': 'close'})
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return Request(method, target, headers)
+
+    async def _dispatch(self, request):
+        if request.method == 'INVALID':
+            return Response(b"Bad Request\n", status=400)
+        if request.method == 'TOO_LARGE':
+            return Response(b"Request Header Fields Too Large\n", status=431)
+        if request.method not in ('GET', 'HEAD'):
+            return Response(b"Method Not Allowed\n", status=405)
+        handler = self.routes.get(request.path)
+        if handler is None:
+            return Response(b"Not Found\n", status=404)
+        self.requests += 1
+        try:
+            if asyncio.iscoroutinefunction(handler):
+                return await handler(request)
+            return handler(request)
+        except Exception as exc:
+            print(f"Error handling {request.path}: {exc!r}")
+            return Response(b"Internal Server Error\n", status=500)
+
+    @staticmethod
+    def _write_response(writer, request, response, keep_alive):
+        head = ["HTTP/1.1 {} {}".format(response.status, REASONS.get(response.status, ""))]
+        headers = dict(response.headers)
+        headers['Content-Length'] = str(len(response.body))
+        if not keep_alive:
+            headers['Connection'] = 'close'
+        head += ["{}: {}".format(name, value) for name, value in headers.items()]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1'))
+        if request.method != 'HEAD':
+            writer.write(response.body)
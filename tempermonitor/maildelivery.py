@@ -0,0 +1,300 @@
+"""
+Deliver mails in the background without blocking the event loop.
+
+smtplib is blocking, so all SMTP traffic is done in a single executor thread.
+The connection to the mail server is kept open and reused for the following
+mails, it is only closed after being idle for `smtp_idle_timeout` seconds.
+Failed deliveries are retried with exponential backoff. Every mail is written
+to the spool directory before it is queued and only removed once it has been
+delivered, so pending mails survive a restart of the daemon.
+
+Configuration in the `[mail]` section:
+
+* smtp_host: mail server (default mail.stusta.mhn.de)
+* smtp_port: port of the mail server (default 25)
+* smtp_idle_timeout: close an idle connection after this many seconds (default 60)
+* max_retry_delay: upper bound for the retry backoff in seconds (default 600)
+* spool_dir: directory for undelivered mails, empty to disable spooling
+  (default /var/spool/tempermonitor)
+
+A worker of the supervisor uses a MailRelay instead (`delivery_socket`): it
+hands every mail as one JSON line to the supervisor, which spools and delivers
+it with its own MailDelivery and answers `OK`. Mails are kept and retried until
+the supervisor has acknowledged them.
+"""
+
+import asyncio
+import json
+from collections import deque
+import os
+import smtplib
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import Metric
+from .timing import STAGES
+
+
+class MailDelivery:
+    """
+    Queue of outgoing mails and the worker delivering them
+    """
+
+    def __init__(self, config, loop):
+        conf = config['mail']
+        self.host = conf.get('smtp_host', 'mail.stusta.mhn.de')
+        self.port = int(conf.get('smtp_port', 25))
+        self.idle_timeout = float(conf.get('smtp_idle_timeout', 60))
+        self.max_retry_delay = float(conf.get('max_retry_delay', 600))
+        self.spool_dir = conf.get('spool_dir', '/var/spool/tempermonitor')
+
+        self.loop = loop
+        self.delivered = 0
+        self.failed = 0
+        self.retries = 0
+
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._smtp = None
+        self._task = None
+
+        if self.spool_dir:
+            try:
+                os.makedirs(self.spool_dir, exist_ok=True)
+            except OSError as exc:
+                print(f"Cannot create mail spool {self.spool_dir}, spooling disabled: {exc}")
+                self.spool_dir = None
+
+    def start(self):
+        """
+        Requeue the spooled mails and start the delivery worker
+        """
+        if self.spool_dir:
+            for filename in sorted(os.listdir(self.spool_dir)):
+                if not filename.endswith('.json'):
+                    continue
+                path = os.path.join(self.spool_dir, filename)
+                try:
+                    with open(path) as spoolfile:
+                        mail = json.load(spoolfile)
+                except (OSError, ValueError) as exc:
+                    print(f"Ignoring broken spooled mail {path}: {exc}")
+                    continue
+                print(f"Requeueing spooled mail {filename}")
+                self._queue.put_nowait((path, mail))
+
+        self._task = self.loop.create_task(self.run())
+
+    async def stop(self):
+        """
+        Stop the worker and close the connection, undelivered mails stay spooled
+        """
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.loop.run_in_executor(self._executor, self._close)
+        self._executor.shutdown()
+
+    def submit(self, sender, recipients, message):
+        """
+        Spool the mail and queue it for delivery
+        """
+        mail = {
+            'sender': sender,
+            'recipients': recipients,
+            'message': message,
+        }
+        path = None
+        if self.spool_dir:
+            path = os.path.join(self.spool_dir, f"{time.time_ns()}.json")
+            try:
+                with open(path + '.tmp', 'w') as spoolfile:
+                    json.dump(mail, spoolfile)
+                os.replace(path + '.tmp', path)
+            except OSError as exc:
+                print(f"Could not spool mail: {exc}")
+                path = None
+
+        self._queue.put_nowait((path, mail))
+
+    @property
+    def pending(self):
+        """
+        Number of mails waiting for delivery
+        """
+        return self._queue.qsize()
+
+    async def run(self):
+        """
+        Deliver the queued mails one after another
+        """
+        while True:
+            try:
+                path, mail = await asyncio.wait_for(self._queue.get(),
+                                                    timeout=self.idle_timeout)
+            except asyncio.TimeoutError:
+                await self.loop.run_in_executor(self._executor, self._close)
+                continue
+
+            delay = 1
+            while True:
+                start = time.perf_counter()
+                try:
+                    await self.loop.run_in_executor(self._executor, self._deliver, mail)
+                    self.delivered += 1
+                    STAGES.observe('mail_send', time.perf_counter() - start)
+                    break
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused) as exc:
+                    print(f"Mail rejected by {self.host}, dropping it: {exc}")
+                    self.failed += 1
+                    break
+                except smtplib.SMTPResponseException as exc:
+                    if exc.smtp_code >= 500:
+                        print(f"Mail rejected by {self.host}, dropping it: {exc}")
+                        self.failed += 1
+                        break
+                    print(f"Mail delivery failed, retrying in {delay}s: {exc}")
+                except (smtplib.SMTPException, OSError) as exc:
+                    print(f"Mail delivery failed, retrying in {delay}s: {exc}")
+
+                self.retries += 1
+                await self.loop.run_in_executor(self._executor, self._close)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+
+            if path:
+                try:
+                    os.unlink(path)
+                except OSError as exc:
+                    print(f"Could not remove spooled mail {path}: {exc}")
+
+    def _deliver(self, mail):
+        """
+        Send one mail, reusing the open connection if it is still alive.
+        Runs in the executor thread.
+        """
+        if self._smtp is not None:
+            try:
+                self._smtp.noop()
+            except (smtplib.SMTPException, OSError):
+                self._close()
+
+        if self._smtp is None:
+            self._smtp = smtplib.SMTP(self.host, self.port, timeout=30)
+
+        self._smtp.sendmail(mail['sender'], mail['recipients'], mail['message'])
+
+    def _close(self):
+        """
+        Close the connection to the mail server. Runs in the executor thread.
+        """
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self._smtp.close()
+        self._smtp = None
+
+    def metrics(self):
+        """
+        Delivery counters and the number of waiting mails
+        """
+        yield Metric('tempermonitor_mail_pending', "Mails waiting for delivery",
+                     'gauge', {}, self.pending)
+        yield Metric('tempermonitor_mail_delivered', "Mails delivered",
+                     'counter', {}, self.delivered)
+        yield Metric('tempermonitor_mail_failed', "Mails rejected by the mail server",
+                     'counter', {}, self.failed)
+        yield Metric('tempermonitor_mail_retries', "Failed delivery attempts that were retried",
+                     'counter', {}, self.retries)
+
+
+class MailRelay:
+    """
+    Hand the mails to the delivery of the supervisor
+    """
+
+    def __init__(self, config, loop):
+        self.path = config['mail']['delivery_socket']
+        self.retry_delay = float(config['mail'].get('relay_retry_delay', 5))
+        self.loop = loop
+        self.relayed = 0
+        self.retries = 0
+
+        self._mails = deque()
+        self._wakeup = asyncio.Event()
+        self._reader, self._writer = (None, None)
+        self._task = None
+
+    def start(self):
+        self._task = self.loop.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._close()
+        if self._mails:
+            print(f"Dropping {len(self._mails)} mails not handed to the supervisor")
+
+    def submit(self, sender, recipients, message):
+        self._mails.append({
+            'sender': sender,
+            'recipients': recipients,
+            'message': message,
+        })
+        self._wakeup.set()
+
+    @property
+    def pending(self):
+        return len(self._mails)
+
+    async def run(self):
+        """
+        Hand over the mails one after another, a mail is only removed once the
+        supervisor has acknowledged it
+        """
+        while True:
+            if not self._mails:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            start = time.perf_counter()
+            try:
+                if self._writer is None:
+                    self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+                self._writer.write(json.dumps(self._mails[0]).encode('utf-8') + b"\n")
+                await self._writer.drain()
+                answer = await asyncio.wait_for(self._reader.readline(), timeout=30)
+                if answer.strip() != b"OK":
+                    raise ConnectionError(f"unexpected answer {answer!r}")
+                self._mails.popleft()
+                self.relayed += 1
+                STAGES.observe('mail_relay', time.perf_counter() - start)
+            except (OSError, ConnectionError, asyncio.TimeoutError) as exc:
+                print(f"Could not hand mail to the supervisor, retrying in "
+                      f"{self.retry_delay}s: {exc!r}")
+                self.retries += 1
+                self._close()
+                await asyncio.sleep(self.retry_delay)
+
+    def _close(self):
+        if self._writer:
+            self._writer.close()
+        self._reader, self._writer = (None, None)
+
+    def metrics(self):
+        yield Metric('tempermonitor_mail_pending', "Mails waiting for delivery",
+                     'gauge', {}, self.pending)
+        yield Metric('tempermonitor_mail_relayed', "Mails handed to the supervisor",
+                     'counter', {}, self.relayed)
+        yield Metric('tempermonitor_mail_retries', "Failed attempts that were retried",
+                     'counter', {}, self.retries)
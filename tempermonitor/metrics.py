@@ -0,0 +1,13 @@
+"""
+Exporter independent description of the daemons internal metrics.
+
+Everything that wants to expose numbers (the event bus, plugins, sensors)
+yields Metric tuples, the exporters (e.g. the prometheus plugin) turn them
+into their own format.
+"""
+
+from collections import namedtuple
+
+# kind is "gauge", "counter" or "histogram" (the value is a timing.Histogram),
+# labels is a dict of label name to value
+Metric = namedtuple('Metric', ['name', 'documentation', 'kind', 'labels', 'value'])
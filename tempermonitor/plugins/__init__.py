@@ -1,7 +1,35 @@
+"""
+Plugin registry and discovery.
+
+The plugins shipped with the daemon are found by their module path, all other
+plugins through the `tempermonitor.plugins` entry points of the installed
+packages, which are only read if such a plugin is enabled. A plugin module is
+only imported once its plugin is enabled, so the dependencies of unused plugins
+(e.g. prometheus_client for the prometheus plugin) are never loaded.
+"""
+
 from abc import ABCMeta
+import importlib
+import re
 
 PLUGINS = dict()
 
+ENTRY_POINT_GROUP = 'tempermonitor.plugins'
+
+# name -> module of the plugins shipped with the daemon
+BUILTIN_PLUGINS = {
+    'api': 'tempermonitor.plugins.api',
+    'collectd': 'tempermonitor.plugins.collectd',
+    'mail': 'tempermonitor.plugins.mail',
+    'prometheus': 'tempermonitor.plugins.prometheus',
+    'warnings': 'tempermonitor.plugins.warnings',
+}
+
+# names of the aggregated stats sent with send_stats_graph
+stats_name_re = re.compile(r'^temperature-(?P<group>\w+)-(?P<type>\w+)$')
+
+_entry_points = None
+
 
 class PluginMeta(ABCMeta):
     """
@@ -23,5 +51,39 @@ class Plugin(metaclass=PluginMeta):
         return self.__class__.__name__.lower()
 
 
-# import all plugins so metaclass can populare PLUGINS dict
-from . import collectd, mail, prometheus, warnings
+def entry_points():
+    """
+    name -> entry point of all installed plugins, read once
+    """
+    global _entry_points
+    if _entry_points is None:
+        _entry_points = {}
+        try:
+            from importlib import metadata
+        except ImportError:
+            # python < 3.8, only the builtin plugins are available
+            return _entry_points
+        found = metadata.entry_points()
+        if hasattr(found, 'select'):
+            found = found.select(group=ENTRY_POINT_GROUP)
+        else:
+            found = found.get(ENTRY_POINT_GROUP, [])
+        for entry_point in found:
+            _entry_points.setdefault(entry_point.name, entry_point)
+    return _entry_points
+
+
+def find_plugin(name):
+    """
+    Return the plugin class with the given name, importing its module if
+    needed, or None if there is no such plugin
+    """
+    if name in PLUGINS:
+        return PLUGINS[name]
+    if name in BUILTIN_PLUGINS:
+        importlib.import_module(BUILTIN_PLUGINS[name])
+        return PLUGINS.get(name)
+    entry_point = entry_points().get(name)
+    if entry_point is not None:
+        return entry_point.load()
+    return None
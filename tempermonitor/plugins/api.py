@@ -0,0 +1,223 @@
+import hashlib
+import json
+
+from . import Plugin, stats_name_re
+from ..httpserver import HTTPServer, Response
+from ..metrics import Metric
+
+
+class Snapshot:
+    """
+    The serialized JSON of one endpoint, only rebuilt when the state changed
+    """
+
+    def __init__(self, build):
+        self.build = build
+        self.generation = None
+        self.body = b""
+        self.etag = None
+        self.builds = 0
+
+    def get(self, generation):
+        if generation != self.generation:
+            self.body = json.dumps(self.build(), sort_keys=True, separators=(',', ':'),
+                                   default=str).encode('utf-8')
+            self.etag = '"{}"'.format(hashlib.blake2b(self.body, digest_size=8).hexdigest())
+            self.generation = generation
+            self.builds += 1
+        return self
+
+
+class Api(Plugin):
+    """
+    Serve the current state as JSON for dashboards and scripts.
+
+    * /api/sensors: the last measurement of every sensor
+    * /api/groups: the group statistics and the last closed rollups
+    * /api/buses: the link state of the serial buses
+    * /api/alerts: warnings and errors raised within `alert_timeout` seconds
+    * /api: all of the above
+
+    The state changes at most a few times per block, so the serialized
+    responses are cached until it changes again and carry an ETag. A client
+    sending it back in If-None-Match gets an empty 304.
+    """
+
+    def __init__(self, monitor):
+        self.monitor = monitor
+        self.config = monitor.config
+
+        # group -> type -> (time, value)
+        self.stats = {}
+        # (call, source, name) -> alert
+        self.alerts = {}
+        self.generation = 0
+        self.block_time = None
+        self.not_modified = 0
+        self.configure()
+
+        self.snapshots = {
+            '/api/sensors': Snapshot(self.sensors_state),
+            '/api/groups': Snapshot(self.groups_state),
+            '/api/alerts': Snapshot(self.alerts_state),
+            '/api/buses': Snapshot(self.buses_state),
+            '/api': Snapshot(lambda: {'sensors': self.sensors_state(),
+                                      'groups': self.groups_state(),
+                                      'alerts': self.alerts_state(),
+                                      'buses': self.buses_state()}),
+        }
+        self.server = self._create_server()
+
+    async def start(self):
+        await self.server.start()
+
+    @staticmethod
+    def check_config(config):
+        conf = config['api']
+        float(conf.get('alert_timeout', 300))
+        if not conf.get('path'):
+            int(conf.get('port', 9200))
+
+    def configure(self):
+        conf = self.config['api']
+        self.alert_timeout = float(conf.get('alert_timeout', 300))
+
+    def _create_server(self):
+        conf = self.config['api']
+        routes = {path: self.serve for path in self.snapshots}
+        if conf.get('path'):
+            return HTTPServer(routes, path=conf['path'])
+        return HTTPServer(routes, host=conf.get('address', 'localhost'),
+                          port=int(conf.get('port', 9200)))
+
+    async def reload(self):
+        """
+        Apply the new settings, the server is only restarted if its address changed
+        """
+        self.configure()
+        server = self._create_server()
+        if (server.host, server.port, server.path) != \
+           (self.server.host, self.server.port, self.server.path):
+            await self.server.stop()
+            self.server = server
+            await self.server.start()
+        self.generation += 1
+
+    async def teardown(self):
+        await self.server.stop()
+
+    def serve(self, request):
+        snapshot = self.snapshots[request.path].get(self.generation)
+        headers = {'ETag': snapshot.etag, 'Cache-Control': 'no-cache'}
+        match = request.headers.get('if-none-match')
+        if match and (match.strip() == '*' or snapshot.etag in
+                      (tag.strip().replace('W/', '', 1) for tag in match.split(','))):
+            self.not_modified += 1
+            return Response(status=304, content_type='application/json', headers=headers)
+        return Response(snapshot.body, content_type='application/json', headers=headers)
+
+    def sensors_state(self):
+        return {
+            'time': self.block_time,
+            'sensors': {
+                sensor.name: {
+                    'owid': owid,
+                    'temperature': sensor.temperature,
+                    'valid': sensor.valid,
+                    'last_update': sensor.last_update,
+                }
+                for owid, sensor in self.monitor.sensors.items()
+            },
+        }
+
+    def groups_state(self):
+        stats = {group: {stattype: {'time': stattime, 'value': statval}
+                         for stattype, (stattime, statval) in types.items()}
+                 for group, types in self.stats.items()}
+        rollups = {}
+        for resolution, (start, _, groups) in self.monitor.rollups.latest.items():
+            rollups[str(resolution)] = {
+                'start': start,
+                'groups': {group: {'min': bucket.min, 'max': bucket.max,
+                                   'avg': bucket.avg, 'count': bucket.count}
+                           for group, bucket in groups.items()},
+            }
+        return {'stats': stats, 'rollups': rollups}
+
+    def buses_state(self):
+        return {
+            bus.name: {
+                'port': bus.port,
+                'connected': bus.connected,
+                'state': bus.link_state,
+                'since': bus.link_state_since,
+                'losses': bus.link_losses,
+            }
+            for bus in self.monitor.buses
+        }
+
+    def alerts_state(self):
+        return {'alerts': sorted(self.alerts.values(),
+                                 key=lambda alert: alert['last'], reverse=True)}
+
+    def metrics(self):
+        for path, snapshot in self.snapshots.items():
+            yield Metric('tempermonitor_api_snapshot_builds',
+                         "Serializations of the API responses", 'counter',
+                         {'path': path}, snapshot.builds)
+        yield Metric('tempermonitor_api_requests', "Requests to the API", 'counter',
+                     {}, self.server.requests)
+        yield Metric('tempermonitor_api_not_modified',
+                     "API requests answered with 304 Not Modified", 'counter',
+                     {}, self.not_modified)
+
+    def _alert(self, call, source, name, details, urgent=False):
+        now = self.monitor.clock()
+        key = (call, source, name)
+        alert = self.alerts.get(key)
+        if alert is None:
+            alert = self.alerts[key] = {'type': call, 'source': source, 'name': name,
+                                        'first': now, 'count': 0}
+        alert.update(last=now, urgent=urgent, details=details)
+        alert['count'] += 1
+        self.generation += 1
+
+    def sensor_update(self):
+        """
+        A block was stored, forget alerts that were not raised again
+        """
+        now = self.block_time = self.monitor.clock()
+        for key, alert in list(self.alerts.items()):
+            if now - alert['last'] > self.alert_timeout:
+                del self.alerts[key]
+        self.generation += 1
+
+    def send_stats_graph(self, graph, stattype, stattime, statval):
+        m = stats_name_re.match(stattype)
+        if not m:
+            return
+        self.stats.setdefault(m.group('group'), {})[m.group('type')] = (stattime, statval)
+        self.generation += 1
+
+    def temperature_warning(self, source, urgent=False, **kwargs):
+        name = kwargs.get('name') or "{}-{}".format(kwargs.get('name1'), kwargs.get('name2'))
+        self._alert('temperature_warning', source, name, kwargs, urgent)
+
+    def err_nodata(self, **kwargs):
+        self._alert('err_nodata', None, kwargs.get('bus'), kwargs)
+
+    def err_no_valid_data(self, **kwargs):
+        self._alert('err_no_valid_data', None, kwargs.get('bus'), kwargs)
+
+    def link_state(self, **kwargs):
+        self.generation += 1
+
+    def err_unknown_sensor(self, **kwargs):
+        self._alert('err_unknown_sensor', None, kwargs.get('owid'), kwargs)
+
+    def err_problem_sensor(self, **kwargs):
+        self._alert('err_problem_sensor', None, kwargs.get('name'), kwargs)
+
+    def err_missed_sensor(self, **kwargs):
+        self._alert('err_missed_sensor', None, kwargs.get('name'), kwargs)
+
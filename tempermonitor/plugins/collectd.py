@@ -1,35 +1,172 @@
 import asyncio
 import time
+from collections import Counter, deque
 
 from . import Plugin
+from ..collectdnet import NetworkClient, network_settings
+from ..deadband import Deadband
+from ..metrics import Metric
+from ..timing import STAGES
 
 
 class Collectd(Plugin):
     """
     Implements a super simple collectd interface for only sending temperature data
+
+    Values are not sent one by one: they are collected for `batch_delay` seconds
+    and then written as one batch of PUTVAL commands. The acks are read by a
+    separate task and matched to the values in the order they were sent.
+
+    With `transport=network` the batch is sent instead in the binary network
+    protocol as UDP datagrams to `server`:`server_port`, optionally signed
+    (see collectdnet.py).
+
+    With a `deadband` a sensor value is only sent if it moved by more than the
+    deadband since it was last sent or if that is `heartbeat` seconds ago. The
+    deadband can be overridden in the section of a sensor, `stats_deadband`
+    applies to the aggregated stats.
+
+    The rollups of the resolutions listed in `rollups` (seconds) are sent as
+    `tail-rollup-<resolution>/temperature-<sensor or group>-<min|max|avg>`.
     """
 
     def __init__(self, monitor):
         self.config = monitor.config
-        self.path = self.config['collectd']['socketpath']
-        self._reader, self._writer = (None, None)
-        asyncio.run(self.reconnect())
-
         self.monitor = monitor
+        self.path = None
+        self.network = None
+        self._reader, self._writer = (None, None)
+        self._ack_task = None
 
         self.last_store = 0
 
+        # values waiting to be written: (identifier, interval, timestamp, value)
+        self._batch = []
+        # identifiers of the written values, waiting for their ack
+        self._inflight = deque()
+        self._flush_handle = None
+        self._flush_lock = asyncio.Lock()
+
+        self.sent = 0
+        self.acked = 0
+        self.failures = Counter()
+
+        self.deadband = Deadband(60)
+        self.configure()
+
+    @staticmethod
+    def check_config(config):
+        """
+        Raise if the settings of the config are invalid, nothing is applied
+        """
+        conf = config['collectd']
+        transport = conf.get('transport', 'unixsock')
+        if transport == 'network':
+            network_settings(conf)
+        elif transport == 'unixsock':
+            conf['socketpath']
+        else:
+            raise RuntimeError(f"Unknown collectd transport {transport}")
+        float(conf.get('batch_delay', 0.1))
+        float(conf.get('heartbeat', 60))
+        int(conf.get('max_pending', 10000))
+        [int(value) for value in conf.get('rollups', '').split(',') if value.strip()]
+        for section in config.sections():
+            for option in ('deadband', 'stats_deadband'):
+                if config[section].get(option, '').strip():
+                    float(config[section][option])
+
+    def configure(self):
+        """
+        Read the settings, a changed socket is connected on the next write
+        """
+        self.check_config(self.config)
+        transport = self.config['collectd'].get('transport', 'unixsock')
+        if transport == 'network':
+            network = self.network or NetworkClient(self.monitor.loop)
+            network.configure(self.config['collectd'])
+            path = None
+        elif transport == 'unixsock':
+            network = None
+            path = self.config['collectd']['socketpath']
+        else:
+            raise RuntimeError(f"Unknown collectd transport {transport}")
+
+        if self.path is not None and path != self.path:
+            self._close()
+        self.path = path
+        if self.network is not None and network is not self.network:
+            self.network.close()
+        self.network = network
+        self.batch_delay = float(self.config['collectd'].get('batch_delay', 0.1))
+        self.max_pending = int(self.config['collectd'].get('max_pending', 10000))
+
+        def deadband(section, option, default=None):
+            value = self.config[section].get(option, '').strip()
+            return float(value) if value else default
+
+        self.rollups = [int(value) for value in
+                        self.config['collectd'].get('rollups', '').split(',') if value.strip()]
+
+        self.deadband.heartbeat = float(self.config['collectd'].get('heartbeat', 60))
+        self.sensor_deadband = deadband('collectd', 'deadband')
+        self.stats_deadband = deadband('collectd', 'stats_deadband', self.sensor_deadband)
+        self.sensor_deadbands = {
+            owid: deadband(owid, 'deadband', self.sensor_deadband)
+            for owid in self.monitor.sensors
+        }
+
+    def reload(self):
+        self.configure()
+        # sensors may have been renamed, start over
+        self.deadband.reset()
+
     async def reconnect(self):
         """
         optionally close and then reconnect to the unix socket
         """
-        if self._writer:
-            self._writer.close()
+        self._close()
 
         self._reader, self._writer = await asyncio.open_unix_connection(
             path=self.path)
+        self._ack_task = self.monitor.loop.create_task(self._read_acks(self._reader))
 
-    async def _send(self, identifier, interval, timestamp, value):
+    def _close(self):
+        """
+        Close the connection, the values still waiting for an ack have failed
+        """
+        if self._ack_task:
+            self._ack_task.cancel()
+            self._ack_task = None
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+        for identifier in self._inflight:
+            self.failures[identifier] += 1
+        self._inflight.clear()
+
+    async def _read_acks(self, reader):
+        """
+        Match every response line of collectd to the oldest unacknowledged value
+        """
+        while True:
+            line = await reader.readline()
+            if not line:
+                print("Connection reset. reconnecting on next write")
+                break
+            identifier = self._inflight.popleft() if self._inflight else None
+            line = line.decode('utf-8').strip()
+            if line.startswith('-'):
+                # collectd responds with a negative status on errors
+                print("Collectd rejected {}: {}".format(identifier, line))
+                self.failures[identifier] += 1
+            else:
+                self.acked += 1
+
+        self._ack_task = None
+        self._close()
+
+    def _send(self, identifier, interval, timestamp, value):
         """
         The collectd naming convention is:
          host "/" plugin ["-" plugin instance] "/" type ["-" type instance]
@@ -39,59 +176,156 @@ class Collectd(Plugin):
          - plugin-instance: the graph
          - type the line in the graph
          - type instance : if there are more than one "temperature"s
+
+        The value is only queued and written with the next batch.
         """
+        self._batch.append((identifier, interval, timestamp, value))
 
-        data = "PUTVAL \"{}/{}\" interval={} {}:{}\n".format(
-            self.config['collectd']['hostname'],
-            identifier,
-            interval,
-            timestamp,
-            value)
-        try:
-            #print("Sending data:", data.strip())
-            self._writer.write(data.encode('utf-8'))
-            await self._writer.drain()
-        except:
-            await self.reconnect()
-            return
+        if len(self._batch) > self.max_pending:
+            dropped = self._batch.pop(0)[0]
+            self.failures[dropped] += 1
+
+        if self._flush_handle is None:
+            self._flush_handle = self.monitor.loop.call_later(
+                self.batch_delay,
+                lambda: self.monitor.loop.create_task(self.flush()))
+
+    async def flush(self):
+        """
+        Write all queued values in one go
+        """
+        self._flush_handle = None
+        async with self._flush_lock:
+            batch, self._batch = self._batch, []
+            if not batch:
+                return
+            if self.network is not None:
+                await self._flush_network(batch)
+                return
+
+            if len(self._inflight) > self.max_pending:
+                print("Collectd does not respond. reconnecting")
+                self._close()
+
+            start = time.perf_counter()
+            try:
+                if self._writer is None:
+                    await self.reconnect()
+                hostname = self.config['collectd']['hostname']
+                self._writer.write("".join(
+                    "PUTVAL \"{}/{}\" interval={} {}:{}\n".format(hostname, *value)
+                    for value in batch).encode('utf-8'))
+                self._inflight.extend(value[0] for value in batch)
+                self.sent += len(batch)
+                await self._writer.drain()
+                STAGES.observe('collectd_flush', time.perf_counter() - start)
+            except OSError as exc:
+                print("Could not write to collectd: {}".format(exc))
+                if self._writer is None:
+                    # Not written at all - keep the values for the next batch
+                    self._batch[:0] = batch[-self.max_pending:]
+                else:
+                    self._close()
 
+    async def _flush_network(self, batch):
+        """
+        Send the batch as datagrams, there are no acks
+        """
+        start = time.perf_counter()
         try:
-            line = await asyncio.wait_for(self._reader.readline(), 1)
-        except asyncio.TimeoutError:
-            print("Collectd did not respond.")
-            return
-        line = line.decode('utf-8').strip()
-        if not line:
-            print("Connection reset. reconnecting")
-            await self.reconnect()
-        else:
-            pass
-            # print("recv:", line)
+            await self.network.send(batch)
+            self.sent += len(batch)
+            STAGES.observe('collectd_flush', time.perf_counter() - start)
+        except OSError as exc:
+            print("Could not send to collectd: {}".format(exc))
+            self.network.close()
+            self._batch[:0] = batch[-self.max_pending:]
+
+    async def teardown(self):
+        """
+        Write the last batch and close the connection
+        """
+        if self._flush_handle:
+            self._flush_handle.cancel()
+        await self.flush()
+        self._close()
+        if self.network is not None:
+            self.network.close()
 
-    async def send_sensor_values(self, sensor):
+    def metrics(self):
+        yield Metric('tempermonitor_collectd_values_sent', "Values written to collectd",
+                     'counter', {}, self.sent)
+        yield Metric('tempermonitor_collectd_values_acked', "Values acknowledged by collectd",
+                     'counter', {}, self.acked)
+        yield Metric('tempermonitor_collectd_values_inflight',
+                     "Values waiting for an ack from collectd", 'gauge', {}, len(self._inflight))
+        yield Metric('tempermonitor_collectd_values_queued',
+                     "Values waiting for the next batch", 'gauge', {}, len(self._batch))
+        if self.network is not None:
+            yield Metric('tempermonitor_collectd_packets_sent',
+                         "Datagrams sent to the collectd network plugin", 'counter', {},
+                         self.network.packets)
+            yield Metric('tempermonitor_collectd_bytes_sent',
+                         "Bytes sent to the collectd network plugin", 'counter', {},
+                         self.network.bytes)
+            yield Metric('tempermonitor_collectd_send_errors',
+                         "Errors reported for the sent datagrams", 'counter', {},
+                         self.network.errors)
+        for identifier, count in self.failures.items():
+            yield Metric('tempermonitor_collectd_value_failures',
+                         "Values that could not be stored in collectd", 'counter',
+                         {'value': str(identifier)}, count)
+        for kind, count in self.deadband.emitted.items():
+            yield Metric('tempermonitor_collectd_values_emitted',
+                         "Values that passed the deadband", 'counter', {'kind': kind}, count)
+        for kind, count in self.deadband.suppressed.items():
+            yield Metric('tempermonitor_collectd_values_suppressed',
+                         "Values suppressed by the deadband", 'counter', {'kind': kind}, count)
+
+    def send_sensor_values(self, sensor, deadband=None):
         """
         Store the temperature to collectd for fancy graphs
         """
-        await self._send("tail-temperature/temperature-{}".format(sensor.name),
-                         int(self.config['collectd']['interval']),
-                         int(sensor.last_update),
-                         sensor.temperature)
+        identifier = "tail-temperature/temperature-{}".format(sensor.name)
+        if not self.deadband.check(identifier, sensor.last_update, sensor.temperature,
+                                   deadband, 'sensor'):
+            return
+        self._send(identifier,
+                   int(self.config['collectd']['interval']),
+                   int(sensor.last_update),
+                   sensor.temperature)
 
     ## Plugin Callbacks ##
-    async def send_stats_graph(self, graph, stattype, stattime, statval):
+    def send_stats_graph(self, graph, stattype, stattime, statval):
         """
         to be called as a plugin callback to store stuff into collectd
         """
-        await self._send("tail-{}/{}".format(graph, stattype),
-                         int(self.config['collectd']['interval']),
-                         int(stattime),
-                         statval)
+        identifier = "tail-{}/{}".format(graph, stattype)
+        if not self.deadband.check(identifier, stattime, statval,
+                                   self.stats_deadband, 'stats'):
+            return
+        self._send(identifier,
+                   int(self.config['collectd']['interval']),
+                   int(stattime),
+                   statval)
+
+    def rollup_closed(self, resolution, start, sensors, groups):
+        """
+        Store the closed rollups of the selected resolutions
+        """
+        if resolution not in self.rollups:
+            return
+        for name, bucket in list(sensors.items()) + list(groups.items()):
+            for stat in ('min', 'max', 'avg'):
+                self._send("tail-rollup-{}/temperature-{}-{}".format(resolution, name, stat),
+                           resolution, int(start + resolution), getattr(bucket, stat))
 
-    async def sensor_update(self):
+    def sensor_update(self):
         """
         Receive sensor data to store them regularely into collectd
         """
-        for sensor in self.monitor.sensors.values():
+        for owid, sensor in self.monitor.sensors.items():
             if sensor.valid:
-                await self.send_sensor_values(sensor)
+                self.send_sensor_values(
+                    sensor, self.sensor_deadbands.get(owid, self.sensor_deadband))
         self.last_store = time.time()
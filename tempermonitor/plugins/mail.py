@@ -1,9 +1,14 @@
 import time
+from collections import OrderedDict
 from email.mime.text import MIMEText
 from email.utils import formatdate
-import smtplib
 
 from . import Plugin
+from ..maildelivery import MailDelivery, MailRelay
+from ..metrics import Metric
+
+# distinct notifications listed in one digest, the rest is only counted
+DIGEST_MAX_ENTRIES = 50
 
 UNKNOWN_SENSOR_SUBJECT = "WARNING: Unconfigured Sensor ID: {owid}"
 UNKNOWN_SENSOR_BODY = """Hello Guys,
@@ -70,10 +75,33 @@ please check if the controller is going haywire.
 I will try to fix this issue by reconnecting...
 
 
+Regards, Temperature
+"""
+
+LINK_RECOVERED_SUBJECT = "INFO: Serial bus {bus} is back"
+LINK_RECOVERED_BODY = """Helly guys,
+
+The serial bus {bus} delivers valid data again after {downtime:.0f} seconds.
+
+Regards, Temperature
+"""
+
+DIGEST_SUBJECT = "WARNING: {count} notifications from the temperature monitoring"
+DIGEST_BODY = """Hello Guys,
+
+These notifications were raised within the last {window:.0f} seconds:
+
+{summary}
+
+{details}
+
 Regards, Temperature
 """
 
 SENSOR_TEMPERATURE_WARNING_SUBJECT = "Temperaturwarnung Serverraum"
+# early warnings have their own subject, so their rate limit does not hold
+# back the warning once the threshold is actually crossed
+SENSOR_TEMPERATURE_TREND_SUBJECT = "Temperaturwarnung Serverraum (Trend)"
 SENSOR_TEMPERATURE_WARNING_BODY = """Hi Guys,
 
 Die Temperaturen im Serverraum werden langsam Bedenklich:
@@ -82,7 +110,7 @@ Die Temperaturen im Serverraum werden langsam Bedenklich:
 
 Auslöser: {reason}
 
-Aktuelle Temperaturen:
+Aktuelle Temperaturen (Minimum/Maximum der letzten Stunde):
 {alltemperatures}
 
 Bitte haltet die Temperaturen im Auge und fahrt eventuell heiß laufende Server herunter
@@ -91,45 +119,182 @@ with love,
 Temperator"""
 
 
+class RateLimit:
+    """
+    The time of the last mail per subject. Entries expire after the delay and
+    at most `max_entries` are kept, the oldest are dropped first.
+    """
+
+    def __init__(self):
+        self.last = OrderedDict()
+        self.limited = 0
+
+    def allow(self, key, now, delay, max_entries):
+        # entries are only added, never updated, so they are ordered by time
+        while self.last and now - next(iter(self.last.values())) >= delay:
+            self.last.popitem(last=False)
+        if key in self.last:
+            self.limited += 1
+            return False
+        self.last[key] = now
+        while len(self.last) > max_entries:
+            self.last.popitem(last=False)
+        return True
+
+
 class Mail(Plugin):
     """
     Handle all the mail sending stuff
+
+    With `digest_window` set, non-urgent mails are collected for that many
+    seconds and sent as one digest per recipient list. Urgent mails are sent
+    right away.
     """
 
     def __init__(self, monitor):
         self.monitor = monitor
         self.config = self.monitor.config
 
-        self._mail_rate_limit = {}
+        self._mail_rate_limit = RateLimit()
+        # recipients -> [(time, subject, body)]
+        self._digests = {}
+        self._digest_handle = None
+        self.digest_events = 0
+        self.digests_sent = 0
 
-    async def send_mail(self, subject, body, urgent=False):
+        if self.config['mail'].get('delivery_socket'):
+            # supervised worker, the supervisor delivers the mails
+            self.delivery = MailRelay(self.config, monitor.loop)
+        else:
+            self.delivery = MailDelivery(self.config, monitor.loop)
+
+    @staticmethod
+    def check_config(config):
+        conf = config['mail']
+        conf['from']
+        conf['to']
+        conf['to_urgent']
+        int(conf['min_delay_between_messages'])
+        int(conf.get('rate_limit_entries', 1000))
+        float(conf.get('digest_window', 0))
+
+    async def start(self):
         """
-        Send a mail to the configured recipients
+        Requeue the spooled mails and start the delivery
         """
-        msg = MIMEText(body, _charset="UTF-8")
-        msg['Subject'] = subject
-        msg['From'] = self.config['mail']['from']
-        if urgent:
-            recipients = self.config['mail']['to_urgent'].split(',')
-        else:
-            recipients = self.config['mail']['to'].split(',')
-        msg['To'] = ",".join([s.strip() for s in recipients])
-        msg['Date'] = formatdate(localtime=True)
+        self.delivery.start()
+
+    async def teardown(self):
+        """
+        Send the pending digests and stop the delivery worker, undelivered
+        mails stay in the spool
+        """
+        self.flush_digests()
+        await self.delivery.stop()
+
+    def metrics(self):
+        yield from self.delivery.metrics()
+        yield Metric('tempermonitor_mail_rate_limited', "Mails not sent due to the rate limit",
+                     'counter', {}, self._mail_rate_limit.limited)
+        yield Metric('tempermonitor_mail_rate_limit_entries',
+                     "Subjects remembered by the rate limit", 'gauge', {},
+                     len(self._mail_rate_limit.last))
+        yield Metric('tempermonitor_mail_digest_events', "Notifications collected into digests",
+                     'counter', {}, self.digest_events)
+        yield Metric('tempermonitor_mail_digests_sent', "Digest mails sent",
+                     'counter', {}, self.digests_sent)
+        yield Metric('tempermonitor_mail_digest_pending',
+                     "Notifications waiting for the next digest", 'gauge', {},
+                     sum(len(events) for events in self._digests.values()))
 
+    async def send_mail(self, subject, body, urgent=False):
+        """
+        Send a mail to the configured recipients, or add it to the digest
+        """
+        conf = self.config['mail']
+        now = self.monitor.clock()
         print("Notification: {}".format(subject))
 
-        # Ratelimit the emails
-        time_since_last_mail = time.time() - self._mail_rate_limit.get(subject, 0)
-        if time_since_last_mail < int(self.config['mail']['min_delay_between_messages']):
-            print("Not sending due to ratelimiting: %i", time_since_last_mail)
+        # Ratelimit the emails, an urgent mail is not held back by a normal one
+        if not self._mail_rate_limit.allow((urgent, subject), now,
+                                           int(conf['min_delay_between_messages']),
+                                           int(conf.get('rate_limit_entries', 1000))):
+            print("Not sending due to ratelimiting: {}".format(subject))
             return
 
         print("Body: {}".format(body))
 
-        self._mail_rate_limit[subject] = time.time()
-        smtp = smtplib.SMTP("mail.stusta.mhn.de")
-        smtp.sendmail(msg['From'], recipients, msg.as_string())
-        smtp.quit()
+        recipients = conf['to_urgent'] if urgent else conf['to']
+        window = float(conf.get('digest_window', 0))
+        if urgent or window <= 0:
+            self._submit(recipients, subject, body)
+            return
+
+        self._digests.setdefault(recipients, []).append((now, subject, body))
+        self.digest_events += 1
+        if self._digest_handle is None:
+            self._digest_handle = self.monitor.loop.call_later(window, self.flush_digests)
+
+    def _submit(self, recipients, subject, body):
+        recipients = [s.strip() for s in recipients.split(',')]
+        msg = MIMEText(body, _charset="UTF-8")
+        msg['Subject'] = subject
+        msg['From'] = self.config['mail']['from']
+        msg['To'] = ",".join(recipients)
+        msg['Date'] = formatdate(localtime=True)
+        self.delivery.submit(msg['From'], recipients, msg.as_string())
+
+    def flush_digests(self):
+        """
+        Send one mail per recipient list with the collected notifications, a
+        single notification is sent as it is
+        """
+        if self._digest_handle:
+            self._digest_handle.cancel()
+            self._digest_handle = None
+        digests, self._digests = self._digests, {}
+        window = float(self.config['mail'].get('digest_window', 0))
+        for recipients, events in digests.items():
+            if len(events) == 1:
+                _, subject, body = events[0]
+                self._submit(recipients, subject, body)
+                continue
+
+            # subject -> [count, first, last, last body]
+            grouped = OrderedDict()
+            for now, subject, body in events:
+                entry = grouped.setdefault(subject, [0, now, now, body])
+                entry[0] += 1
+                entry[2:] = [now, body]
+
+            def clock(timestamp):
+                return time.strftime('%H:%M:%S', time.localtime(timestamp))
+
+            listed = list(grouped.items())[:DIGEST_MAX_ENTRIES]
+            summary = ["* {}x {} ({} - {})".format(count, subject, clock(first), clock(last))
+                       for subject, (count, first, last, _) in listed]
+            if len(grouped) > len(listed):
+                summary.append("* ... and {} more".format(len(grouped) - len(listed)))
+            details = ["--- {} ---\n{}".format(subject, body)
+                       for subject, (_, _, _, body) in listed]
+            self._submit(recipients,
+                         DIGEST_SUBJECT.format(count=len(events)),
+                         DIGEST_BODY.format(window=window, summary="\n".join(summary),
+                                            details="\n".join(details)))
+            self.digests_sent += 1
+
+    @staticmethod
+    def format_temperature(sensor):
+        """
+        Current temperature of the sensor together with the range of the last hour
+        """
+        if not sensor.valid:
+            return "{}: INVALID".format(sensor.name)
+        _, hourmin, hourmax, _ = sensor.history.stats(3600)
+        if hourmin is None:
+            return "{}: {}".format(sensor.name, sensor.temperature)
+        return "{}: {} ({:.1f} - {:.1f})".format(
+            sensor.name, sensor.temperature, hourmin, hourmax)
 
     async def err_nodata(self, **kwargs):
         await self.send_mail(
@@ -141,6 +306,13 @@ class Mail(Plugin):
             NO_VALID_DATA_SUBJECT.format(**kwargs),
             NO_VALID_DATA_BODY.format(**kwargs))
 
+    async def link_state(self, downtime=None, **kwargs):
+        # the loss itself is reported by err_nodata or err_no_valid_data
+        if downtime is not None:
+            await self.send_mail(
+                LINK_RECOVERED_SUBJECT.format(**kwargs),
+                LINK_RECOVERED_BODY.format(downtime=downtime, **kwargs))
+
     async def err_unknown_sensor(self, **kwargs):
         await self.send_mail(
             UNKNOWN_SENSOR_SUBJECT.format(**kwargs),
@@ -157,20 +329,29 @@ class Mail(Plugin):
             SENSOR_MEASUREMENT_MISSED_BODY.format(**kwargs))
 
     async def temperature_warning(self, source, urgent=False, **kwargs):
+        subject = SENSOR_TEMPERATURE_WARNING_SUBJECT
         if source == "tempdiff":
             temperatures = "{name1}:{temp1}\n{name2}:{temp2}".format(**kwargs)
             reason = "Differenztemperatur: {tempdiff}".format(**kwargs)
         elif source == "singlehot":
             temperatures = "{name}:{temp}".format(**kwargs)
             reason = "Einzeltemperatur zu hoch"
+        elif source == "rule":
+            temperatures = "{name}:{temp:.1f}".format(**kwargs)
+            reason = "Regel {name}: {expression} = {temp:.1f}, Schwelle {threshold}".format(
+                **kwargs)
+        elif source == "trend":
+            subject = SENSOR_TEMPERATURE_TREND_SUBJECT
+            temperatures = "{name}:{temp:.1f}".format(**kwargs)
+            reason = "Trend {slope:+.2f} K/min, {threshold} erreicht in {minutes:.0f} min".format(
+                minutes=kwargs['eta'] / 60, **kwargs)
 
         alltemperatures = '\n'.join([
-            "{}: {}".format(sensor.name, sensor.temperature) if sensor.valid
-            else "{}: INVALID".format(sensor.name)
+            self.format_temperature(sensor)
             for sensor in self.monitor.sensors.values()])
 
         await self.send_mail(
-            SENSOR_TEMPERATURE_WARNING_SUBJECT,
+            subject,
             SENSOR_TEMPERATURE_WARNING_BODY.format(
                 temperatures=temperatures,
                 reason=reason,
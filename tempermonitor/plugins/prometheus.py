@@ -1,38 +1,172 @@
-import re
-import asyncio
-from prometheus_client import start_http_server, Gauge
+from prometheus_client import REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily, HistogramMetricFamily
 
-from . import Plugin
+from . import Plugin, stats_name_re
+from ..httpserver import HTTPServer, Response
 
-stats_name_re = re.compile(r'^temperature-(?P<group>\w+)-(?P<type>\w+)$')
+METRIC_FAMILIES = {
+    'gauge': GaugeMetricFamily,
+    'counter': CounterMetricFamily,
+    'histogram': HistogramMetricFamily,
+}
+
+
+class MonitorCollector:
+    """
+    Export the internal metrics of the monitor and its plugins at scrape time
+    """
+
+    def __init__(self, monitor):
+        self.monitor = monitor
+
+    def collect(self):
+        families = {}
+        for metric in self.monitor.metrics():
+            family = families.get(metric.name)
+            if family is None:
+                family = METRIC_FAMILIES[metric.kind](
+                    metric.name, metric.documentation, labels=list(metric.labels))
+                families[metric.name] = family
+            if metric.kind == 'histogram':
+                family.add_metric(list(metric.labels.values()), metric.value.buckets(),
+                                  metric.value.sum)
+            else:
+                family.add_metric(list(metric.labels.values()), metric.value)
+        return families.values()
+
+
+class SensorCollector:
+    """
+    Read the live sensor table whenever prometheus scrapes.
+
+    Only valid measurements that are younger than `stale_after` seconds are
+    exported as temperature, the validity and age of every sensor are exported
+    separately.
+    """
+
+    def __init__(self, plugin):
+        self.plugin = plugin
+
+    def collect(self):
+        plugin = self.plugin
+        now = plugin.monitor.clock()
+
+        temperature = GaugeMetricFamily(
+            plugin.sensor_metric_name, "Container Temperature Measurements",
+            labels=["sensor"])
+        valid = GaugeMetricFamily(
+            plugin.sensor_metric_name + "_valid",
+            "Is the last measurement of the sensor valid", labels=["sensor"])
+        age = GaugeMetricFamily(
+            plugin.sensor_metric_name + "_age_seconds",
+            "Seconds since the last valid measurement of the sensor", labels=["sensor"])
+
+        for sensor in plugin.monitor.sensors.values():
+            if sensor.temperature is None:
+                valid.add_metric([sensor.name], 0)
+                continue
+            sensor_age = now - sensor.last_update
+            current = sensor.valid and sensor_age <= plugin.stale_after
+            valid.add_metric([sensor.name], int(current))
+            age.add_metric([sensor.name], sensor_age)
+            if current:
+                temperature.add_metric([sensor.name], sensor.temperature,
+                                       timestamp=plugin.timestamp(sensor.last_update))
+
+        aggregated = GaugeMetricFamily(
+            plugin.aggregated_metric_name, "Container Temperature Aggregations",
+            labels=["group", "type"])
+        for (group, stattype), (stattime, statval) in plugin.aggregated.items():
+            if now - stattime <= plugin.stale_after:
+                aggregated.add_metric([group, stattype], statval,
+                                      timestamp=plugin.timestamp(stattime))
+
+        return [temperature, valid, age, aggregated]
 
 
 class Prometheus(Plugin):
+    """
+    Serve the sensor values and the internal metrics for prometheus.
+
+    Nothing is exported when the values change, the collectors read the current
+    state when prometheus scrapes the endpoint, which is served from within the
+    event loop.
+    """
+
     def __init__(self, monitor):
-        self.loop = asyncio.get_event_loop()
         self.config = monitor.config
-        self.last_store = 0
         self.monitor = monitor
 
-        self.sensor_metrics = Gauge(
-            name=self.config["prometheus"]["sensor_metric_name"],
-            documentation="Container Temperature Measurements",
-            labelnames=["sensor"]
-        )
+        # (group, type) -> (time, value)
+        self.aggregated = {}
+        self.configure()
 
-        self.aggregated_metrics = Gauge(
-            name=self.config["prometheus"]["aggregated_metric_name"],
-            documentation="Container Temperature Aggregations",
-            labelnames=["group", "type"]
-        )
+        self.registry = REGISTRY
+        self._collectors = [SensorCollector(self), MonitorCollector(monitor)]
+        for collector in self._collectors:
+            self.registry.register(collector)
 
-        start_http_server(
-            addr=self.config["prometheus"].get('address', 'localhost'),
-            port=int(self.config["prometheus"]["port"])
-        )
-        print("started prometheus http server")
+        self.server = self._create_server()
 
-    async def send_stats_graph(self, graph, stattype, stattime, statval):
+    async def start(self):
+        await self.server.start()
+
+    @staticmethod
+    def check_config(config):
+        conf = config["prometheus"]
+        conf["sensor_metric_name"]
+        conf["aggregated_metric_name"]
+        float(conf.get('stale_after', 60))
+        conf.getboolean('export_timestamps', True)
+        if not conf.get('path'):
+            int(conf["port"])
+
+    def configure(self):
+        conf = self.config["prometheus"]
+        self.sensor_metric_name = conf["sensor_metric_name"]
+        self.aggregated_metric_name = conf["aggregated_metric_name"]
+        self.stale_after = float(conf.get('stale_after', 60))
+        self.export_timestamps = conf.getboolean('export_timestamps', True)
+
+    def _create_server(self):
+        conf = self.config["prometheus"]
+        if conf.get('path'):
+            return HTTPServer({'/metrics': self.serve_metrics}, path=conf['path'])
+        return HTTPServer(
+            {'/metrics': self.serve_metrics},
+            host=conf.get('address', 'localhost'),
+            port=int(conf["port"]))
+
+    async def reload(self):
+        """
+        Apply the new settings, the server is only restarted if its address changed
+        """
+        self.configure()
+        server = self._create_server()
+        if (server.host, server.port, server.path) != \
+           (self.server.host, self.server.port, self.server.path):
+            await self.server.stop()
+            self.server = server
+            await self.server.start()
+
+    def timestamp(self, value):
+        """
+        The sample timestamp to export, if enabled
+        """
+        return value if self.export_timestamps else None
+
+    def serve_metrics(self, request):
+        """
+        Render all metrics in the prometheus text format
+        """
+        return Response(generate_latest(self.registry), content_type=CONTENT_TYPE_LATEST)
+
+    async def teardown(self):
+        await self.server.stop()
+        for collector in self._collectors:
+            self.registry.unregister(collector)
+
+    def send_stats_graph(self, graph, stattype, stattime, statval):
         """
         to be called as a plugin callback to export aggregated measurements
         """
@@ -40,12 +174,4 @@ class Prometheus(Plugin):
         if not m:
             return
 
-        self.aggregated_metrics.labels(group=m.group('group'), type=m.group('type')).set(statval)
-
-    async def sensor_update(self):
-        """
-        Receive sensor data to store them regularely into collectd
-        """
-        for sensor in self.monitor.sensors.values():
-            if sensor.valid:
-                self.sensor_metrics.labels(sensor=sensor.name).set(sensor.temperature)
+        self.aggregated[(m.group('group'), m.group('type'))] = (stattime, statval)
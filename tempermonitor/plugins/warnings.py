@@ -1,140 +1,130 @@
-import time
-
 from . import Plugin
+from ..rules import RuleEngine
+from ..trend import Trend
 
 
 class Warnings(Plugin):
     """
     Generate all kind of warnings whenever needed and observe the sensor
     if they see a problematic situation in the container
+
+    The statistics of all groups are computed every block and the alert rules
+    (see rules.py) are evaluated on them.
+
+    Besides the thresholds, the trend of every ceiling sensor and of the
+    ceiling average is fitted over the last `trend_window` seconds. If it is
+    projected to cross the critical (single sensor) or warning (average) level
+    within `trend_horizon` seconds, an early warning is sent.
     """
 
     def __init__(self, monitor):
         self.monitor = monitor
+        self.warning_conf = self.monitor.config['warning']
 
+        # sensor name or group -> Trend
+        self.trends = {}
+        self.rules = RuleEngine(self.monitor.config, self.monitor.rollups.groups)
+        self.configure()
+        self.rules.bind(self.revmapping)
+
+    @staticmethod
+    def check_config(config):
+        conf = config['warning']
+        float(conf.get('trend_horizon', 900))
+        float(conf.get('trend_window', 600))
+        int(conf.get('trend_min_samples', 10))
+        conf.getfloat('ceiling_critical_level')
+        conf.getfloat('ceiling_warning_level')
+
+    def configure(self):
         self.revmapping = {
             sensor.name: sensor
             for sensor in self.monitor.sensors.values()
         }
+        self.trend_horizon = float(self.warning_conf.get('trend_horizon', 900))
+        self.critical_level = self.warning_conf.getfloat('ceiling_critical_level')
+        self.warning_level = self.warning_conf.getfloat('ceiling_warning_level')
+        # changed settings or sensors start with a fresh trend
+        self.trends = {}
 
-        self.warning_conf = self.monitor.config['warning']
-
-        conftest = [
-            self.warning_conf['floor_sensors'],
-            self.warning_conf['ceiling_sensors'],
-            self.warning_conf['floor_ceiling_diff'],
-            self.warning_conf['ceiling_warning_level'],
-        ]
-        del conftest
-
-    def get_sensor(self, sensorname):
+    def reload(self):
         """
-        Resovle the reverse mapping and get back the sensor
+        Compile the rules again and rebuild the name mapping after the sensors
+        have changed. Invalid rules are reported and the old ones are kept.
         """
-        return self.revmapping[sensorname]
-
-    def get_stats(self, sensorlist):
+        self.configure()
+        try:
+            self.rules.configure(self.monitor.config, self.monitor.rollups.groups)
+        except RuntimeError as exc:
+            print(f"{exc}, keeping the old rules")
+        self.rules.bind(self.revmapping)
+
+    def get_trend(self, name):
+        trend = self.trends.get(name)
+        if trend is None:
+            trend = self.trends[name] = Trend(
+                float(self.warning_conf.get('trend_window', 600)),
+                int(self.warning_conf.get('trend_min_samples', 10)))
+        return trend
+
+    async def check_trend(self, name, timestamp, value, threshold, urgent=False):
         """
-        Calculate mininmum, maximum average and variance over the sensor names given
+        Update the trend of a sensor or group and warn if it is about to
+        cross the threshold
         """
-        sensors = [self.get_sensor(sensor) for sensor in sensorlist]
-        sensors = [sensor for sensor in sensors if sensor.valid]
-
-        if not sensors:
-            return [], 0, 0, 0, 0
-
-        avg = sum(sensor.temperature for sensor in sensors) / len(sensors)
-        var = sum((sensor.temperature - avg) ** 2 for sensor in sensors) / len(sensors)
-
-        sensormin = +9999
-        sensormax = -9999
-        for sensor in sensors:
-            if sensor.temperature < sensormin:
-                sensormin = sensor.temperature
-            if sensor.temperature > sensormax:
-                sensormax = sensor.temperature
-
-        return sensors, sensormin, sensormax, avg, var
+        trend = self.get_trend(name)
+        trend.add(timestamp, value)
+        eta = trend.time_to_cross(threshold)
+        if eta is not None and eta < self.trend_horizon:
+            slope, current = trend.fit()
+            await self.monitor.call_plugin("temperature_warning",
+                                           source="trend",
+                                           name=name,
+                                           temp=current,
+                                           slope=slope * 60,
+                                           threshold=threshold,
+                                           eta=eta,
+                                           urgent=urgent)
 
     async def sensor_update(self):
         """
-        First generate stats and relay them to the collectd module, then use these stats
-        to decide wether it is currently critical in the container, and if so, send
-        warnings
+        First generate the stats of all groups and relay them to the collectd
+        module, then evaluate the rules on these stats and send warnings for
+        the ones that fire
         """
-        # Do nothing yet
-        floor_sensors, floor_min, floor_max, floor_avg, floor_var = self.get_stats(
-            self.warning_conf['floor_sensors'].split(','))
-
-        ceil_sensors, ceil_min, ceil_max, ceil_avg, ceil_var = self.get_stats(
-            self.warning_conf['ceiling_sensors'].split(','))
-
-        now = time.time()
-        if floor_sensors:
-            await self.monitor.call_plugin(
-                "send_stats_graph", graph="stats",
-                stattype="temperature-floor-min", stattime=now, statval=floor_min)
-            await self.monitor.call_plugin(
-                "send_stats_graph", graph="stats",
-                stattype="temperature-floor-max", stattime=now, statval=floor_max)
-            await self.monitor.call_plugin(
-                "send_stats_graph", graph="stats",
-                stattype="temperature-floor-avg", stattime=now, statval=floor_avg)
-            await self.monitor.call_plugin(
-                "send_stats_graph", graph="stats",
-                stattype="temperature-floor-var", stattime=now, statval=floor_var)
-
-        if ceil_sensors:
-            await self.monitor.call_plugin(
-                "send_stats_graph", graph="stats",
-                stattype="temperature-ceil-min", stattime=now, statval=ceil_min)
-            await self.monitor.call_plugin(
-                "send_stats_graph", graph="stats",
-                stattype="temperature-ceil-max", stattime=now, statval=ceil_max)
-            await self.monitor.call_plugin(
-                "send_stats_graph", graph="stats",
-                stattype="temperature-ceil-avg", stattime=now, statval=ceil_avg)
-            await self.monitor.call_plugin(
-                "send_stats_graph", graph="stats",
-                stattype="temperature-ceil-var", stattime=now, statval=ceil_var)
-
-        if floor_sensors and ceil_sensors:
-            # Else we already have sent warning messages for broken sensors
-
-            tempdiff = ceil_avg - floor_avg
+        now = self.monitor.clock()
+        values = self.rules.update(now)
+
+        for group in self.rules.valid:
+            for stattype in ('min', 'max', 'avg', 'var'):
+                await self.monitor.call_plugin(
+                    "send_stats_graph", graph="stats",
+                    stattype=f"temperature-{group}-{stattype}", stattime=now,
+                    statval=values[group, stattype])
+            print("{}: min {:05.2f} max {:05.2f} avg {:05.2f} var {:05.2f}".format(
+                group, values[group, 'min'], values[group, 'max'],
+                values[group, 'avg'], values[group, 'var']))
+
+        if ('floor', 'avg') in values and ('ceil', 'avg') in values:
             await self.monitor.call_plugin(
                 "send_stats_graph", graph="stats",
-                stattype="temperature-floor_ceil-diff", stattime=now, statval=tempdiff)
-
-            print("floor: min {:05.2f} max {:05.2f} avg {:05.2f} var {:05.2f}".format(
-                floor_min, floor_max, floor_avg, floor_var))
-            print("ceil:  min {:05.2f} max {:05.2f} avg {:05.2f} var {:05.2f}".format(
-                ceil_min, ceil_max, ceil_avg, ceil_var))
-
-            # Here comes the warning magic
-
-            # Critical: ceiling temperature > threshold (sane default: 45)
-            if ceil_max > int(self.warning_conf['ceiling_critical_level']):
-                await self.monitor.call_plugin("temperature_warning",
-                                               source="singlehot",
-                                               name="ceiling",
-                                               temp=ceil_max,
-                                               urgent=True)
-
-            # Warning: ceiling tempareture > threshold (sane default: 40)
-            if ceil_avg > int(self.warning_conf['ceiling_warning_level']):
-                await self.monitor.call_plugin("temperature_warning",
-                                               source="singlehot",
-                                               name="ceiling",
-                                               temp=ceil_avg)
-
-            # Warning: temperature difference > threshold (sane default: 17)
-            if ceil_max > int(self.warning_conf['min_ceiling_warning']):
-                if tempdiff > int(self.warning_conf['floor_ceiling_diff']):
-                    await self.monitor.call_plugin("temperature_warning",
-                                                   source="tempdiff",
-                                                   name1="floor",
-                                                   name2="ceiling",
-                                                   temp1=floor_avg,
-                                                   temp2=ceil_avg,
-                                                   tempdiff=tempdiff)
+                stattype="temperature-floor_ceil-diff", stattime=now,
+                statval=values['ceil', 'avg'] - values['floor', 'avg'])
+
+        for rule, value in self.rules.evaluate(values, now):
+            await self.monitor.call_plugin("temperature_warning",
+                                           source="rule",
+                                           name=rule.name,
+                                           temp=value,
+                                           expression=rule.expression,
+                                           threshold=rule.threshold,
+                                           urgent=rule.urgent)
+
+        # Early warning: the ceiling is heading towards the thresholds
+        if self.trend_horizon > 0 and 'ceil' in self.rules.valid:
+            if self.critical_level is not None:
+                for sensor in self.rules.valid['ceil']:
+                    await self.check_trend(sensor.name, sensor.last_update, sensor.temperature,
+                                           self.critical_level, urgent=True)
+            if self.warning_level is not None:
+                await self.check_trend("ceiling", now, values['ceil', 'avg'], self.warning_level)
@@ -0,0 +1,93 @@
+"""
+Profile the running daemon on demand.
+
+    kill -USR1 $(pidof tempermonitor)
+
+starts a cProfile and tracemalloc capture, the next SIGUSR1 stops it and
+writes to `profile_dir` of `[general]` (default: the temp directory):
+
+* profile-<time>.prof: the cProfile stats, e.g. for `python3 -m pstats` or snakeviz
+* profile-<time>.txt: the top functions by cumulative time and the allocations
+  that grew most during the capture
+* profile-<time>.snap: the tracemalloc snapshot at the end of the capture
+
+Profiling slows the daemon down, so only keep it running for a few blocks.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import tempfile
+import time
+import tracemalloc
+
+
+class Profiler:
+    """
+    Toggle a cProfile and tracemalloc capture
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._profile = None
+        self._snapshot = None
+        self._started = None
+        self._stop_tracemalloc = False
+
+    @property
+    def directory(self):
+        return self.config['general'].get('profile_dir', tempfile.gettempdir())
+
+    @property
+    def running(self):
+        return self._profile is not None
+
+    def toggle(self):
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def start(self):
+        print("Starting profiler")
+        self._started = time.time()
+        self._stop_tracemalloc = not tracemalloc.is_tracing()
+        if self._stop_tracemalloc:
+            tracemalloc.start(int(self.config['general'].get('profile_frames', 10)))
+        self._snapshot = tracemalloc.take_snapshot()
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def stop(self):
+        """
+        Stop the capture and write the results, returns the path without suffix
+        or None if they could not be written
+        """
+        self._profile.disable()
+        profile, self._profile = self._profile, None
+        snapshot = tracemalloc.take_snapshot()
+        if self._stop_tracemalloc:
+            tracemalloc.stop()
+
+        report = io.StringIO()
+        report.write(f"Profile of {time.time() - self._started:.1f}s\n\n")
+        pstats.Stats(profile, stream=report).sort_stats('cumulative').print_stats(40)
+        report.write("\nAllocation growth during the capture:\n")
+        for stat in snapshot.compare_to(self._snapshot, 'lineno')[:25]:
+            report.write(f"{stat}\n")
+        self._snapshot = None
+
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(self._started))
+        base = os.path.join(self.directory, f"profile-{stamp}")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            profile.dump_stats(base + ".prof")
+            snapshot.dump(base + ".snap")
+            with open(base + ".txt", 'w') as reportfile:
+                reportfile.write(report.getvalue())
+        except OSError as exc:
+            print(f"Could not write the profile: {exc!r}")
+            return None
+        print(f"Profile written to {base}.*")
+        return base
@@ -0,0 +1,274 @@
+"""
+Decoders for the protocols spoken by the ESP firmware.
+
+Both decoders work on arbitrary chunks of received bytes and return complete
+blocks, so the serial reader does not need to care about lines or frames.
+
+The text protocol sends one `one-wire-id temperature` line per sensor and
+terminates every block with an empty line.
+
+The firmware also supports a compact binary framing. It is negotiated at
+connect time: the host sends `MODE BIN1`, the firmware answers with the text
+line `OK BIN1` and only sends binary frames from then on. If there is no answer
+the host keeps using the text protocol.
+
+Every frame is
+
+    magic (a5 5a) | type (u8) | payload length (u16) | payload | crc32 (u32)
+
+with all integers little endian. The crc32 covers type, length and payload.
+
+Frame types:
+
+* `I` id table: sequence (u16), count (u16), count * 8 byte one wire ids.
+  The index of an id in this table is used by the data frames.
+* `D` data, one complete block: sequence (u16), device time in ms (u32),
+  count (u16), count * (sensor index (u16), temperature in 1/100 degrees (i16)).
+  A temperature of 0x7fff marks a failed reading.
+
+The sequence number is shared by both frame types and incremented with every
+frame, so lost frames are detected exactly.
+"""
+
+import binascii
+import struct
+
+MAGIC = b'\xa5\x5a'
+HANDSHAKE = b'MODE BIN1\n'
+HANDSHAKE_ACK = b'OK BIN1'
+
+FRAME_IDS = ord('I')
+FRAME_DATA = ord('D')
+
+HEADER = struct.Struct('<BH')
+CRC = struct.Struct('<I')
+IDS_HEADER = struct.Struct('<HH')
+DATA_HEADER = struct.Struct('<HIH')
+DATA_ENTRY = struct.Struct('<Hh')
+
+# Largest payload the host accepts (an id table of 2000 sensors), anything longer
+# is a corrupted length field
+MAX_PAYLOAD = 16384
+READ_ERROR = 0x7fff
+# temperature that is reported for failed readings, same as the text protocol
+READ_ERROR_TEMPERATURE = 9001.0
+# Longest line the text decoder accepts before it considers the data garbage
+MAX_LINE = 1024
+
+
+def encode_frame(frame_type, payload):
+    """
+    Build a complete frame around the payload
+    """
+    header = HEADER.pack(frame_type, len(payload))
+    return MAGIC + header + payload + CRC.pack(binascii.crc32(header + payload))
+
+
+class Block:
+    """
+    One complete block of measurements
+    """
+
+    def __init__(self, values, sequence=None, device_time=None):
+        # one wire id -> temperature
+        self.values = values
+        # only set by the binary protocol
+        self.sequence = sequence
+        self.device_time = device_time
+
+
+class TextDecoder:
+    """
+    Incrementally decode the text protocol from arbitrary chunks of bytes.
+
+    Until the first empty line everything is discarded: after connecting we
+    might see the micropython startup garbage or the middle of a block.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._values = {}
+        self.synced = False
+        # set while waiting for the answer to the binary handshake
+        self.expect_handshake = False
+        self.handshake = False
+
+        self.lines = 0
+        self.valid_lines = 0
+        self.invalid_lines = 0
+        self.garbage_bytes = 0
+        self.last_line = b""
+
+    def feed(self, data):
+        """
+        Add received bytes, returns the list of completed Blocks.
+
+        Decoding stops at the answer to the binary handshake, the bytes after it
+        are returned by remaining().
+        """
+        buffer = self._buffer
+        buffer += data
+        blocks = []
+        values = self._values
+        start = 0
+        while True:
+            end = buffer.find(b'\n', start)
+            if end < 0:
+                break
+            line = bytes(buffer[start:end]).strip()
+            start = end + 1
+
+            if not line:
+                # Block has ended
+                if self.synced:
+                    blocks.append(Block(values))
+                else:
+                    self.synced = True
+                values = {}
+                continue
+
+            self.lines += 1
+            self.last_line = line
+            if self.expect_handshake and line.endswith(HANDSHAKE_ACK):
+                self.handshake = True
+                self.expect_handshake = False
+                break
+            if not self.synced:
+                self.garbage_bytes += len(line)
+                continue
+
+            owid, _, temp = line.partition(b' ')
+            try:
+                values[owid.decode('ascii')] = float(temp)
+                self.valid_lines += 1
+            except (ValueError, UnicodeError):
+                self.invalid_lines += 1
+                print("Invaid line received: {}".format(line))
+
+        del buffer[:start]
+        self._values = values
+        if len(buffer) > MAX_LINE and not self.handshake:
+            # No line end in sight, this is not the text protocol
+            self.garbage_bytes += len(buffer)
+            buffer.clear()
+            self._values = {}
+            self.synced = False
+        return blocks
+
+    def remaining(self):
+        """
+        Return and forget the undecoded bytes
+        """
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+class BinaryDecoder:
+    """
+    Incrementally decode binary frames from arbitrary chunks of bytes
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.ids = None
+        self._last_sequence = None
+
+        self.frames = 0
+        self.crc_errors = 0
+        self.lost_frames = 0
+        self.garbage_bytes = 0
+        self.unmapped_frames = 0
+
+    def feed(self, data):
+        """
+        Add received bytes, returns the list of completed Blocks
+        """
+        self._buffer += data
+        blocks = []
+        while True:
+            start = self._buffer.find(MAGIC)
+            if start < 0:
+                # keep a possible first half of the magic
+                keep = 1 if self._buffer.endswith(MAGIC[:1]) else 0
+                self.garbage_bytes += len(self._buffer) - keep
+                del self._buffer[:len(self._buffer) - keep]
+                break
+            if start:
+                self.garbage_bytes += start
+                del self._buffer[:start]
+
+            if len(self._buffer) < len(MAGIC) + HEADER.size:
+                break
+            frame_type, length = HEADER.unpack_from(self._buffer, len(MAGIC))
+            if length > MAX_PAYLOAD:
+                self._skip_magic()
+                continue
+            end = len(MAGIC) + HEADER.size + length + CRC.size
+            if len(self._buffer) < end:
+                break
+
+            body = bytes(self._buffer[len(MAGIC):end - CRC.size])
+            crc, = CRC.unpack_from(self._buffer, end - CRC.size)
+            if binascii.crc32(body) != crc:
+                self.crc_errors += 1
+                self._skip_magic()
+                continue
+            del self._buffer[:end]
+
+            try:
+                block = self._handle_frame(frame_type, body[HEADER.size:])
+            except struct.error:
+                # valid crc, but the payload does not match its type
+                self.garbage_bytes += end
+                continue
+            if block is not None:
+                blocks.append(block)
+        return blocks
+
+    def _skip_magic(self):
+        """
+        The magic at the start of the buffer did not start a valid frame
+        """
+        self.garbage_bytes += len(MAGIC)
+        del self._buffer[:len(MAGIC)]
+
+    def _check_sequence(self, sequence):
+        if self._last_sequence is not None:
+            lost = (sequence - self._last_sequence - 1) & 0xffff
+            self.lost_frames += lost
+        self._last_sequence = sequence
+        self.frames += 1
+
+    def _handle_frame(self, frame_type, payload):
+        if frame_type == FRAME_IDS:
+            sequence, count = IDS_HEADER.unpack_from(payload)
+            self._check_sequence(sequence)
+            offset = IDS_HEADER.size
+            self.ids = [binascii.hexlify(payload[offset + 8 * i:offset + 8 * i + 8]).decode('ascii')
+                        for i in range(count)]
+            return None
+
+        if frame_type == FRAME_DATA:
+            sequence, device_time, count = DATA_HEADER.unpack_from(payload)
+            self._check_sequence(sequence)
+            if self.ids is None:
+                self.unmapped_frames += 1
+                return None
+
+            values = {}
+            for index, value in DATA_ENTRY.iter_unpack(
+                    payload[DATA_HEADER.size:DATA_HEADER.size + count * DATA_ENTRY.size]):
+                if index >= len(self.ids):
+                    # stale id table, wait for the next one
+                    self.unmapped_frames += 1
+                    return None
+                if value == READ_ERROR:
+                    temperature = READ_ERROR_TEMPERATURE
+                else:
+                    temperature = value / 100
+                values[self.ids[index]] = temperature
+            return Block(values, sequence, device_time)
+
+        # Unknown frame types are skipped, they might be added by newer firmware
+        return None
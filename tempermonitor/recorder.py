@@ -0,0 +1,269 @@
+"""
+Record the raw serial bytes of every bus for later analysis or replay.
+
+Enabled by setting `directory` in the `[recorder]` section. Every bus records
+into its own subdirectory:
+
+* segment-<start>.gz: a capture file (see capture.py) covering at most
+  `segment_seconds` (default 3600). Only the newest `max_segments`
+  (default 168) segments are kept. A segment is never appended to after a
+  restart, if the name is taken (a restart within the same second) it
+  becomes segment-<start>-<n>.gz.
+* index: one line `first-timestamp last-timestamp segment offset` per chunk
+
+Receiving data only appends it to a list. Every `flush_interval` seconds
+(default 10) the collected records are compressed as one chunk - an
+independent gzip member - and appended to the current segment in a separate
+thread. A time window can thus be extracted by decompressing only the chunks
+the index points to:
+
+    python3 -m tempermonitor.recorder <bus directory> <start> <end> <output>
+
+with start and end as unix timestamps or ISO dates. The output is a capture
+file that can be replayed with `tempermonitor --replay`.
+"""
+
+import argparse
+import asyncio
+import gzip
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from .capture import CAPTURE_MAGIC, encode_records, decode_records
+from .metrics import Metric
+
+INDEX = "index"
+
+
+class Recorder:
+    """
+    Rotating compressed capture of one bus
+    """
+
+    def __init__(self, config, name, loop):
+        conf = config['recorder']
+        self.name = name
+        self.directory = os.path.join(conf['directory'], name)
+        self.segment_seconds = float(conf.get('segment_seconds', 3600))
+        self.max_segments = int(conf.get('max_segments', 168))
+        self.flush_interval = float(conf.get('flush_interval', 10))
+        self.loop = loop
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.records = 0
+        self.bytes_recorded = 0
+        self.bytes_written = 0
+
+        self._pending = []
+        self._segment = None
+        self._segment_start = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._task = None
+
+    def record(self, timestamp, data):
+        """
+        Remember received bytes, they are written with the next flush
+        """
+        self._pending.append((timestamp, data))
+
+    def start(self):
+        """
+        Start flushing periodically
+        """
+        self._task = self.loop.create_task(self.run())
+
+    async def stop(self):
+        """
+        Write the last chunk and stop flushing
+        """
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+        self._executor.shutdown()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """
+        Compress and write all collected records as one chunk
+        """
+        records, self._pending = self._pending, []
+        if not records:
+            return
+        try:
+            await self.loop.run_in_executor(self._executor, self._write_chunk, records)
+        except OSError as exc:
+            print(f"[{self.name}] Could not write capture: {exc}")
+
+    def _write_chunk(self, records):
+        """
+        Runs in the executor thread
+        """
+        first, last = records[0][0], records[-1][0]
+        payload = encode_records(records)
+        self.records += len(records)
+        self.bytes_recorded += len(payload)
+
+        if self._segment is None or first - self._segment_start >= self.segment_seconds:
+            self._rotate(first)
+            payload = CAPTURE_MAGIC + payload
+
+        chunk = gzip.compress(payload)
+        path = os.path.join(self.directory, self._segment)
+        with open(path, 'ab') as segment:
+            offset = segment.tell()
+            segment.write(chunk)
+        self.bytes_written += len(chunk)
+
+        with open(os.path.join(self.directory, INDEX), 'a') as index:
+            index.write(f"{first:.6f} {last:.6f} {self._segment} {offset}\n")
+
+    def _rotate(self, start):
+        """
+        Start a new segment and remove the oldest ones
+        """
+        name = f"segment-{int(start)}.gz"
+        number = 0
+        while True:
+            try:
+                # the capture magic must be at offset 0 of a segment
+                open(os.path.join(self.directory, name), 'xb').close()
+                break
+            except FileExistsError:
+                number += 1
+                name = f"segment-{int(start)}-{number}.gz"
+        self._segment = name
+        self._segment_start = start
+
+        segments = sorted((name for name in os.listdir(self.directory)
+                           if segment_key(name) and name != self._segment), key=segment_key)
+        expired = set(segments[:max(0, len(segments) + 1 - self.max_segments)])
+        if not expired:
+            return
+        for name in expired:
+            os.unlink(os.path.join(self.directory, name))
+
+        entries = [entry for entry in read_index(self.directory)
+                   if entry[2] not in expired]
+        tmp = os.path.join(self.directory, INDEX + ".tmp")
+        with open(tmp, 'w') as index:
+            for first, last, segment, offset in entries:
+                index.write(f"{first:.6f} {last:.6f} {segment} {offset}\n")
+        os.replace(tmp, os.path.join(self.directory, INDEX))
+
+    def metrics(self):
+        labels = {'bus': self.name}
+        yield Metric('tempermonitor_recorder_records', "Serial reads recorded",
+                     'counter', labels, self.records)
+        yield Metric('tempermonitor_recorder_bytes', "Recorded bytes before compression",
+                     'counter', labels, self.bytes_recorded)
+        yield Metric('tempermonitor_recorder_written_bytes', "Compressed bytes written",
+                     'counter', labels, self.bytes_written)
+        yield Metric('tempermonitor_recorder_pending', "Serial reads waiting for the next flush",
+                     'gauge', labels, len(self._pending))
+
+
+def segment_key(name):
+    """
+    (start, number) of a segment file name for sorting, None for other files
+    """
+    if not name.startswith("segment-") or not name.endswith(".gz"):
+        return None
+    start, _, number = name[8:-3].partition('-')
+    try:
+        return int(start), int(number or 0)
+    except ValueError:
+        return None
+
+
+def read_index(directory):
+    """
+    All (first, last, segment, offset) entries of the index
+    """
+    entries = []
+    try:
+        with open(os.path.join(directory, INDEX)) as index:
+            for line in index:
+                try:
+                    first, last, segment, offset = line.split()
+                    entries.append((float(first), float(last), segment, int(offset)))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def read_chunk(path, offset):
+    """
+    Decompress the single gzip member at offset
+    """
+    decompressor = zlib.decompressobj(wbits=31)
+    data = []
+    with open(path, 'rb') as segment:
+        segment.seek(offset)
+        while not decompressor.eof:
+            compressed = segment.read(65536)
+            if not compressed:
+                break
+            data.append(decompressor.decompress(compressed))
+    data = b"".join(data)
+    if offset == 0 and data.startswith(CAPTURE_MAGIC):
+        data = data[len(CAPTURE_MAGIC):]
+    return data
+
+
+def extract(directory, start, end, output):
+    """
+    Write all records between start and end into a new capture file,
+    returns the number of records
+    """
+    count = 0
+    with open(output, 'wb') as capture:
+        capture.write(CAPTURE_MAGIC)
+        for first, last, segment, offset in read_index(directory):
+            if last < start or first > end:
+                continue
+            path = os.path.join(directory, segment)
+            if not os.path.exists(path):
+                continue
+            records = [(timestamp, data)
+                       for timestamp, data in decode_records(read_chunk(path, offset))
+                       if start <= timestamp <= end]
+            capture.write(encode_records(records))
+            count += len(records)
+    return count
+
+
+def parse_time(value):
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Extract a time window of a recorded bus into a capture file")
+    parser.add_argument("directory", help="recording directory of the bus")
+    parser.add_argument("start", help="unix timestamp or ISO date")
+    parser.add_argument("end", help="unix timestamp or ISO date")
+    parser.add_argument("output", help="capture file to write")
+    args = parser.parse_args()
+
+    count = extract(args.directory, parse_time(args.start), parse_time(args.end), args.output)
+    print(f"Extracted {count} records to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Drive the daemon from a recorded serial capture instead of a serial port.
+
+The recorded bytes run through the same decoders and plugin calls as live data,
+but all timestamps are taken from the capture. The replay speed is either a
+factor of real time or None for as fast as possible. At any speed, every block
+waits until all plugins have handled its events: the plugins read the sensors
+of the monitor, so they would otherwise see a later block, and no event is
+dropped from a full plugin queue. A slow plugin thus slows the replay down.
+
+When the capture is finished, the event loop is stopped.
+"""
+
+import asyncio
+import time
+
+from .capture import iter_capture
+from .serialbus import SerialBus
+
+
+class ReplayBus(SerialBus):
+    """
+    A serial bus reading a capture file
+    """
+
+    # a replay must not overwrite the recording it may be reading
+    recordable = False
+
+    def __init__(self, monitor, section, capture, speed=1.0):
+        super().__init__(monitor, section)
+        self.capture = capture
+        self.speed = speed
+        self.now = None
+
+    def start(self):
+        """
+        Start the replay task
+        """
+        print(f"[{self.name}] replaying {self.capture}")
+        self.monitor.clock = self.clock
+        self._task = self.monitor.loop.create_task(self.run())
+        self._task.add_done_callback(self._task_done)
+
+    def _task_done(self, task):
+        """
+        A failed replay never reaches its end, stop the event loop anyway
+        """
+        super()._task_done(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.monitor.loop.stop()
+
+    def clock(self):
+        """
+        The capture time of the record currently replayed
+        """
+        if self.now is None:
+            return time.time()
+        return self.now
+
+    async def reconnect(self):
+        self._start_protocol()
+        self.connected = True
+
+    async def handle_blocks(self, blocks):
+        """
+        Hand over one block at a time and wait until the plugins handled it
+        """
+        for block in blocks:
+            await super().handle_blocks([block])
+            await self.monitor.eventbus.join()
+
+    async def run(self):
+        """
+        Replay all records of the capture with the selected speed
+        """
+        await self.reconnect()
+        first = None
+        started = time.monotonic()
+        records = 0
+        for timestamp, data in iter_capture(self.capture):
+            if first is None:
+                first = timestamp
+            if self.speed:
+                delay = (timestamp - first) / self.speed - (time.monotonic() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            self.now = timestamp
+            self.bytes_received += len(data)
+            records += 1
+            await self.handle_blocks(self.decode(data))
+
+        await self.monitor.eventbus.join()
+        print(f"[{self.name}] replay finished: {records} records in "
+              f"{time.monotonic() - started:.1f}s")
+        self.connected = False
+        self.monitor.loop.stop()
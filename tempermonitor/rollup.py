@@ -0,0 +1,150 @@
+"""
+Incremental min/max/avg/count rollups of the measurements.
+
+Every accepted sample updates one bucket per resolution (`rollups` in
+`[general]`, default 60,300,3600 seconds) of its sensor and of every group the
+sensor belongs to. Buckets are aligned to multiples of their resolution. When a
+sample arrives after the end of the current buckets of a resolution, all of its
+buckets are closed at once and handed to the plugins with one
+`rollup_closed(resolution, start, sensors, groups)` call, `sensors` and
+`groups` map the names to the closed Buckets.
+
+Groups are configured in the `[groups]` section as `<group>=<sensor>,...`.
+Without that section the floor and ceiling sensors of `[warning]` form the
+groups `floor` and `ceil`.
+"""
+
+from .metrics import Metric
+
+DEFAULT_RESOLUTIONS = "60,300,3600"
+
+
+class Bucket:
+    """
+    The aggregate of all samples of one series within one interval
+    """
+    __slots__ = ('start', 'count', 'min', 'max', 'sum')
+
+    def __init__(self, start):
+        self.start = start
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.sum = 0.0
+
+    def add(self, value):
+        if self.count:
+            if value < self.min:
+                self.min = value
+            elif value > self.max:
+                self.max = value
+        else:
+            self.min = self.max = value
+        self.count += 1
+        self.sum += value
+
+    @property
+    def avg(self):
+        return self.sum / self.count if self.count else None
+
+
+class Resolution:
+    """
+    The open buckets of all series for one resolution
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.start = None
+        self.end = None
+        self.sensors = {}
+        self.groups = {}
+
+    def align(self, timestamp):
+        self.start = timestamp - timestamp % self.seconds
+        self.end = self.start + self.seconds
+
+
+class RollupEngine:
+    """
+    Maintain the rollups of all sensors and groups
+    """
+
+    def __init__(self, config):
+        self.resolutions = []
+        self.groups = {}
+        self._groups_of = {}
+        # closed resolutions waiting to be handed to the plugins
+        self.closed = []
+        # resolution -> (start, sensors, groups) of the last closed buckets
+        self.latest = {}
+        self.configure(config)
+
+    def configure(self, config):
+        """
+        Read the resolutions and groups, open buckets of changed resolutions
+        are dropped
+        """
+        seconds = [int(value) for value in
+                   config['general'].get('rollups', DEFAULT_RESOLUTIONS).split(',')
+                   if value.strip()]
+        current = {resolution.seconds: resolution for resolution in self.resolutions}
+        self.resolutions = [current.get(value) or Resolution(value) for value in seconds]
+
+        if config.has_section('groups'):
+            groups = dict(config['groups'])
+        elif config.has_section('warning'):
+            groups = {'floor': config['warning'].get('floor_sensors', ''),
+                      'ceil': config['warning'].get('ceiling_sensors', '')}
+        else:
+            groups = {}
+        self.groups = {group: [name.strip() for name in names.split(',') if name.strip()]
+                       for group, names in groups.items()}
+        self._groups_of = {}
+        for group, names in self.groups.items():
+            for name in names:
+                self._groups_of.setdefault(name, []).append(group)
+
+    def add(self, name, timestamp, value):
+        """
+        Add an accepted sample of the sensor with the given name
+        """
+        groups = self._groups_of.get(name, ())
+        for resolution in self.resolutions:
+            if resolution.end is None or timestamp >= resolution.end:
+                self._close(resolution, timestamp)
+
+            bucket = resolution.sensors.get(name)
+            if bucket is None:
+                bucket = resolution.sensors[name] = Bucket(resolution.start)
+            bucket.add(value)
+
+            for group in groups:
+                bucket = resolution.groups.get(group)
+                if bucket is None:
+                    bucket = resolution.groups[group] = Bucket(resolution.start)
+                bucket.add(value)
+
+    def _close(self, resolution, timestamp):
+        if resolution.sensors or resolution.groups:
+            closed = (resolution.seconds, resolution.start,
+                      resolution.sensors, resolution.groups)
+            self.closed.append(closed)
+            self.latest[resolution.seconds] = closed[1:]
+        resolution.sensors = {}
+        resolution.groups = {}
+        resolution.align(timestamp)
+
+    def pop_closed(self):
+        """
+        Return and forget the resolutions closed since the last call
+        """
+        closed, self.closed = self.closed, []
+        return closed
+
+    def metrics(self):
+        for resolution in self.resolutions:
+            yield Metric('tempermonitor_rollup_open_buckets',
+                         "Rollup buckets of the current interval", 'gauge',
+                         {'resolution': str(resolution.seconds)},
+                         len(resolution.sensors) + len(resolution.groups))
@@ -0,0 +1,260 @@
+"""
+Declarative alert rules over sensor groups.
+
+A rule is configured in a `[rule:<name>]` section:
+
+    [rule:floor_ceiling_diff]
+    value=avg(ceil) - avg(floor)
+    above=15
+    when=max(ceil) > 35
+    for=120
+    hysteresis=1
+    urgent=no
+
+`value` is a sum of aggregates of the groups (see `[groups]`) and constants.
+The aggregates are `min`, `max`, `avg`, `var`, `count` of the valid sensors of
+a group and `slope`, the trend of the group average in K/min over
+`trend_window` seconds of `[warning]`. A rule fires once its value has been
+above (or `below`) the threshold for `for` seconds (default 0) and the
+optional `when` condition holds. It stays active until the value is back by
+more than `hysteresis` (default 0), and is reported every block while active.
+
+Without any rule section, the thresholds of `[warning]` are used as the rules
+ceiling_critical, ceiling_warning and floor_ceiling_diff.
+
+The rules are compiled when the config is (re)loaded, every block the
+aggregates of all groups are computed in one pass and the rules only look
+them up.
+"""
+
+import configparser
+import re
+
+from .trend import Trend
+
+AGGREGATES = ('min', 'max', 'avg', 'var', 'count', 'slope')
+
+term_re = re.compile(r'\s*([+-])?\s*(?:(\w+)\(\s*(\w+)\s*\)|(\d+(?:\.\d*)?))\s*')
+condition_re = re.compile(r'^(.*?)\s*([<>])\s*(-?\d+(?:\.\d*)?)\s*$')
+
+
+def rule_sections(config):
+    """
+    Return the sections of all configured rules
+    """
+    return [section for section in config.sections() if section.startswith('rule:')]
+
+
+def legacy_rules(config, groups):
+    """
+    The rules equivalent to the thresholds of [warning]
+    """
+    if not config.has_section('warning') or 'ceil' not in groups:
+        return {}
+    conf = config['warning']
+    rules = {}
+    if 'ceiling_critical_level' in conf:
+        rules['ceiling_critical'] = {'value': 'max(ceil)', 'urgent': 'yes',
+                                     'above': conf['ceiling_critical_level']}
+    if 'ceiling_warning_level' in conf:
+        rules['ceiling_warning'] = {'value': 'avg(ceil)',
+                                    'above': conf['ceiling_warning_level']}
+    if 'floor_ceiling_diff' in conf and 'floor' in groups:
+        rules['floor_ceiling_diff'] = {'value': 'avg(ceil) - avg(floor)',
+                                       'above': conf['floor_ceiling_diff']}
+        if 'min_ceiling_warning' in conf:
+            rules['floor_ceiling_diff']['when'] = \
+                'max(ceil) > {}'.format(conf['min_ceiling_warning'])
+    return rules
+
+
+def compile_expression(text, groups):
+    """
+    Compile a sum of aggregates and constants into a function of the
+    aggregates of a block. Returns the function and the (group, aggregate)
+    keys it uses.
+    """
+    terms = []
+    position = 0
+    while position < len(text):
+        m = term_re.match(text, position)
+        if not m or m.end() == position or (terms and not m.group(1)):
+            raise RuntimeError(f"Invalid expression: {text!r}")
+        position = m.end()
+        sign = -1 if m.group(1) == '-' else 1
+        if m.group(4):
+            terms.append((sign, None, float(m.group(4))))
+            continue
+        aggregate, group = m.group(2), m.group(3)
+        if aggregate not in AGGREGATES:
+            raise RuntimeError(f"Unknown aggregate {aggregate} in {text!r}")
+        if group not in groups:
+            raise RuntimeError(f"Unknown group {group} in {text!r}")
+        terms.append((sign, (group, aggregate), 0.0))
+    if not terms:
+        raise RuntimeError("Empty expression")
+
+    keys = {key for _, key, _ in terms if key}
+    if len(terms) == 1 and terms[0][0] == 1 and terms[0][1]:
+        key = terms[0][1]
+        return (lambda values: values.get(key)), keys
+
+    def evaluate(values):
+        total = 0.0
+        for sign, key, constant in terms:
+            if key is None:
+                total += sign * constant
+                continue
+            value = values.get(key)
+            if value is None:
+                return None
+            total += sign * value
+        return total
+    return evaluate, keys
+
+
+class Rule:
+    """
+    A compiled rule and its state
+    """
+
+    def __init__(self, name, options, groups):
+        self.name = name
+        try:
+            self.expression = options['value']
+            if ('above' in options) == ('below' in options):
+                raise RuntimeError("exactly one of above and below is required")
+            self.sign = 1 if 'above' in options else -1
+            self.threshold = float(options['above' if self.sign == 1 else 'below'])
+            self.duration = float(options.get('for', 0))
+            self.hysteresis = float(options.get('hysteresis', 0))
+            self.urgent = configparser.ConfigParser.BOOLEAN_STATES[
+                str(options.get('urgent', 'no')).lower()]
+            self.value, self.keys = compile_expression(self.expression, groups)
+
+            self.when = None
+            if options.get('when'):
+                m = condition_re.match(options['when'])
+                if not m:
+                    raise RuntimeError(f"Invalid condition: {options['when']!r}")
+                when, keys = compile_expression(m.group(1), groups)
+                self.keys |= keys
+                when_sign = 1 if m.group(2) == '>' else -1
+                when_threshold = float(m.group(3))
+
+                def condition(values):
+                    value = when(values)
+                    return value is not None and when_sign * (value - when_threshold) > 0
+                self.when = condition
+        except (KeyError, ValueError, RuntimeError) as exc:
+            raise RuntimeError(f"Invalid rule {name}: {exc}")
+
+        self.active = False
+        self.since = None
+
+    def evaluate(self, values, now):
+        """
+        Returns the value if the rule fires in this block, else None
+        """
+        value = self.value(values)
+        if value is not None and (self.when is None or self.when(values)):
+            excess = self.sign * (value - self.threshold)
+            if excess > 0 or (self.active and excess > -self.hysteresis):
+                if self.since is None:
+                    self.since = now
+                if now - self.since >= self.duration:
+                    self.active = True
+                    return value
+                return None
+        self.active = False
+        self.since = None
+        return None
+
+
+class RuleEngine:
+    """
+    Compute the aggregates of all groups and evaluate the rules on them
+    """
+
+    def __init__(self, config, groups):
+        self.rules = []
+        self.groups = {}
+        self._members = {}
+        self._slopes = {}
+        # group -> valid sensors of the last block
+        self.valid = {}
+        self.configure(config, groups)
+
+    def configure(self, config, groups):
+        """
+        Compile the rules of the config, nothing is changed if one is invalid
+        """
+        sections = rule_sections(config)
+        if sections:
+            definitions = {section.split(':', 1)[1]: config[section] for section in sections}
+        else:
+            definitions = legacy_rules(config, groups)
+        rules = [Rule(name, options, groups) for name, options in definitions.items()]
+
+        previous = {rule.name: rule for rule in self.rules}
+        for rule in rules:
+            if rule.name in previous:
+                rule.active, rule.since = previous[rule.name].active, previous[rule.name].since
+        self.rules = rules
+        self.groups = groups
+
+        window = 600
+        min_samples = 10
+        if config.has_section('warning'):
+            window = float(config['warning'].get('trend_window', window))
+            min_samples = int(config['warning'].get('trend_min_samples', min_samples))
+        self._slopes = {group: self._slopes.get(group) or Trend(window, min_samples)
+                        for rule in rules for group, aggregate in rule.keys
+                        if aggregate == 'slope'}
+
+    def bind(self, sensors):
+        """
+        Resolve the members of the groups, sensors maps names to sensors
+        """
+        self._members = {group: [sensors[name] for name in names if name in sensors]
+                         for group, names in self.groups.items()}
+
+    def update(self, now):
+        """
+        Compute the aggregates of all groups with valid sensors, returns
+        (group, aggregate) -> value
+        """
+        values = {}
+        self.valid = {}
+        for group, members in self._members.items():
+            valid = [sensor for sensor in members if sensor.valid]
+            if not valid:
+                continue
+            self.valid[group] = valid
+            temperatures = [sensor.temperature for sensor in valid]
+            count = len(temperatures)
+            avg = sum(temperatures) / count
+            values[group, 'count'] = count
+            values[group, 'min'] = min(temperatures)
+            values[group, 'max'] = max(temperatures)
+            values[group, 'avg'] = avg
+            values[group, 'var'] = sum((value - avg) ** 2 for value in temperatures) / count
+
+            trend = self._slopes.get(group)
+            if trend is not None:
+                trend.add(now, avg)
+                fit = trend.fit()
+                if fit is not None:
+                    values[group, 'slope'] = fit[0] * 60
+        return values
+
+    def evaluate(self, values, now):
+        """
+        Returns the (rule, value) of all rules firing in this block
+        """
+        fired = []
+        for rule in self.rules:
+            value = rule.evaluate(values, now)
+            if value is not None:
+                fired.append((rule, value))
+        return fired
@@ -0,0 +1,390 @@
+"""
+A single serial connection to an ESP one-wire bridge.
+
+Every bus runs its own reader task and reconnect logic and hands the decoded
+measurements to the TempMonitor, which merges all buses into one sensor table.
+"""
+
+import asyncio
+import os
+import random
+import time
+import serial_asyncio
+import serial
+
+from .metrics import Metric
+from .protocol import BinaryDecoder, TextDecoder, HANDSHAKE
+from .recorder import Recorder
+from .timing import STAGES, Histogram
+
+LINK_STATES = ('syncing', 'up', 'down', 'absent')
+
+# seconds from losing the link to valid data again
+RECOVERY_BUCKETS = (1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+
+def bus_sections(config):
+    """
+    Return all config sections that describe a serial bus.
+
+    This is the plain `[serial]` section as well as every `[serial:<name>]`
+    section.
+    """
+    return [section for section in config.sections()
+            if section == 'serial' or section.startswith('serial:')]
+
+
+class SerialBus:
+    """
+    Interact with one esp-one-wire interface that sends:
+
+    one-wire-id1 temperature
+    one-wire-id1 temperature
+    one-wire-id1 temperature
+
+    followed by an empty line as data packet
+
+    With `protocol=binary` the compact binary framing is negotiated with the
+    firmware at connect time, if the firmware does not answer within
+    `handshake_timeout` seconds the text protocol is used.
+
+    A bus configured with `standby=yes` is a hot standby: its values are only
+    used for sensors that have not been delivered by a primary bus in the
+    current block.
+
+    If the `[recorder]` section configures a directory, all received bytes are
+    recorded there (see recorder.py).
+    """
+
+    recordable = True
+
+    def __init__(self, monitor, section):
+        self.monitor = monitor
+        self.section = section
+        if ':' in section:
+            self.name = section.split(':', 1)[1]
+        else:
+            self.name = section
+
+        conf = monitor.config[section]
+        self.port = conf['port']
+        try:
+            self.baudrate = int(conf['baudrate'])
+        except ValueError:
+            raise RuntimeError(f"Invalid baudrate for {section}: {conf['baudrate']}")
+        if self.baudrate <= 0:
+            raise RuntimeError(f"Invalid baudrate for {section}: {self.baudrate}")
+        self.timeout = int(conf['timeout'])
+        self.standby = conf.getboolean('standby', False)
+        self.reconnect_delay = float(conf.get('reconnect_delay', 1))
+        self.max_reconnect_delay = float(conf.get('max_reconnect_delay', 60))
+        self.reconnect_jitter = float(conf.get('reconnect_jitter', 0.2))
+        self.resync_timeout = float(conf.get('resync_timeout', 10))
+        self.device_poll_interval = float(conf.get('device_poll_interval', 1))
+        self.protocol = conf.get('protocol', 'text')
+        if self.protocol not in ('text', 'binary'):
+            raise RuntimeError(f"Invalid protocol for {section}: {self.protocol}")
+        self.handshake_timeout = float(conf.get('handshake_timeout', 5))
+
+        self.connected = False
+        self.binary = False
+        self.text_decoder = TextDecoder()
+        self.binary_decoder = BinaryDecoder()
+        self.bytes_received = 0
+        self._last_data = b""
+        self._lost_frames_reported = 0
+        self._negotiate_until = None
+        self._reader, self._writer = (None, None)
+        self._task = None
+
+        # link state machine, see set_link_state
+        self.link_state = None
+        self.link_state_since = None
+        self.link_losses = 0
+        self.connect_failures = 0
+        self.recovery = Histogram(RECOVERY_BUCKETS)
+        self._attempts = 0
+        self._down_since = None
+        self._last_valid_data = 0
+
+        self.recorder = None
+        if self.recordable and monitor.config.has_section('recorder') and \
+           monitor.config['recorder'].get('directory'):
+            self.recorder = Recorder(monitor.config, self.name, monitor.loop)
+
+    def start(self):
+        """
+        Start the reader task of this bus
+        """
+        print(f"[{self.name}] connecting to", self.port)
+        if self.recorder:
+            self.recorder.start()
+        self._task = self.monitor.loop.create_task(self.run())
+        self._task.add_done_callback(self._task_done)
+
+    def _task_done(self, task):
+        """
+        Report a reader task that ended with an exception, the bus is down
+        until the daemon is restarted
+        """
+        if task.cancelled() or task.exception() is None:
+            return
+        exc = task.exception()
+        print(f"[{self.name}] Reader task died: {exc!r}")
+        self._close()
+        self.monitor.loop.create_task(self.set_link_state('down', f"reader task died: {exc!r}"))
+
+    async def stop(self):
+        """
+        Terminate the reader task and close the connection
+        """
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            except Exception:
+                # already reported by _task_done
+                pass
+        self._close()
+        if self.recorder:
+            await self.recorder.stop()
+
+    def _device_missing(self):
+        """
+        Is the port a local device file that does not exist (e.g. an USB
+        adapter that is being re-enumerated)
+        """
+        return '://' not in self.port and not os.path.exists(self.port)
+
+    def _backoff(self):
+        """
+        The delay before the next connection attempt, doubled with every
+        failed attempt since the link was last up and randomized by `jitter`
+        """
+        delay = min(self.max_reconnect_delay, self.reconnect_delay * 2 ** self._attempts)
+        self._attempts += 1
+        return delay * (1 - self.reconnect_jitter * random.random())
+
+    async def set_link_state(self, state, reason):
+        """
+        Record a transition of the link and report it to the plugins
+        """
+        previous = self.link_state
+        if state == previous:
+            return
+        now = time.time()
+        downtime = None
+        if previous == 'up':
+            self._down_since = now
+            self.link_losses += 1
+        elif state == 'up':
+            self._attempts = 0
+            if self._down_since is not None:
+                downtime = now - self._down_since
+                self.recovery.observe(downtime)
+                self._down_since = None
+        self.link_state = state
+        self.link_state_since = now
+        print(f"[{self.name}] link {previous} -> {state}: {reason}")
+        await self.monitor.call_plugin("link_state", bus=self.name, state=state,
+                                       previous=previous, reason=reason, downtime=downtime)
+
+    async def reconnect(self):
+        """
+        Connect to the ESP chip, retrying with backoff until it succeeds. While
+        the device file is missing, wait for it to come back instead.
+        """
+        self._close()
+        while True:
+            if self._device_missing():
+                await self.set_link_state('absent', f"{self.port} does not exist")
+                while self._device_missing():
+                    await asyncio.sleep(self.device_poll_interval)
+                print(f"[{self.name}] {self.port} is back")
+                self._attempts = 0
+
+            try:
+                self._reader, self._writer = await serial_asyncio.open_serial_connection(
+                    url=self.port,
+                    baudrate=self.baudrate)
+                break
+            except (serial.SerialException, OSError, ValueError) as exc:
+                # ValueError: pyserial rejected the settings, e.g. an unknown URL
+                self.connect_failures += 1
+                delay = self._backoff()
+                print(f"[{self.name}] Connection failed, retrying in {delay:.1f}s: {exc}")
+                await self.set_link_state('down', f"connection failed: {exc}")
+                await asyncio.sleep(delay)
+
+        self._start_protocol()
+        self.connected = True
+        self._last_valid_data = time.time()
+        await self.set_link_state('syncing', "connected")
+
+    async def link_lost(self, reason):
+        """
+        Close the connection and reconnect after the backoff delay
+        """
+        self._close()
+        await self.set_link_state('down', reason)
+        delay = self._backoff()
+        print(f"[{self.name}] {reason} - reconnecting in {delay:.1f}s")
+        await asyncio.sleep(delay)
+        await self.reconnect()
+
+    def _close(self):
+        if self._writer:
+            self._writer.close()
+        self._reader, self._writer = (None, None)
+        self.connected = False
+
+    def _start_protocol(self):
+        """
+        Start decoding a new connection, negotiate the binary protocol if enabled
+        """
+        # upon startup we only see garbage. (micropython starting up),
+        # also it will produce warnings if the recording is started in the middle
+        # of a message, so the text decoder waits until the end of a message block
+        # to start the game
+        self.binary = False
+        self.text_decoder = TextDecoder()
+        self.binary_decoder = BinaryDecoder()
+        self._lost_frames_reported = 0
+        if self.protocol == 'binary':
+            # Ask the firmware for binary frames, old firmware will just ignore it
+            if self._writer:
+                self._writer.write(HANDSHAKE)
+            self.text_decoder.expect_handshake = True
+            self._negotiate_until = time.time() + self.handshake_timeout
+
+    async def run(self):
+        """
+        Read the protocol, update the sensors or finish a block
+        """
+        await self.reconnect()
+        self._last_valid_data = time.time()
+        while True:
+            if time.time() - self._last_valid_data > self.resync_timeout:
+                # only reported once until the link is up again
+                if self._attempts == 0:
+                    if self.binary:
+                        last_line = self._last_data
+                    else:
+                        last_line = self.text_decoder.last_line
+                    await self.monitor.call_plugin("err_no_valid_data",
+                                                   last_line=last_line,
+                                                   bus=self.name)
+                await self.link_lost(f"no valid data for {self.resync_timeout:.0f}s")
+                continue
+
+            if self._negotiate_until is not None and time.time() > self._negotiate_until:
+                print(f"[{self.name}] Firmware does not speak the binary protocol, using text")
+                self._negotiate_until = None
+                self.text_decoder.expect_handshake = False
+
+            try:
+                data = await asyncio.wait_for(
+                    self._reader.read(65536),
+                    timeout=self.timeout)
+                if not data:
+                    raise serial.SerialException("Connection closed")
+            except asyncio.TimeoutError:
+                print(f"[{self.name}] No Data")
+                await self.monitor.call_plugin("err_nodata", bus=self.name, time=self.timeout)
+                if self._device_missing():
+                    await self.link_lost(f"{self.port} disappeared")
+                continue
+            except (serial.SerialException, OSError, ValueError) as exc:
+                # ValueError: pyserial rejected the settings, e.g. an unknown URL
+                await self.link_lost(f"serial connection failed: {exc}")
+                continue
+
+            start = time.perf_counter()
+            self.bytes_received += len(data)
+            self._last_data = data
+            if self.recorder:
+                self.recorder.record(time.time(), data)
+                STAGES.observe('record', time.perf_counter() - start)
+            await self.handle_blocks(self.decode(data))
+            STAGES.observe('read', time.perf_counter() - start)
+
+    def decode(self, data):
+        """
+        Feed the received bytes into the active decoder, returns the completed blocks
+        """
+        start = time.perf_counter()
+        if self.binary:
+            blocks = self.binary_decoder.feed(data)
+        else:
+            blocks = self.text_decoder.feed(data)
+            if self.text_decoder.handshake:
+                print(f"[{self.name}] Using binary protocol")
+                self.binary = True
+                self._negotiate_until = None
+                blocks += self.binary_decoder.feed(self.text_decoder.remaining())
+        STAGES.observe('parse', time.perf_counter() - start)
+        return blocks
+
+    async def handle_blocks(self, blocks):
+        """
+        Hand the decoded measurements to the monitor
+        """
+        for block in blocks:
+            if block.values:
+                # we have at least a valid line
+                self._last_valid_data = time.time()
+                if self.link_state != 'up':
+                    await self.set_link_state('up', "receiving valid data")
+            start = time.perf_counter()
+            for owid, temp in block.values.items():
+                await self.monitor.sensor_reading(self, owid, temp)
+            STAGES.observe('readings', time.perf_counter() - start)
+            await self.monitor.block_done(self)
+
+        # the frames were counted by decode, before the blocks are handled
+        lost_frames = self.binary_decoder.lost_frames - self._lost_frames_reported
+        if lost_frames > 0:
+            self._lost_frames_reported = self.binary_decoder.lost_frames
+            await self.monitor.call_plugin("err_frames_lost", bus=self.name, count=lost_frames)
+
+    def metrics(self):
+        """
+        Received bytes and the error counters of the binary protocol
+        """
+        labels = {'bus': self.name}
+        yield Metric('tempermonitor_bus_bytes_received', "Bytes received on the serial bus",
+                     'counter', labels, self.bytes_received)
+        yield Metric('tempermonitor_bus_binary', "Is the bus using the binary protocol",
+                     'gauge', labels, int(self.binary))
+        yield Metric('tempermonitor_bus_garbage_bytes', "Bytes that were not part of a line or frame",
+                     'counter', labels,
+                     self.text_decoder.garbage_bytes + self.binary_decoder.garbage_bytes)
+        if self.binary:
+            yield Metric('tempermonitor_bus_frames', "Binary frames received",
+                         'counter', labels, self.binary_decoder.frames)
+            yield Metric('tempermonitor_bus_frames_lost',
+                         "Binary frames lost according to their sequence number",
+                         'counter', labels, self.binary_decoder.lost_frames)
+            yield Metric('tempermonitor_bus_crc_errors', "Binary frames with a wrong checksum",
+                         'counter', labels, self.binary_decoder.crc_errors)
+        else:
+            yield Metric('tempermonitor_bus_lines', "Text lines received",
+                         'counter', labels, self.text_decoder.lines)
+            yield Metric('tempermonitor_bus_invalid_lines', "Text lines that could not be parsed",
+                         'counter', labels, self.text_decoder.invalid_lines)
+        yield Metric('tempermonitor_bus_link_up', "Is valid data being received on the bus",
+                     'gauge', labels, int(self.link_state == 'up'))
+        for state in LINK_STATES:
+            yield Metric('tempermonitor_bus_link_state', "Current state of the serial link",
+                         'gauge', dict(labels, state=state), int(self.link_state == state))
+        yield Metric('tempermonitor_bus_link_losses', "Times the link went down after being up",
+                     'counter', labels, self.link_losses)
+        yield Metric('tempermonitor_bus_connect_failures', "Failed attempts to open the port",
+                     'counter', labels, self.connect_failures)
+        yield Metric('tempermonitor_bus_recovery_seconds',
+                     "Time from losing the link to receiving valid data again",
+                     'histogram', labels, self.recovery)
+        if self.recorder:
+            yield from self.recorder.metrics()
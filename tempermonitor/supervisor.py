@@ -0,0 +1,348 @@
+"""
+Run one tempermonitor worker process per site.
+
+    tempermonitor /etc/tempermonitor-supervisor.ini --supervise /etc/tempermonitor.d
+
+starts a worker for every `*.ini` file in the directory, the site is named
+after the file. A worker is a normal tempermonitor process with two overrides:
+its prometheus plugin serves on a unix socket instead of a port, and its mails
+are handed to the supervisor instead of the mail server. A crashed worker is
+restarted after `restart_delay` seconds, doubled with every crash up to
+`max_restart_delay`.
+
+The supervisor serves all metrics of the workers on one prometheus endpoint,
+every series gets a `site` label. Mails of all workers are delivered by a single
+MailDelivery, with one spool and one connection to the mail server.
+
+On SIGHUP the directory is scanned again: new sites are started, removed ones
+stopped and all other workers reload their config.
+
+The config of the supervisor:
+
+* [supervisor] runtime_dir: directory of the sockets (default /run/tempermonitor),
+  restart_delay (default 1), max_restart_delay (default 60), scrape_timeout
+  (default 5)
+* [prometheus] address and port of the merged endpoint
+* [mail] the mail server settings, see maildelivery.py
+"""
+
+import asyncio
+import configparser
+import glob
+import json
+import os
+import signal
+import sys
+import time
+
+from prometheus_client import CollectorRegistry, CONTENT_TYPE_LATEST, generate_latest
+
+from .httpserver import HTTPServer, Response
+from .maildelivery import MailDelivery
+from .metrics import Metric
+from .plugins.prometheus import MonitorCollector
+from .timing import STAGES
+
+
+class Site:
+    """
+    One worker process and its restarts
+    """
+
+    def __init__(self, supervisor, name, configfile):
+        self.supervisor = supervisor
+        self.name = name
+        self.configfile = configfile
+        self.metrics_socket = os.path.join(supervisor.runtime_dir, f"{name}.metrics.sock")
+        self.process = None
+        self.restarts = 0
+        self._stopping = False
+        self._task = None
+
+    def start(self):
+        self._task = self.supervisor.loop.create_task(self.run())
+
+    async def run(self):
+        """
+        Start the worker and restart it whenever it exits
+        """
+        supervisor = self.supervisor
+        package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONUNBUFFERED='1',
+                   PYTHONPATH=os.pathsep.join(filter(None, [
+                       package_dir, os.environ.get('PYTHONPATH')])))
+        delay = supervisor.restart_delay
+        while True:
+            started = time.monotonic()
+            print(f"[{self.name}] starting worker for {self.configfile}")
+            self.process = await asyncio.create_subprocess_exec(
+                sys.executable, '-m', 'tempermonitor', self.configfile,
+                '--metrics-socket', self.metrics_socket,
+                '--mail-socket', supervisor.mail_socket,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT, env=env)
+
+            # prefix the output of the worker with the site
+            while True:
+                line = await self.process.stdout.readline()
+                if not line:
+                    break
+                print(f"[{self.name}] {line.decode('utf-8', 'replace').rstrip()}")
+            code = await self.process.wait()
+            self.process = None
+            if self._stopping:
+                return
+
+            if time.monotonic() - started >= supervisor.max_restart_delay:
+                delay = supervisor.restart_delay
+            print(f"[{self.name}] worker exited with {code}, restarting in {delay}s")
+            self.restarts += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, supervisor.max_restart_delay)
+
+    def reload(self):
+        """
+        Let the worker reload its config
+        """
+        if self.process:
+            self.process.send_signal(signal.SIGHUP)
+
+    async def stop(self):
+        """
+        Terminate the worker, it is killed if it does not exit within 10s
+        """
+        self._stopping = True
+        process = self.process
+        if process:
+            process.terminate()
+            try:
+                await asyncio.wait_for(process.wait(), timeout=10)
+            except asyncio.TimeoutError:
+                process.kill()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def scrape(self, timeout):
+        """
+        Fetch the metrics of the worker, None if it does not answer
+        """
+        writer = None
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_unix_connection(self.metrics_socket), timeout=timeout)
+            writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+            data = await asyncio.wait_for(reader.read(), timeout=timeout)
+        except (OSError, asyncio.TimeoutError):
+            return None
+        finally:
+            if writer:
+                writer.close()
+        head, _, body = data.partition(b"\r\n\r\n")
+        if not head.startswith(b"HTTP/1.1 200"):
+            return None
+        return body.decode('utf-8')
+
+
+def add_label(line, name, value):
+    """
+    Add a label to a sample line of the prometheus text format
+    """
+    value = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    label = f'{name}="{value}"'
+    brace = line.find('{')
+    space = line.find(' ')
+    if 0 <= brace < space:
+        if line[brace + 1] == '}':
+            return line[:brace + 1] + label + line[brace + 1:]
+        return line[:brace + 1] + label + ',' + line[brace + 1:]
+    return line[:space] + '{' + label + '}' + line[space:]
+
+
+def merge_metrics(expositions):
+    """
+    Merge (site, text) prometheus expositions into one text, adding the site
+    label to every sample unless site is None. Samples of the same family are
+    grouped, HELP and TYPE are only kept once.
+    """
+    # family name -> (comment lines, samples)
+    families = {}
+    for site, text in expositions:
+        family = None
+        for line in text.splitlines():
+            if not line:
+                continue
+            if line.startswith('#'):
+                parts = line.split(' ', 3)
+                if len(parts) >= 3 and parts[1] in ('HELP', 'TYPE'):
+                    family = families.setdefault(parts[2], ({}, []))
+                    family[0].setdefault(parts[1], line)
+                continue
+            if family is None:
+                family = families.setdefault(line.split('{', 1)[0].split(' ', 1)[0], ({}, []))
+            family[1].append(line if site is None else add_label(line, 'site', site))
+
+    lines = []
+    for comments, samples in families.values():
+        lines += [comments[kind] for kind in ('HELP', 'TYPE') if kind in comments]
+        lines += samples
+    return "\n".join(lines) + "\n"
+
+
+class Supervisor:
+    """
+    Manage the workers of all sites in a directory
+    """
+
+    def __init__(self, loop, configfile, directory):
+        self.loop = loop
+        self.configfile = configfile
+        self.directory = directory
+
+        self.config = configparser.ConfigParser()
+        self.config.read(configfile)
+        for section in ('supervisor', 'prometheus', 'mail'):
+            if not self.config.has_section(section):
+                self.config.add_section(section)
+
+        conf = self.config['supervisor']
+        self.runtime_dir = conf.get('runtime_dir', '/run/tempermonitor')
+        self.restart_delay = float(conf.get('restart_delay', 1))
+        self.max_restart_delay = float(conf.get('max_restart_delay', 60))
+        self.scrape_timeout = float(conf.get('scrape_timeout', 5))
+        os.makedirs(self.runtime_dir, exist_ok=True)
+        self.mail_socket = os.path.join(self.runtime_dir, "mail.sock")
+
+        self.sites = {}
+        self.scraped = set()
+        self.mails_received = 0
+        self.delivery = MailDelivery(self.config, loop)
+        self._mail_server = None
+        self.server = HTTPServer(
+            {'/metrics': self.serve_metrics},
+            host=self.config['prometheus'].get('address', 'localhost'),
+            port=int(self.config['prometheus'].get('port', 9199)))
+        self.registry = CollectorRegistry()
+        self.registry.register(MonitorCollector(self))
+
+    async def start(self):
+        self.delivery.start()
+        self._mail_server = await asyncio.start_unix_server(self._handle_mail,
+                                                            path=self.mail_socket)
+        await self.server.start()
+        self.rescan()
+
+    def site_configs(self):
+        """
+        site name -> config file of all sites in the directory
+        """
+        configs = {}
+        for path in sorted(glob.glob(os.path.join(self.directory, '*.ini'))):
+            if os.path.abspath(path) == os.path.abspath(self.configfile):
+                continue
+            configs[os.path.splitext(os.path.basename(path))[0]] = path
+        return configs
+
+    def rescan(self):
+        """
+        Start the workers of new sites and stop the ones of removed sites
+        """
+        configs = self.site_configs()
+        for name in list(self.sites):
+            if configs.get(name) != self.sites[name].configfile:
+                print(f"Stopping site {name}")
+                self.loop.create_task(self.sites.pop(name).stop())
+        for name, configfile in configs.items():
+            if name not in self.sites:
+                self.sites[name] = Site(self, name, configfile)
+                self.sites[name].start()
+
+    async def reload(self):
+        print(f"Reloading sites from {self.directory}")
+        known = set(self.sites)
+        self.rescan()
+        for name in known & set(self.sites):
+            self.sites[name].reload()
+
+    async def _handle_mail(self, reader, writer):
+        """
+        Accept mails of the workers, every mail is one JSON line
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    mail = json.loads(line)
+                    self.delivery.submit(mail['sender'], mail['recipients'], mail['message'])
+                except (ValueError, KeyError, TypeError) as exc:
+                    print(f"Invalid mail from worker: {exc!r}")
+                    writer.write(b"ERROR\n")
+                else:
+                    self.mails_received += 1
+                    writer.write(b"OK\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve_metrics(self, request):
+        """
+        Scrape all workers concurrently and merge their metrics
+        """
+        sites = list(self.sites.values())
+        results = await asyncio.gather(*(site.scrape(self.scrape_timeout) for site in sites))
+        expositions = [(site.name, text) for site, text in zip(sites, results)
+                       if text is not None]
+        self.scraped = {name for name, _ in expositions}
+        expositions.append((None, generate_latest(self.registry).decode('utf-8')))
+        return Response(merge_metrics(expositions).encode('utf-8'),
+                        content_type=CONTENT_TYPE_LATEST)
+
+    def metrics(self):
+        for site in self.sites.values():
+            labels = {'site': site.name}
+            yield Metric('tempermonitor_site_up', "Is the worker of the site running",
+                         'gauge', labels, int(site.process is not None))
+            yield Metric('tempermonitor_site_scraped', "Could the metrics of the site be read",
+                         'gauge', labels, int(site.name in self.scraped))
+            yield Metric('tempermonitor_site_restarts', "Restarts of the worker of the site",
+                         'counter', labels, site.restarts)
+        yield Metric('tempermonitor_mail_received', "Mails handed over by the workers",
+                     'counter', {}, self.mails_received)
+        yield from self.delivery.metrics()
+        yield from STAGES.metrics()
+
+    async def teardown(self):
+        for site in self.sites.values():
+            await site.stop()
+        await self.server.stop()
+        if self._mail_server:
+            self._mail_server.close()
+        await self.delivery.stop()
+
+
+def main(configfile, directory):
+    """
+    Run the supervisor until it is terminated
+    """
+    loop = asyncio.get_event_loop()
+    supervisor = Supervisor(loop, configfile, directory)
+    loop.run_until_complete(supervisor.start())
+    loop.add_signal_handler(signal.SIGHUP, lambda: loop.create_task(supervisor.reload()))
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # a second signal (e.g. systemd or timeout repeating SIGTERM) must not
+        # interrupt the teardown
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, lambda: None)
+        loop.run_until_complete(supervisor.teardown())
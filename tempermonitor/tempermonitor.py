@@ -17,15 +17,63 @@ Open issues:
 - Integrate USB Sensors
 """
 
+import argparse
 import asyncio
 import configparser
-import sys
+import signal
 import time
+from collections import Counter
 from datetime import datetime
-import serial_asyncio
-import serial
 
-from .plugins import PLUGINS
+from .eventbus import EventBus
+from .filters import SensorFilter
+from .history import History, history_size
+from .metrics import Metric
+from .plugins import find_plugin
+from .replay import ReplayBus
+from .rollup import RollupEngine
+from .rules import RuleEngine
+from .serialbus import SerialBus, bus_sections
+from .timing import STAGES
+
+
+# All sections that do not describe a sensor, besides the serial buses
+KNOWN_SECTIONS = ['DEFAULT', 'serial', 'collectd', 'mail', 'warning', 'prometheus', 'general',
+                  'filter', 'recorder', 'groups', 'api']
+
+# Sensor options that do not configure the filter chain
+SENSOR_OPTIONS = ['name', 'calibration']
+
+
+def sensor_sections(config):
+    """
+    Return the one wire ids of all configured sensors, the sections of the
+    enabled plugins are skipped as well
+    """
+    plugins = {name.strip() for name in config['general'].get('plugins', '').split(',')}
+    return [section for section in config
+            if section not in KNOWN_SECTIONS and section not in plugins and
+            not section.startswith(('serial:', 'rule:'))]
+
+
+def sensor_settings(config, owid):
+    """
+    Return the name and calibration of a sensor, raise if they are missing
+    """
+    if 'name' not in config[owid] or 'calibration' not in config[owid]:
+        print(f"Invalid Config for: {owid}")
+        raise RuntimeError(f"Invalid Config for: {owid}")
+    return config[owid]['name'], config[owid]['calibration']
+
+
+def section_dict(config, section, exclude=()):
+    """
+    The raw options of a section, to detect changes
+    """
+    if not config.has_section(section):
+        return None
+    return {key: value for key, value in config.items(section, raw=True)
+            if key not in exclude}
 
 
 class Sensor:
@@ -36,51 +84,74 @@ class Sensor:
     def __init__(self, config, owid):
         self.temperature = None
         self.last_update = 0
+        self.last_seen = 0
+        self.source = None
+        # (bus, index of the block of that bus) the sensor was last seen in
+        self.seen_block = None
         self.calibration = 0
         self.valid = True
+        self.history = History(history_size(config))
+        self.filter = SensorFilter(config, owid)
 
         if owid not in config:
             print(f"Invalid Config: missing section {owid}")
             return
 
-        if 'name' not in config[owid] or 'calibration' not in config[owid]:
-            print(f"Invalid Config for: {owid}")
-            raise RuntimeError(f"Invalid Config for: {owid}")
-
-        self.name = config[owid]['name']
-        self.calibration = config[owid]['calibration']
+        self.name, self.calibration = sensor_settings(config, owid)
 
-    def update(self, temperature):
+    def update(self, temperature, timestamp, source=None):
         """
-        Store a new measurement, and remember the time it was taken
+        Store a new measurement, and remember the time it was taken and the bus
+        it was received on
         """
         self.temperature = float(temperature)
-        self.last_update = time.time()
+        self.last_update = timestamp
+        self.last_seen = self.last_update
+        self.source = source
+        self.history.append(self.last_update, self.temperature)
 
 
 class TempMonitor:
     """
-    Interact with the esp-one-wire interface that sends:
+    Collect the measurements of one or more serial buses into one sensor table.
+
+    Every bus is configured in its own section: `[serial]` and/or any number of
+    `[serial:<name>]` sections. All buses feed the same sensors and a block is
+    stored as soon as every connected bus has finished its current block.
 
-    one-wire-id1 temperature
-    one-wire-id1 temperature
-    one-wire-id1 temperature
+    If a replay capture is given, it is read instead of the serial buses, using
+    the settings of the first bus. `clock` then returns the time of the capture.
 
-    followed by an empty line as data packet
+    `reload` re-reads the config file and applies the changes of the sensors
+    and plugins while the serial buses keep running.
+
+    `overrides` ({section: {option: value}}) take precedence over the config
+    file, e.g. for the sockets of a supervised worker.
     """
 
-    def __init__(self, loop, configfile):
+    def __init__(self, loop, configfile, replay=None, replay_speed=1.0, overrides=None):
         self.loop = loop or asyncio.get_event_loop()
+        self.clock = time.time
 
         self._configname = configfile
+        self.overrides = overrides or {}
         self.config = configparser.ConfigParser()
         self.config.read(configfile)
+        self._apply_overrides(self.config)
 
         self.plugins = []
+        self.eventbus = EventBus(self)
         self.sensors = {}
+        self.rollups = RollupEngine(self.config)
+        self.buses = []
         self._last_store = 0
-
-        self._reader, self._writer = (None, None)
+        self._blocks_done = set()
+        # bus name -> completed blocks
+        self._bus_blocks = Counter()
+        self._block_started = None
+        self._reload_lock = asyncio.Lock()
+        # plugin name -> failed reload() hooks
+        self.reload_failures = Counter()
 
         # Test if all necessary config fields are set, that are not part of the normal
         # startup
@@ -92,154 +163,360 @@ class TempMonitor:
             self.config['mail']['to'],
             self.config['mail']['to_urgent'],
             self.config['mail']['min_delay_between_messages'],
-            self.config['serial']['timeout'],
-            self.config['serial']['port'],
-            self.config['serial']['baudrate'],
         ]
+        for section in bus_sections(self.config):
+            configtest += [
+                self.config[section]['timeout'],
+                self.config[section]['port'],
+                self.config[section]['baudrate'],
+            ]
         del configtest
 
-        print("connecting to", self.config['serial']['port'])
-        for owid in self.config:
-            # Skip all known and predefined sections
-            if owid in ['DEFAULT', 'serial', 'collectd', 'mail', 'warning', 'prometheus', 'general']:
-                continue
+        sections = bus_sections(self.config)
+        if not sections:
+            raise RuntimeError("Invalid Config: no serial section")
+        if replay:
+            self.buses.append(ReplayBus(self, sections[0], replay, replay_speed))
+        else:
+            for section in sections:
+                self.buses.append(SerialBus(self, section))
+        self._buses_by_name = {bus.name: bus for bus in self.buses}
+
+        for owid in sensor_sections(self.config):
             self.sensors[owid] = Sensor(self.config, owid)
-        self._run_task = loop.create_task(self.run())
-
-    async def reconnect(self):
-        """
-        Connect to the ESP chip
-        """
-        try:
-            self._reader, self._writer = await serial_asyncio.open_serial_connection(
-                url=self.config['serial']['port'],
-                baudrate=self.config['serial']['baudrate'],
-                loop=self.loop)
-        except serial.SerialException:
-            print("Connection failed!")
-            self.loop.stop()
-            raise
-
-        # upon startup we only see garbage. (micropython starting up),
-        # also it will produce warnings if the recording is started in the middle
-        # of a message, so wait until the end of a message block to start the game
-        # If the baudrate is wrong during micropython startup - this will also be
-        # skiped.
-        while True:
-            try:
-                if (await self._reader.readline()).decode('ascii').strip() == "":
-                    break
-            except UnicodeError:
-                continue
 
-    async def run(self):
+        for bus in self.buses:
+            bus.start()
+
+    async def sensor_reading(self, bus, owid, temp):
         """
-        Read the protocol, update the sensors or trigger a collectd update
+        A bus has received a measurement for the given one wire id
         """
-        await self.reconnect()
-        last_valid_data_received = time.time()
-        line = ""
-        reconnected_on_error = False
-        while True:
-            # Wait for the next line
+        if self._block_started is None:
+            self._block_started = time.perf_counter()
+        sensor = self.sensors.get(owid, None)
+        if sensor and bus.standby and self._delivered_by_primary(sensor):
+            # The primary bus already delivered this sensor for the current block
+            return
 
-            if time.time() - last_valid_data_received > 10:
-                await self.call_plugin("err_no_valid_data", last_line=line)
-                if not reconnected_on_error:
-                    reconnected_on_error = True
-                    await self.reconnect()
+        if not sensor:
+            # If the sensor is new - notify the operators
+            print("Unknown sensor")
+            await self.call_plugin("err_unknown_sensor",
+                                   config=self._configname,
+                                   owid=owid,
+                                   temp=temp)
+        elif temp > 1000 or temp < -1000:
+            print("Sensor invalid")
+            sensor.valid = False
+            # if the sensor is giving bullshit data - notify the operators
+            await self.call_plugin("err_problem_sensor",
+                                   owid=owid,
+                                   name=sensor.name,
+                                   temp=temp)
+        else:
+            now = self.clock()
+            sensor.seen_block = (bus.name, self._bus_blocks[bus.name])
+            value, rejected_by = sensor.filter.process(now, temp)
+            if rejected_by is None:
+                sensor.valid = True
+                # in the unlikely event that everyting is fine: log the data
+                sensor.update(value, now, source=bus.name)
+                self.rollups.add(sensor.name, now, value)
+            else:
+                print(f"Sample {temp} of {sensor.name} rejected by filter {rejected_by}")
+                # A single glitch keeps the last value, but a sensor that is
+                # rejected persistently is broken
+                sensor.last_seen = now
+                if sensor.filter.persistent:
+                    sensor.valid = False
+                    await self.call_plugin("err_problem_sensor",
+                                           owid=owid,
+                                           name=sensor.name,
+                                           temp=temp)
 
-            try:
-                line = await asyncio.wait_for(
-                    self._reader.readline(),
-                    timeout=int(self.config['serial']['timeout']))
-                print("Received: ", line)
-            except asyncio.TimeoutError:
-                print("No Data")
-                await self.call_plugin("err_nodata")
+    def _delivered_by_primary(self, sensor):
+        """
+        Has the sensor been updated by a non-standby bus since the last store
+        """
+        if sensor.source is None or sensor.last_update <= self._last_store:
+            return False
+        source = self._buses_by_name.get(sensor.source)
+        return source is not None and not source.standby
+
+    async def block_done(self, bus):
+        """
+        A bus has received the empty line terminating a block.
+
+        The merged block is stored once all connected buses are done. If a bus
+        finishes a second block before the others, the lagging buses are not
+        waited for any longer. Their sensors are not missed by that, see
+        `_missed`.
+        """
+        self._bus_blocks[bus.name] += 1
+        if bus.name in self._blocks_done:
+            await self.store_sensors()
+
+        self._blocks_done.add(bus.name)
+        if all(other.name in self._blocks_done
+               for other in self.buses if other.connected):
+            await self.store_sensors()
+
+    def _missed(self, sensor):
+        """
+        Has the bus of the sensor completed a block without it. Buses do not
+        run at exactly the same rate, so the time of the last store can not
+        be used while the bus is connected. A sensor that was not seen yet or
+        whose bus is disconnected is missed if it was not seen since the last
+        store.
+        """
+        if sensor.seen_block is not None:
+            name, block = sensor.seen_block
+            bus = self._buses_by_name.get(name)
+            if bus is not None and bus.connected:
+                return self._bus_blocks[name] > block + 1
+        return sensor.last_seen <= self._last_store
+
+    async def teardown(self):
+        """ Terminate all started tasks """
+        for bus in self.buses:
+            await bus.stop()
+        await self.eventbus.teardown()
+        for plugin in self.plugins:
+            teardown = getattr(plugin, 'teardown', None)
+            if teardown:
+                await teardown()
+
+    def add_plugin(self, plugin):
+        """
+        Register a plugin and start its event worker
+        """
+        self.plugins.append(plugin)
+        self.eventbus.add_plugin(plugin)
+
+    async def remove_plugin(self, plugin):
+        """
+        Stop the event worker of a plugin and tear it down
+        """
+        self.plugins.remove(plugin)
+        await self.eventbus.remove_plugin(plugin.name)
+        teardown = getattr(plugin, 'teardown', None)
+        if teardown:
+            await teardown()
+
+    def active_plugins(self, config=None):
+        """
+        Names of the plugins enabled in the config
+        """
+        config = config or self.config
+        return [name.strip() for name in config["general"]["plugins"].split(",")
+                if name.strip()]
+
+    def load_plugins(self):
+        """
+        Load the plugins enabled in the config that are not loaded yet. Only
+        the modules of these plugins are imported, their optional async
+        `start()` runs in the background.
+        """
+        active_plugins = self.active_plugins()
+        print(f"Active plugins: {active_plugins}")
+
+        loaded = {plugin.name for plugin in self.plugins}
+        for name in active_plugins:
+            if name in loaded:
                 continue
-            except serial.SerialException as exc:
-                print("Problem with the serial connection - reconnecting: ", exc)
-                await self.reconnect()
+            plugin = find_plugin(name)
+            if plugin is None:
+                print(f"Unknown plugin: {name}")
                 continue
+            self.add_plugin(plugin(self))
+            print(f"Loaded plugin: {name}")
 
-            try:
-                line = line.decode('ascii').strip()
-            except UnicodeError:
-                print("Unicode error")
-                continue
-            # print("recv:", line)
+    async def unload_plugins(self):
+        """
+        Remove the plugins that are no longer enabled in the config
+        """
+        active_plugins = self.active_plugins()
+        for plugin in list(self.plugins):
+            if plugin.name not in active_plugins:
+                await self.remove_plugin(plugin)
+                print(f"Removed plugin: {plugin.name}")
 
-            if line == '':
-                # Block has ended
-                print("Done block, storing sensors")
-                await self.store_sensors()
-                print("Done")
-                continue
+    async def reload(self):
+        """
+        Re-read the config file and apply the differences.
 
-            # Try to parse the line
+        Sensors are added, removed or renamed, a sensor whose section was
+        replaced by one with the same name (e.g. a swapped sensor) keeps the
+        history. Plugins are loaded or removed and the remaining ones get their
+        optional `reload()` hook called. The config object is updated in place,
+        so plugins keeping a reference see the new values. The settings of the
+        plugins are checked before with their optional `check_config(config)`.
+
+        The serial buses and the recorder are not touched, their changes need a
+        restart. If the new config is invalid, nothing is changed.
+        """
+        async with self._reload_lock:
+            print(f"Reloading config from {self._configname}")
+            config = configparser.ConfigParser()
             try:
-                owid, temp = line.split(' ')
-                temp = float(temp)
-            except ValueError as exc:
-                print("Invaid line received: {}\n{}".format(line, exc))
+                with open(self._configname) as configfile:
+                    text = configfile.read()
+                config.read_string(text)
+                self._apply_overrides(config)
+                config['general']['plugins']
+                RuleEngine(config, RollupEngine(config).groups)
+                for name in self.active_plugins(config):
+                    check_config = getattr(find_plugin(name), 'check_config', None)
+                    if check_config:
+                        check_config(config)
+                sensors, changes = self._reload_sensors(config)
+            except (OSError, KeyError, ValueError, RuntimeError, configparser.Error) as exc:
+                print(f"Invalid config, not reloading: {exc!r}")
+                return
+
+            for section in set(bus_sections(self.config) + bus_sections(config) + ['recorder']):
+                if section_dict(self.config, section) != section_dict(config, section):
+                    print(f"Changes of [{section}] are applied on restart")
+
+            self.config.defaults().clear()
+            for section in self.config.sections():
+                self.config.remove_section(section)
+            self.config.read_string(text)
+            self._apply_overrides(self.config)
+
+            self._apply_sensors(sensors, changes)
+            self.sensors.clear()
+            self.sensors.update(sensors)
+            self.rollups.configure(self.config)
+
+            await self.unload_plugins()
+            # new plugins read the new config anyway
+            previous = list(self.plugins)
+            self.load_plugins()
+            for plugin in previous:
+                reload = getattr(plugin, 'reload', None)
+                try:
+                    if asyncio.iscoroutinefunction(reload):
+                        await reload()
+                    elif reload:
+                        reload()
+                except Exception as exc:
+                    # the other plugins still get the new settings
+                    self.reload_failures[plugin.name] += 1
+                    print(f"Plugin {plugin.name} failed to reload: {exc!r}")
+
+    def _apply_overrides(self, config):
+        for section, options in self.overrides.items():
+            if not config.has_section(section):
+                config.add_section(section)
+            config[section].update(options)
+
+    def _reload_sensors(self, config):
+        """
+        Build the sensor table for the new config, keeping the state of
+        unchanged sensors. The existing sensors are not modified, their new
+        settings are returned as changes for `_apply_sensors`.
+        """
+        owids = sensor_sections(config)
+        sensors = {}
+        changes = []
+        for owid in owids:
+            name, calibration = sensor_settings(config, owid)
+            sensor = self.sensors.get(owid)
+            if sensor is None:
+                sensors[owid] = Sensor(config, owid)
                 continue
-
-            ## we have at least a valid line
-            last_valid_data_received = time.time()
-            reconnected_on_error = False
-
-            sensor = self.sensors.get(owid, None)
-            if not sensor:
-                # If the sensor is new - notify the operators
-                print("Unknown sensor")
-                await self.call_plugin("err_unknown_sensor",
-                                       config=self._configname,
-                                       owid=owid,
-                                       temp=temp)
-            elif temp > 1000 or temp < -1000:
-                print("Sensor invalid")
-                sensor.valid = False
-                # if the sensor is giving bullshit data - notify the operators
-                await self.call_plugin("err_problem_sensor",
-                                       owid=owid,
-                                       name=sensor.name,
-                                       temp=temp)
+            sensor_filter = None
+            if section_dict(self.config, 'filter') != section_dict(config, 'filter') or \
+               section_dict(self.config, owid, SENSOR_OPTIONS) != \
+               section_dict(config, owid, SENSOR_OPTIONS):
+                sensor_filter = SensorFilter(config, owid)
+            changes.append((sensor, name, calibration, sensor_filter))
+            sensors[owid] = sensor
+        return sensors, changes
+
+    def _apply_sensors(self, sensors, changes):
+        """
+        Apply the result of `_reload_sensors` once the new config is known to
+        be valid
+        """
+        removed = {sensor.name: sensor for owid, sensor in self.sensors.items()
+                   if owid not in sensors}
+        now = self.clock()
+        for owid, sensor in sensors.items():
+            if owid in self.sensors:
+                continue
+            replaced = removed.pop(sensor.name, None)
+            if replaced:
+                print(f"Sensor {sensor.name} is now {owid}")
+                sensor.history = replaced.history
             else:
-                sensor.valid = True
-                # in the unlikely event that everyting is fine: log the data
-                sensor.update(temp)
-
-    async def teardown(self):
-        """ Terminate all started tasks """
-        self._run_task.cancel()
-        try:
-            await self._run_task
-        except asyncio.CancelledError:
-            pass
+                print(f"Added sensor {sensor.name} ({owid})")
+            # do not report the new sensor as missed in the current block
+            sensor.last_seen = now
+        for name in removed:
+            print(f"Removed sensor {name}")
+
+        for sensor, name, calibration, sensor_filter in changes:
+            if sensor.name != name:
+                print(f"Renamed sensor {sensor.name} to {name}")
+            sensor.name, sensor.calibration = name, calibration
+            if sensor_filter:
+                sensor.filter = sensor_filter
 
     async def call_plugin(self, call, *args, **kwargs):
         """
-        Call the given method on all plugins, proxying arguments
+        Call the given method on all plugins, proxying arguments.
+
+        The call is only queued for every plugin, this never waits for a plugin
+        to finish.
+        """
+        self.eventbus.emit(call, *args, **kwargs)
+
+    def metrics(self):
         """
-        result = {}
+        Collect the internal metrics of the monitor and all plugins
+        """
+        yield from self.eventbus.metrics()
+        yield from self.rollups.metrics()
+        yield from STAGES.metrics()
+        for name, count in self.reload_failures.items():
+            yield Metric('tempermonitor_plugin_reload_failures',
+                         "Plugins that failed to apply a reloaded config", 'counter',
+                         {'plugin': name}, count)
+        for bus in self.buses:
+            yield from bus.metrics()
+        for sensor in self.sensors.values():
+            if not sensor.filter.stages:
+                continue
+            labels = {'sensor': sensor.name}
+            yield Metric('tempermonitor_sensor_samples_accepted',
+                         "Samples that passed the sensor filter", 'counter',
+                         labels, sensor.filter.accepted)
+            for stage in sensor.filter.stages:
+                yield Metric('tempermonitor_sensor_samples_rejected',
+                             "Samples rejected by the sensor filter", 'counter',
+                             dict(labels, stage=stage.name),
+                             sensor.filter.rejected[stage.name])
         for plugin in self.plugins:
-            func = getattr(plugin, call, None)
-            if func:
-                if asyncio.iscoroutinefunction(func):
-                    result[plugin.name] = await func(*args, **kwargs)
-                else:
-                    result[plugin.name] = func(*args, **kwargs)
+            metrics = getattr(plugin, 'metrics', None)
+            if metrics:
+                yield from metrics()
 
     async def store_sensors(self):
         """
         Prepare the sensors to be stored and maybe send an email
         """
+        started = time.perf_counter()
+        if self._block_started is not None:
+            STAGES.observe('block', started - self._block_started)
+            self._block_started = None
         sensorstr = "measurements: "
         for owid, sensor in self.sensors.items():
             if sensor.valid:
                 sensorstr += "{}: {}; ".format(sensor.name, sensor.temperature)
-                if sensor.last_update <= self._last_store:
+                if self._missed(sensor):
                     sensor.valid = False
                     isotime = datetime.utcfromtimestamp(sensor.last_update).isoformat()
                     await self.call_plugin("err_missed_sensor",
@@ -250,36 +527,79 @@ class TempMonitor:
                 sensorstr += "{}: INVALID; ".format(sensor.name)
 
         print(sensorstr)
+        for resolution, start, sensors, groups in self.rollups.pop_closed():
+            await self.call_plugin("rollup_closed", resolution=resolution, start=start,
+                                   sensors=sensors, groups=groups)
         await self.call_plugin("sensor_update")
-        self._last_store = time.time()
+        self._last_store = self.clock()
+        self._blocks_done.clear()
+        STAGES.observe('store', time.perf_counter() - started)
 
 
 def main():
     """
     Start the tempmonitor
     """
-    loop = asyncio.get_event_loop()
+    parser = argparse.ArgumentParser(description="Temperature monitoring daemon")
+    parser.add_argument("config", nargs="?", default="/etc/tempermonitor.ini",
+                        help="config file (default: %(default)s)")
+    parser.add_argument("--replay", metavar="CAPTURE",
+                        help="read a recorded serial capture instead of the serial ports")
+    parser.add_argument("--speed", default="1",
+                        help="replay speed: factor of real time or 'max' (default: 1)")
+    parser.add_argument("--supervise", metavar="DIRECTORY",
+                        help="run one worker per site config (*.ini) in the directory, "
+                             "the config file then configures the supervisor")
+    parser.add_argument("--metrics-socket", metavar="PATH", help=argparse.SUPPRESS)
+    parser.add_argument("--mail-socket", metavar="PATH", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.supervise:
+        from . import supervisor
+        supervisor.main(args.config, args.supervise)
+        return
+
+    # set by the supervisor for its workers
+    overrides = {}
+    if args.metrics_socket:
+        overrides['prometheus'] = {'path': args.metrics_socket}
+    if args.mail_socket:
+        overrides['mail'] = {'delivery_socket': args.mail_socket}
+
+    speed = None
+    if args.speed != "max":
+        speed = float(args.speed)
 
-    configfile = "/etc/tempermonitor.ini"
-    if len(sys.argv) == 2:
-        configfile = sys.argv[1]
+    loop = asyncio.get_event_loop()
 
+    configfile = args.config
     print(f"Configuring temperature monitoring system from {configfile}.")
-    monitor = TempMonitor(loop, configfile)
-
-    active_plugins = monitor.config["general"]["plugins"].split(",")
-    print(f"Active plugins: {active_plugins}")
-
-    for plugin in active_plugins:
-        if plugin in PLUGINS:
-            p = PLUGINS[plugin](monitor)
-            monitor.plugins.append(p)
-            print(f"Loaded plugin: {plugin}")
+    monitor = TempMonitor(loop, configfile, replay=args.replay, replay_speed=speed,
+                          overrides=overrides)
+
+    monitor.load_plugins()
+    loop.add_signal_handler(signal.SIGHUP, lambda: loop.create_task(monitor.reload()))
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    profiler = None
+
+    def toggle_profiler():
+        # only imported when needed, it pulls in cProfile and tracemalloc
+        nonlocal profiler
+        if profiler is None:
+            from .profiler import Profiler
+            profiler = Profiler(monitor.config)
+        profiler.toggle()
+    loop.add_signal_handler(signal.SIGUSR1, toggle_profiler)
 
     try:
         loop.run_forever()
     except KeyboardInterrupt:
         pass
     finally:
+        # a second signal (e.g. systemd or timeout repeating SIGTERM) must not
+        # interrupt the teardown
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, lambda: None)
+        if profiler and profiler.running:
+            profiler.stop()
         loop.run_until_complete(monitor.teardown())
-
@@ -0,0 +1,79 @@
+"""
+Latency histograms of the processing stages.
+
+The code of a stage measures its own duration with `time.perf_counter()` and
+hands it to `STAGES.observe(stage, seconds)`. The histograms are exported as
+`tempermonitor_stage_seconds` with a `stage` label:
+
+* read: handling of the received bytes of a bus, from the read returning to
+  all completed blocks being handed to the monitor
+* record: writing the received bytes to the recorder
+* parse: decoding the received bytes into blocks
+* readings: filtering and storing the readings of one block
+* block: from the first reading of a block to storing it
+* store: storing a block and emitting its plugin calls
+* collectd_flush, mail_send, mail_relay, http_request: outbound I/O
+
+The duration of every plugin callback and the time events wait in the plugin
+queues are measured by the event bus.
+"""
+
+from bisect import bisect_left
+
+from .metrics import Metric
+
+# seconds, the last bucket is +Inf
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    Count observations into fixed buckets
+    """
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def buckets(self):
+        """
+        The cumulative (upper bound, count) of all buckets, prometheus style
+        """
+        result = []
+        total = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            total += count
+            result.append(('+Inf' if bound == float('inf') else str(bound), total))
+        return result
+
+
+class Stages:
+    """
+    The histograms of all stages
+    """
+
+    def __init__(self):
+        self.histograms = {}
+
+    def observe(self, stage, seconds):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = Histogram()
+        histogram.observe(seconds)
+
+    def metrics(self):
+        for stage, histogram in self.histograms.items():
+            yield Metric('tempermonitor_stage_seconds', "Duration of the processing stages",
+                         'histogram', {'stage': stage}, histogram)
+
+
+STAGES = Stages()
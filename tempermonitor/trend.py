@@ -0,0 +1,94 @@
+"""
+Sliding window linear regression to predict threshold crossings.
+
+The regression sums over the samples of the last `window` seconds are updated
+when a sample is added or leaves the window, so every sample costs O(1).
+Timestamps are taken relative to an origin that moves along with the window to
+keep the sums numerically stable.
+"""
+
+from collections import deque
+
+
+class Trend:
+    """
+    Least squares fit of the samples of the last `window` seconds
+    """
+
+    def __init__(self, window, min_samples=10):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples = deque()
+        self._origin = 0.0
+        self._evicted = 0
+        self._n = 0
+        self._st = self._sv = self._stt = self._stv = 0.0
+
+    def __len__(self):
+        return self._n
+
+    def add(self, timestamp, value):
+        """
+        Add a sample, samples must be added in ascending time
+        """
+        samples = self._samples
+        if samples and timestamp <= samples[-1][0]:
+            return
+        if not samples:
+            self._origin = timestamp
+        samples.append((timestamp, value))
+        self._sum(timestamp, value, 1)
+
+        while timestamp - samples[0][0] > self.window:
+            self._sum(*samples.popleft(), -1)
+            self._evicted += 1
+        if self._evicted >= len(samples):
+            self._rebase()
+
+    def _sum(self, timestamp, value, sign):
+        t = timestamp - self._origin
+        self._n += sign
+        self._st += sign * t
+        self._sv += sign * value
+        self._stt += sign * t * t
+        self._stv += sign * t * value
+
+    def _rebase(self):
+        """
+        Move the origin to the oldest sample and recompute the sums, this
+        happens once per window so it is O(1) per sample
+        """
+        self._evicted = 0
+        self._origin = self._samples[0][0]
+        self._n = 0
+        self._st = self._sv = self._stt = self._stv = 0.0
+        for timestamp, value in self._samples:
+            self._sum(timestamp, value, 1)
+
+    def fit(self):
+        """
+        Returns (slope per second, fitted value at the newest sample) or None
+        if there are not enough samples spanning at least half the window
+        """
+        if self._n < max(self.min_samples, 2) or \
+           self._samples[-1][0] - self._samples[0][0] < self.window / 2:
+            return None
+        denominator = self._n * self._stt - self._st * self._st
+        if denominator <= 0:
+            return None
+        slope = (self._n * self._stv - self._st * self._sv) / denominator
+        intercept = (self._sv - slope * self._st) / self._n
+        return slope, intercept + slope * (self._samples[-1][0] - self._origin)
+
+    def time_to_cross(self, threshold):
+        """
+        Seconds until the fitted line rises above the threshold, None if it is
+        not rising towards it or already above it
+        """
+        fit = self.fit()
+        if fit is None:
+            return None
+        slope, current = fit
+        if slope <= 0 or current >= threshold:
+            return None
+        return (threshold - current) / slope
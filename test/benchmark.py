@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+End-to-end ingestion benchmark of the tempermonitor.
+
+Drives a complete TempMonitor with a synthetic sensor feed and local mock
+sinks and reports throughput, latency from writing a block to the plugins
+seeing it, CPU time per block and memory growth.
+
+The feed is written either through a pty (the real serial path) or directly
+into the readers stream buffer (`--transport memory`). The collectd, SMTP and
+prometheus sinks run in a separate process, so their CPU time is not
+accounted to the daemon.
+
+Example:
+
+    python3 benchmark.py --sensors 500 --rate 10 --duration 30
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tty
+import types
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tempermonitor.tempermonitor import TempMonitor  # noqa: E402
+from tempermonitor.plugins import Plugin, find_plugin  # noqa: E402
+
+SEQUENCE_SENSOR = 'ffffffffffffffff'
+
+
+class BenchProbe(Plugin):
+    """
+    Record when the plugins see a stored block
+    """
+
+    def __init__(self, monitor):
+        self.monitor = monitor
+        self.seen = {}
+
+    def sensor_update(self):
+        sensor = self.monitor.sensors[SEQUENCE_SENSOR]
+        if sensor.temperature is not None:
+            self.seen.setdefault(int(sensor.temperature), time.perf_counter())
+
+
+def sensor_id(index):
+    return "{:016x}".format(index + 1)
+
+
+def write_config(directory, args):
+    """
+    Config with all plugins pointing to the mock sinks
+    """
+    names = ["bench{}".format(i) for i in range(args.sensors)]
+    half = max(1, args.sensors // 2)
+    lines = [
+        "[general]",
+        "plugins=benchprobe,{}".format(args.plugins),
+        "history_size={}".format(args.history),
+        "",
+        "[serial]",
+        "port=PORT",
+        "baudrate=115200",
+        "timeout=10",
+        "",
+        "[filter]",
+        "stages={}".format(args.filters),
+        "",
+        "[collectd]",
+        "socketpath={}/collectd.sock".format(directory),
+        "hostname=bench",
+        "interval=1",
+        "",
+        "[prometheus]",
+        "sensor_metric_name=bench_temperature",
+        "aggregated_metric_name=bench_temperature_agg",
+        "address=localhost",
+        "port={}".format(args.prometheus_port),
+        "",
+        "[mail]",
+        "from=bench@localhost",
+        "to=bench@localhost",
+        "to_urgent=bench@localhost",
+        "min_delay_between_messages=3600",
+        "smtp_host=localhost",
+        "smtp_port={}".format(args.smtp_port),
+        "spool_dir={}/spool".format(directory),
+        "",
+        "[warning]",
+        "floor_sensors={}".format(",".join(names[:half])),
+        "ceiling_sensors={}".format(",".join(names[half:] or names)),
+        "min_ceiling_warning=35",
+        "floor_ceiling_diff=15",
+        "ceiling_warning_level=40",
+        "ceiling_critical_level=45",
+        "",
+        "[{}]".format(SEQUENCE_SENSOR),
+        "name=sequence",
+        "calibration=0",
+        "",
+    ]
+    for index, name in enumerate(names):
+        lines += ["[{}]".format(sensor_id(index)), "name={}".format(name),
+                  "calibration=0", ""]
+    path = os.path.join(directory, "bench.ini")
+    with open(path, "w") as configfile:
+        configfile.write("\n".join(lines))
+    return path
+
+
+def make_block(sequence, sensors):
+    lines = ["{} {:.2f}".format(sensor_id(index), 20 + random.random() * 5)
+             for index in range(sensors)]
+    lines.append("{} {}".format(SEQUENCE_SENSOR, sequence))
+    return ("\n".join(lines) + "\n\n").encode('ascii')
+
+
+def run_sinks(directory, smtp_port, prometheus_port, stop):
+    """
+    Mock collectd, SMTP and a prometheus scraper, run in a separate process
+    """
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import smtpmock
+
+    scrapes = []
+
+    async def collectd(reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            writer.write(b"0 Success: 1 value has been dispatched.\n")
+
+    def scrape():
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                urllib.request.urlopen(
+                    "http://localhost:{}/metrics".format(prometheus_port), timeout=5).read()
+                scrapes.append(time.perf_counter() - start)
+            except OSError:
+                pass
+            time.sleep(1)
+
+    async def main():
+        collectd_server = await asyncio.start_unix_server(
+            collectd, path=os.path.join(directory, "collectd.sock"))
+        smtp_server = await asyncio.start_server(smtpmock.handle, 'localhost', smtp_port)
+        scraper = threading.Thread(target=scrape, daemon=True)
+        scraper.start()
+        while not stop.is_set():
+            await asyncio.sleep(0.1)
+        collectd_server.close()
+        smtp_server.close()
+
+    # the mock prints every mail, keep the benchmark output readable
+    sys.stdout = open(os.devnull, "w")
+    asyncio.run(main())
+    if scrapes:
+        scrapes.sort()
+        with open(os.path.join(directory, "scrapes.json"), "w") as result:
+            json.dump({'count': len(scrapes), 'p50': scrapes[len(scrapes) // 2],
+                       'max': scrapes[-1]}, result)
+
+
+def rss_kib():
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def pty_feeder(fd, args, written, stop):
+    interval = 1 / args.rate
+    os.write(fd, b"startup garbage\n\n")
+    next_block = time.perf_counter()
+    for sequence in range(args.blocks):
+        if stop.is_set():
+            break
+        block = make_block(sequence, args.sensors)
+        written[sequence] = time.perf_counter()
+        os.write(fd, block)
+        next_block += interval
+        time.sleep(max(0, next_block - time.perf_counter()))
+
+
+async def memory_feeder(bus, args, written):
+    interval = 1 / args.rate
+    while bus._reader is None:
+        await asyncio.sleep(0.01)
+    bus._reader.feed_data(b"startup garbage\n\n")
+    next_block = time.perf_counter()
+    for sequence in range(args.blocks):
+        block = make_block(sequence, args.sensors)
+        written[sequence] = time.perf_counter()
+        bus._reader.feed_data(block)
+        next_block += interval
+        await asyncio.sleep(max(0, next_block - time.perf_counter()))
+
+
+async def memory_reconnect(bus):
+    """
+    Replaces SerialBus.reconnect for the in-memory transport
+    """
+    bus._reader = asyncio.StreamReader()
+    bus._writer = None
+    bus.connected = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sensors", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=10, help="blocks per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--transport", choices=["pty", "memory"], default="pty")
+    parser.add_argument("--plugins", default="collectd,mail,prometheus,warnings")
+    parser.add_argument("--filters", default="poweron,rate,outlier")
+    parser.add_argument("--history", type=int, default=86400)
+    parser.add_argument("--smtp-port", type=int, default=18025)
+    parser.add_argument("--prometheus-port", type=int, default=19299)
+    parser.add_argument("--json", action="store_true", help="print the results as json")
+    args = parser.parse_args()
+    args.blocks = int(args.rate * args.duration)
+
+    directory = tempfile.mkdtemp(prefix="tempermonitor-bench-")
+    configfile = write_config(directory, args)
+
+    stop = multiprocessing.Event()
+    sinks = multiprocessing.Process(
+        target=run_sinks, args=(directory, args.smtp_port, args.prometheus_port, stop))
+    sinks.start()
+    time.sleep(0.5)
+
+    written = {}
+    if args.transport == "pty":
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        with open(configfile) as configcontent:
+            config = configcontent.read().replace("port=PORT", "port=" + os.ttyname(slave))
+        with open(configfile, "w") as configcontent:
+            configcontent.write(config)
+
+    # the daemon prints every block, keep the benchmark output readable
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    rss_start = rss_kib()
+    monitor = TempMonitor(loop, configfile)
+    for name in monitor.config["general"]["plugins"].split(","):
+        monitor.add_plugin(find_plugin(name)(monitor))
+    probe = monitor.plugins[0]
+
+    if args.transport == "pty":
+        feeder = threading.Thread(target=pty_feeder, args=(master, args, written, stop),
+                                  daemon=True)
+        feeder.start()
+    else:
+        bus = monitor.buses[0]
+        bus.reconnect = types.MethodType(memory_reconnect, bus)
+        loop.create_task(memory_feeder(bus, args, written))
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    loop.run_until_complete(asyncio.sleep(args.duration + 1))
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    rss_end = rss_kib()
+
+    stop.set()
+    loop.run_until_complete(monitor.teardown())
+    sinks.join()
+    sys.stdout = stdout
+
+    latencies = sorted(probe.seen[sequence] - written[sequence]
+                       for sequence in probe.seen if sequence in written)
+    blocks = len(latencies)
+    results = {
+        'transport': args.transport,
+        'sensors': args.sensors,
+        'rate': args.rate,
+        'blocks_written': len(written),
+        'blocks_seen': blocks,
+        'values_per_second': blocks * (args.sensors + 1) / wall,
+        'latency_p50_ms': percentile(latencies, 0.5) * 1000,
+        'latency_p90_ms': percentile(latencies, 0.9) * 1000,
+        'latency_p99_ms': percentile(latencies, 0.99) * 1000,
+        'latency_max_ms': percentile(latencies, 1) * 1000,
+        'cpu_per_block_ms': cpu / max(blocks, 1) * 1000,
+        'cpu_utilisation': cpu / wall,
+        'rss_start_kib': rss_start,
+        'rss_end_kib': rss_end,
+        'rss_growth_kib': rss_end - rss_start,
+        'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    try:
+        with open(os.path.join(directory, "scrapes.json")) as scrapes:
+            scrape = json.load(scrapes)
+        results['scrapes'] = scrape['count']
+        results['scrape_p50_ms'] = scrape['p50'] * 1000
+        results['scrape_max_ms'] = scrape['max'] * 1000
+    except (OSError, ValueError):
+        pass
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for key, value in results.items():
+            if isinstance(value, float):
+                value = "{:.2f}".format(value)
+            print("{:<20} {}".format(key, value))
+
+
+if __name__ == '__main__':
+    main()
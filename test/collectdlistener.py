@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Receive the datagrams of the collectd network transport and print the values.
+
+Stands in for the network plugin of collectd to check `transport=network` of
+the collectd plugin. With `--user` only datagrams signed by one of the given
+users are accepted.
+
+Example, against `server=localhost`, `security_level=sign`, `username=temp`
+and `password=secret` in `[collectd]`:
+
+    python3 collectdlistener.py --port 25826 --user temp:secret
+"""
+
+import argparse
+import os
+import socket
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tempermonitor.collectdnet import DEFAULT_PORT, decode  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--address", default="localhost")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--user", action="append",
+                        help="username:password of a user allowed to sign, can be repeated")
+    parser.add_argument("--count", type=int, default=0,
+                        help="exit after this many values, 0 runs forever")
+    args = parser.parse_args()
+
+    users = None
+    if args.user:
+        users = dict(user.split(':', 1) for user in args.user)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((args.address, args.port))
+    received = 0
+    while not args.count or received < args.count:
+        packet, sender = sock.recvfrom(65535)
+        try:
+            values = decode(packet, users)
+        except (ValueError, UnicodeDecodeError) as exc:
+            print("Rejected datagram from {}: {}".format(sender, exc))
+            continue
+        print("Datagram of {} bytes with {} values".format(len(packet), len(values)))
+        for host, identifier, timestamp, interval, value in values:
+            print('PUTVAL "{}/{}" interval={:g} {:.0f}:{}'.format(
+                host, identifier, interval, timestamp, ':'.join(str(v) for v in value)))
+        received += len(values)
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
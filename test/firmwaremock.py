@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Run the MicroPython firmware on the host against simulated 1-wire buses.
+
+`machine`, `onewire`, `ds18x20` and the micropython variants of the standard
+modules are replaced by mocks running on a virtual clock: a conversion takes
+the typical time of its resolution, reading a scratchpad takes a few ms. The
+output of the firmware is parsed with the decoders of the daemon and every
+round is checked to contain all sensors. test_firmware.py runs the same
+simulation unattended.
+
+Example, one 12 bit bus with 8 sensors and one 9 bit bus with 4 sensors:
+
+    python3 firmwaremock.py --bus 12:8 --bus 9:4 --protocol binary
+"""
+
+import argparse
+import binascii
+import os
+import struct
+import sys
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tempermonitor.protocol import BinaryDecoder, TextDecoder, HANDSHAKE  # noqa: E402
+
+# typical conversion time per resolution, the datasheet maximum is used by the firmware
+TYPICAL_CONVERSION_MS = {9: 70, 10: 140, 11: 280, 12: 560}
+SCRATCHPAD_READ_MS = 6
+
+
+class Finished(Exception):
+    pass
+
+
+class Clock:
+    """
+    The virtual clock, replaces `time` in the firmware
+    """
+
+    def __init__(self, duration_ms):
+        self.now = 0
+        self.duration_ms = duration_ms
+
+    def ticks_ms(self):
+        return self.now
+
+    @staticmethod
+    def ticks_add(ticks, delta):
+        return ticks + delta
+
+    @staticmethod
+    def ticks_diff(ticks1, ticks2):
+        return ticks1 - ticks2
+
+    def sleep_ms(self, ms):
+        self.advance(ms)
+
+    def advance(self, ms):
+        self.now += ms
+        if self.now > self.duration_ms:
+            raise Finished()
+
+
+class OneWire:
+    """
+    One pin with the simulated sensors
+    """
+    buses = {}
+
+    def __init__(self, pin):
+        self.roms = OneWire.buses[pin.id]
+        self.resolution = 12
+        self.conversion_done = 0
+
+    def readbit(self):
+        return int(CLOCK.now >= self.conversion_done)
+
+
+class DS18X20:
+    def __init__(self, ow):
+        self.ow = ow
+        self.reads = 0
+
+    def scan(self):
+        return list(self.ow.roms)
+
+    def write_scratchpad(self, rom, buf):
+        self.ow.resolution = ((buf[2] >> 5) & 3) + 9
+
+    def convert_temp(self):
+        self.ow.conversion_done = CLOCK.now + TYPICAL_CONVERSION_MS[self.ow.resolution]
+
+    def read_temp(self, rom):
+        CLOCK.advance(SCRATCHPAD_READ_MS)
+        self.reads += 1
+        if CLOCK.now < self.ow.conversion_done:
+            raise Exception("conversion not finished")
+        return 20 + rom[-1] / 16
+
+
+class Stdin:
+    """
+    Characters sent by the host, each (time in ms, text) becomes readable at
+    its time. Like on the device, readline blocks until a line end arrives.
+    """
+
+    def __init__(self, sent=()):
+        self.sent = list(sent)
+        self.data = ''
+
+    def available(self):
+        while self.sent and self.sent[0][0] <= CLOCK.now:
+            self.data += self.sent.pop(0)[1]
+        return self.data
+
+    def read(self, count):
+        data, self.data = self.available()[:count], self.data[count:]
+        return data
+
+    def readline(self):
+        while '\n' not in self.available():
+            CLOCK.advance(1)
+        line, _, self.data = self.data.partition('\n')
+        return line + '\n'
+
+
+class Poll:
+    def register(self, stream, mask):
+        self.stream = stream
+
+    def poll(self, timeout):
+        return [(self.stream, 1)] if self.stream.available() else []
+
+
+class Stdout:
+    """
+    Collects everything the firmware writes, text and binary
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+        self.buffer = self
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.data += data
+
+
+def install_mocks(stdin, stdout):
+    machine = types.ModuleType('machine')
+    machine.Pin = lambda pin: types.SimpleNamespace(id=pin)
+    onewire = types.ModuleType('onewire')
+    onewire.OneWire = OneWire
+    ds18x20 = types.ModuleType('ds18x20')
+    ds18x20.DS18X20 = DS18X20
+    ubinascii = types.ModuleType('ubinascii')
+    ubinascii.hexlify = binascii.hexlify
+    ubinascii.crc32 = binascii.crc32
+    uselect = types.ModuleType('uselect')
+    uselect.poll = Poll
+    uselect.POLLIN = 1
+    sys.modules.update({'machine': machine, 'onewire': onewire, 'ds18x20': ds18x20,
+                        'ubinascii': ubinascii, 'ustruct': struct, 'uselect': uselect})
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    '..', 'micropython'))
+    import micropython as firmware
+    firmware.time = CLOCK
+    firmware.sys = types.SimpleNamespace(stdin=stdin, stdout=stdout)
+    firmware.print = lambda *args, end='\n': stdout.write(
+        ' '.join(str(arg) for arg in args) + end)
+    return firmware
+
+
+CLOCK = None
+
+
+def simulate(specs, duration=30, interval=0, protocol="text", host=None):
+    """
+    Run the firmware with one bus per (resolution, sensors) for `duration`
+    simulated seconds and decode its output. `host` lists the (time in ms,
+    text) sent by the host, by default the handshake of the protocol.
+    """
+    global CLOCK
+    buses = []
+    OneWire.buses = {}
+    for index, (resolution, sensors) in enumerate(specs):
+        pin = 13 + index
+        OneWire.buses[pin] = [bytes([0x28, index, 0, 0, 0, 0, 0, number])
+                              for number in range(sensors)]
+        buses.append((pin, resolution))
+
+    CLOCK = Clock(duration * 1000)
+    if host is None:
+        host = [(0, HANDSHAKE.decode())] if protocol == "binary" else []
+    stdin, stdout = Stdin(host), Stdout()
+    firmware = install_mocks(stdin, stdout)
+    firmware.ROUND_INTERVAL = interval
+
+    reader = firmware.reader(buses)
+    try:
+        reader.run()
+    except Finished:
+        pass
+
+    decoder = TextDecoder()
+    decoder.expect_handshake = bool(host)
+    blocks = decoder.feed(b"\n\n" + bytes(stdout.data))[1:]
+    text_blocks = len(blocks)
+    if decoder.handshake:
+        blocks += BinaryDecoder().feed(decoder.remaining())
+
+    roms = [rom for bus_roms in OneWire.buses.values() for rom in bus_roms]
+    return types.SimpleNamespace(
+        blocks=blocks,
+        handshake=decoder.handshake,
+        text_blocks=text_blocks,
+        expected={binascii.hexlify(rom).decode(): 20 + rom[-1] / 16 for rom in roms},
+        complete=sum(1 for block in blocks if len(block.values) == len(roms)),
+        errors=sum(1 for block in blocks for value in block.values.values() if value > 1000),
+        round_ms=duration * 1000 / max(len(blocks), 1),
+        sequential_ms=sum(firmware.CONVERSION_MS[resolution] for _, resolution in buses) +
+        len(roms) * SCRATCHPAD_READ_MS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bus", action="append", metavar="RESOLUTION:SENSORS",
+                        help="a bus with its resolution and number of sensors")
+    parser.add_argument("--duration", type=float, default=30, help="simulated seconds")
+    parser.add_argument("--interval", type=int, default=0, help="ROUND_INTERVAL in ms")
+    parser.add_argument("--protocol", choices=["text", "binary"], default="text")
+    args = parser.parse_args()
+
+    specs = [tuple(int(value) for value in spec.split(':')) for spec in args.bus or ["12:8"]]
+    result = simulate(specs, args.duration, args.interval, args.protocol)
+    blocks = result.blocks
+
+    print("rounds         {}".format(len(blocks)))
+    print("complete       {}".format(result.complete))
+    print("read errors    {}".format(result.errors))
+    print("round time     {:.1f} ms".format(result.round_ms))
+    print("sequential     {} ms".format(result.sequential_ms))
+    if result.complete != len(blocks) or result.errors or not blocks:
+        print("FAILED")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
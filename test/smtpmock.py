@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Minimal SMTP sink that prints every received mail.
+
+Usage: python3 smtpmock.py [port]   (default port 8025)
+Configure smtp_host=localhost and smtp_port=8025 in [mail] to use it.
+"""
+
+import asyncio
+import sys
+
+
+async def handle(reader, writer):
+    writer.write(b"220 localhost smtpmock\r\n")
+    in_data = False
+    data = []
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        if in_data:
+            if line in (b".\r\n", b".\n"):
+                in_data = False
+                print(b"".join(data).decode('utf-8', 'replace'))
+                print("-" * 72)
+                sys.stdout.flush()
+                data = []
+                writer.write(b"250 OK queued\r\n")
+            else:
+                data.append(line)
+            continue
+
+        command = line[:4].upper()
+        if command in (b"HELO", b"EHLO"):
+            writer.write(b"250 localhost\r\n")
+        elif command == b"DATA":
+            in_data = True
+            writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+        elif command == b"QUIT":
+            writer.write(b"221 Bye\r\n")
+            await writer.drain()
+            break
+        else:
+            # MAIL, RCPT, NOOP, RSET
+            writer.write(b"250 OK\r\n")
+        await writer.drain()
+    writer.close()
+
+
+async def main(port):
+    server = await asyncio.start_server(handle, 'localhost', port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 8025))
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Measure the import and startup time of the daemon.
+
+Every plugin set is started in a fresh interpreter against a pty, which stands
+in for the serial port. It reports the time to import the daemon, to create the
+monitor, to load the plugins and until all plugins have finished their async
+`start()`, together with the modules of the optional dependencies that were
+imported. It fails if a dependency of a disabled plugin was imported or if the
+startup took longer than `--max-startup-ms`. test_startup.py runs the same
+checks unattended.
+
+Example:
+
+    python3 startup.py --plugins "" --plugins warnings --plugins collectd,mail,prometheus,warnings
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tty
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# module -> plugin that is allowed to import it
+HEAVY_MODULES = {
+    'prometheus_client': 'prometheus',
+    'smtplib': 'mail',
+    'email.mime.text': 'mail',
+    'cProfile': None,
+    'tracemalloc': None,
+}
+
+PLUGIN_SETS = ["", "warnings", "collectd,mail,prometheus,warnings"]
+MAX_STARTUP_MS = 1000
+
+CONFIG = """
+[general]
+plugins={plugins}
+
+[serial]
+port={port}
+baudrate=115200
+timeout=100
+
+[collectd]
+socketpath={directory}/collectd.sock
+hostname=startup
+interval=1
+
+[prometheus]
+sensor_metric_name=startup_temperature
+aggregated_metric_name=startup_temperature_agg
+address=localhost
+port={prometheus_port}
+
+[api]
+address=localhost
+port={api_port}
+
+[mail]
+from=startup@localhost
+to=startup@localhost
+to_urgent=startup@localhost
+min_delay_between_messages=3600
+smtp_host=localhost
+smtp_port=1
+spool_dir={directory}/spool
+
+[warning]
+floor_sensors=floor
+ceiling_sensors=ceil
+min_ceiling_warning=35
+floor_ceiling_diff=15
+ceiling_warning_level=40
+ceiling_critical_level=45
+
+[0000000000000001]
+name=floor
+calibration=0
+
+[0000000000000002]
+name=ceil
+calibration=0
+"""
+
+
+def child(plugins, prometheus_port, api_port):
+    """
+    Start the daemon once and print the timings as json
+    """
+    begin = time.perf_counter()
+    from tempermonitor.tempermonitor import TempMonitor
+    imported = time.perf_counter()
+
+    directory = tempfile.mkdtemp(prefix="tempermonitor-startup-")
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    configfile = os.path.join(directory, "startup.ini")
+    with open(configfile, "w") as config:
+        config.write(CONFIG.format(plugins=plugins, port=os.ttyname(slave),
+                                   directory=directory, prometheus_port=prometheus_port,
+                                   api_port=api_port))
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    monitor = TempMonitor(loop, configfile)
+    created = time.perf_counter()
+    monitor.load_plugins()
+    loaded = time.perf_counter()
+
+    async def wait_started():
+        while any(worker.start_duration is None and hasattr(worker.plugin, 'start')
+                  for worker in monitor.eventbus.workers.values()):
+            await asyncio.sleep(0.001)
+    loop.run_until_complete(wait_started())
+    started = time.perf_counter()
+    loop.run_until_complete(monitor.teardown())
+    sys.stdout = stdout
+
+    print(json.dumps({
+        'plugins': plugins,
+        'import_ms': (imported - begin) * 1000,
+        'create_ms': (created - imported) * 1000,
+        'load_ms': (loaded - created) * 1000,
+        'start_ms': (started - loaded) * 1000,
+        'startup_ms': (started - begin) * 1000,
+        'modules': sorted(module for module in HEAVY_MODULES if module in sys.modules),
+    }))
+
+
+def measure(plugins, runs=5, prometheus_port=19399, api_port=19400):
+    """
+    Start the daemon `runs` times with the plugin set, returns the median run
+    """
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, __file__, "--child", plugins,
+             "--prometheus-port", str(prometheus_port), "--api-port", str(api_port)],
+            check=True, stdout=subprocess.PIPE).stdout
+        results.append(json.loads(output))
+    results.sort(key=lambda run: run['startup_ms'])
+    return results[len(results) // 2]
+
+
+def check(result, max_startup_ms):
+    """
+    The failures of a measured plugin set, empty if it passed
+    """
+    plugins = result['plugins']
+    failures = []
+    enabled = {name.strip() for name in plugins.split(',')}
+    unexpected = [module for module in result['modules']
+                  if HEAVY_MODULES[module] not in enabled]
+    if unexpected:
+        failures.append(f"{plugins or 'no plugins'} imported {', '.join(unexpected)}")
+    if result['startup_ms'] > max_startup_ms:
+        failures.append(f"{plugins or 'no plugins'} took {result['startup_ms']:.1f} ms")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--plugins", action="append",
+                        help="comma separated plugin set to start, can be repeated")
+    parser.add_argument("--runs", type=int, default=5, help="runs per plugin set")
+    parser.add_argument("--max-startup-ms", type=float, default=MAX_STARTUP_MS)
+    parser.add_argument("--prometheus-port", type=int, default=19399)
+    parser.add_argument("--api-port", type=int, default=19400)
+    parser.add_argument("--json", action="store_true", help="print the results as json")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        child(args.child, args.prometheus_port, args.api_port)
+        return
+
+    failed = False
+    results = []
+    for plugins in args.plugins or PLUGIN_SETS:
+        result = measure(plugins, args.runs, args.prometheus_port, args.api_port)
+        results.append(result)
+        for failure in check(result, args.max_startup_ms):
+            print(f"FAILED: {failure}")
+            failed = True
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print("{:<40} {:>9} {:>9} {:>9} {:>9} {:>10}  {}".format(
+            "plugins", "import", "create", "load", "start", "startup", "modules"))
+        for result in results:
+            print("{:<40} {:>7.1f}ms {:>7.1f}ms {:>7.1f}ms {:>7.1f}ms {:>8.1f}ms  {}".format(
+                result['plugins'] or "-", result['import_ms'], result['create_ms'],
+                result['load_ms'], result['start_ms'], result['startup_ms'],
+                ",".join(result['modules']) or "-"))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Tests of the batched PUTVALs of the collectd plugin against a fake unixsock
+server.
+
+    python3 -m unittest discover -s test -p 'test_*.py'
+"""
+
+import asyncio
+import configparser
+import os
+import sys
+import tempfile
+import types
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tempermonitor.plugins.collectd import Collectd  # noqa: E402
+
+
+class FakeCollectd:
+    """
+    Unixsock server answering every PUTVAL by the value it carries:
+    0 succeeds, 1 fails and 2 gets no reply
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lines = []
+        self.writers = []
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_unix_server(self.handle, path=self.path)
+
+    async def handle(self, reader, writer):
+        self.writers.append(writer)
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            self.lines.append(line.decode())
+            value = line.split(b':')[-1].strip()
+            if value == b'0':
+                writer.write(b"0 Success: 1 value has been dispatched.\n")
+            elif value == b'1':
+                writer.write(b"-1 Parse error\n")
+            await writer.drain()
+
+    async def close_connections(self):
+        for writer in self.writers:
+            writer.close()
+        self.writers = []
+
+    async def stop(self):
+        await self.close_connections()
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+
+class CollectdTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'collectd.sock')
+        config = configparser.ConfigParser()
+        config.read_dict({'collectd': {'socketpath': self.path, 'hostname': 'test',
+                                       'interval': '1'}})
+        self.loop = asyncio.new_event_loop()
+        monitor = types.SimpleNamespace(config=config, loop=self.loop, sensors={})
+        self.devnull = open(os.devnull, 'w')
+        self.stdout, sys.stdout = sys.stdout, self.devnull
+        self.collectd = Collectd(monitor)
+        self.server = FakeCollectd(self.path)
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.collectd.teardown())
+        self.loop.run_until_complete(self.server.stop())
+        sys.stdout = self.stdout
+        self.devnull.close()
+        self.loop.close()
+        self.tmp.cleanup()
+
+    def send(self, *values):
+        for value in values:
+            self.collectd._send(f"tail-temperature/temperature-{value}", 1, 1000, value)
+
+    async def wait_for(self, condition):
+        for _ in range(200):
+            if condition():
+                return
+            await asyncio.sleep(0.005)
+        self.fail("timed out")
+
+    def test_acks(self):
+        async def run():
+            await self.server.start()
+            self.send(0, 1, 0)
+            await self.collectd.flush()
+            await self.wait_for(lambda: len(self.server.lines) == 3)
+            await self.wait_for(lambda: not self.collectd._inflight)
+            self.assertEqual(self.collectd.sent, 3)
+            self.assertEqual(self.collectd.acked, 2)
+            self.assertEqual(dict(self.collectd.failures),
+                             {'tail-temperature/temperature-1': 1})
+
+            # collectd hangs, the value stays in flight until the connection is lost
+            self.send(2)
+            await self.collectd.flush()
+            await self.wait_for(lambda: len(self.server.lines) == 4)
+            self.assertEqual(list(self.collectd._inflight),
+                             ['tail-temperature/temperature-2'])
+            # a lost connection fails the unacked value, it is not resent
+            await self.server.close_connections()
+            await self.wait_for(lambda: self.collectd._writer is None)
+            self.assertEqual(self.collectd.failures['tail-temperature/temperature-2'], 1)
+            self.assertEqual(list(self.collectd._inflight), [])
+
+            self.send(0)
+            await self.collectd.flush()
+            await self.wait_for(lambda: self.collectd.acked == 3)
+            self.assertEqual(len(self.server.lines), 5)
+        self.loop.run_until_complete(run())
+
+    def test_retained_until_collectd_is_up(self):
+        async def run():
+            self.send(0, 0)
+            await self.collectd.flush()
+            self.assertEqual(self.collectd.sent, 0)
+            self.assertEqual(len(self.collectd._batch), 2)
+
+            await self.server.start()
+            self.send(0)
+            await self.collectd.flush()
+            await self.wait_for(lambda: self.collectd.acked == 3)
+            self.assertEqual(self.server.lines, [
+                'PUTVAL "test/tail-temperature/temperature-0" interval=1 1000:0\n'] * 3)
+            self.assertEqual(self.collectd._batch, [])
+        self.loop.run_until_complete(run())
+
+    def test_max_pending(self):
+        self.collectd.max_pending = 2
+        self.send(0, 1, 2)
+        self.assertEqual([value[3] for value in self.collectd._batch], [1, 2])
+        self.assertEqual(dict(self.collectd.failures), {'tail-temperature/temperature-0': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
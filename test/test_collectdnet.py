@@ -0,0 +1,92 @@
+"""
+Tests of the binary network protocol of collectd.
+
+    python3 -m unittest discover -s test -p 'test_*.py'
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tempermonitor.collectdnet import (  # noqa: E402
+    PacketEncoder, decode, split_identifier, DEFAULT_PACKET_SIZE)
+
+VALUES = [
+    ("tail-temperature/temperature-floor", 1, 1000, 21.5),
+    ("tail-temperature/temperature-ceil", 1, 1000, 35.25),
+    ("tail-rollup-60/temperature-ceil-max", 60, 1020, -3.0),
+]
+
+
+def decoded(values):
+    """
+    The tuples decode returns for the values of host "host"
+    """
+    return [("host", identifier, timestamp, interval, [value])
+            for identifier, interval, timestamp, value in values]
+
+
+class CollectdNetTest(unittest.TestCase):
+
+    def test_split_identifier(self):
+        self.assertEqual(split_identifier("tail-rollup-60/temperature-ceil-max"),
+                         ("tail", "rollup-60", "temperature", "ceil-max"))
+        self.assertEqual(split_identifier("plugin/type"), ("plugin", "", "type", ""))
+
+    def test_round_trip(self):
+        packets = PacketEncoder("host").encode(VALUES)
+        self.assertEqual(len(packets), 1)
+        self.assertEqual(decode(packets[0]), decoded(VALUES))
+
+    def test_unchanged_parts_are_not_repeated(self):
+        single = PacketEncoder("host").encode(VALUES[:1])[0]
+        both = PacketEncoder("host").encode(VALUES[:2])[0]
+        # the second value only repeats the type instance and the value
+        self.assertLess(len(both) - len(single), len(single) // 2)
+
+    def test_split_at_packet_size(self):
+        values = [("tail-temperature/temperature-sensor{}".format(number), 1,
+                   1000 + number, number / 4) for number in range(200)]
+        packets = PacketEncoder("host").encode(values)
+        self.assertGreater(len(packets), 1)
+        self.assertTrue(all(len(packet) <= DEFAULT_PACKET_SIZE for packet in packets))
+        self.assertEqual([value for packet in packets for value in decode(packet)],
+                         decoded(values))
+
+        small = PacketEncoder("host", max_size=200).encode(values)
+        self.assertTrue(all(len(packet) <= 200 for packet in small))
+        self.assertEqual([value for packet in small for value in decode(packet)],
+                         decoded(values))
+
+    def test_signed(self):
+        encoder = PacketEncoder("host", max_size=300, username="temp", password="secret")
+        packets = encoder.encode(VALUES * 10)
+        self.assertGreater(len(packets), 1)
+        self.assertTrue(all(len(packet) <= 300 for packet in packets))
+        values = [value for packet in packets
+                  for value in decode(packet, {"temp": "secret", "other": "x"})]
+        self.assertEqual(values, decoded(VALUES * 10))
+        # the signature is ignored without users
+        self.assertEqual(decode(packets[0]), decode(packets[0], {"temp": "secret"}))
+
+    def test_signature_rejected(self):
+        packet = PacketEncoder("host", username="temp", password="secret").encode(VALUES)[0]
+        for users in ({"temp": "wrong"}, {"other": "secret"}, {}):
+            with self.subTest(users=users):
+                with self.assertRaises(ValueError):
+                    decode(packet, users)
+        tampered = bytearray(packet)
+        tampered[-1] ^= 0xff
+        with self.assertRaises(ValueError):
+            decode(bytes(tampered), {"temp": "secret"})
+
+    def test_unsigned_rejected(self):
+        packet = PacketEncoder("host").encode(VALUES)[0]
+        with self.assertRaises(ValueError):
+            decode(packet, {"temp": "secret"})
+
+
+if __name__ == '__main__':
+    unittest.main()
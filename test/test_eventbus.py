@@ -0,0 +1,99 @@
+"""
+Tests of the per plugin queues and workers.
+
+    python3 -m unittest discover -s test -p 'test_*.py'
+"""
+
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tempermonitor.eventbus import PluginWorker  # noqa: E402
+
+
+class Plugin:
+    """
+    Records the handled events, stalls while `release` is not set
+    """
+    name = 'test'
+
+    def __init__(self, delay=0):
+        self.release = asyncio.Event()
+        self.delay = delay
+        self.handled = []
+        self.cancelled = 0
+
+    async def sensor_update(self, number):
+        try:
+            await self.release.wait()
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        self.handled.append(number)
+
+
+class PluginWorkerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.devnull = open(os.devnull, 'w')
+        self.stdout, sys.stdout = sys.stdout, self.devnull
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        self.devnull.close()
+        self.loop.close()
+
+    def run_worker(self, plugin, drop_policy, events, timeout=5):
+        worker = PluginWorker(plugin, self.loop, 3, timeout, drop_policy)
+
+        async def feed():
+            # the worker takes the first event and stalls in it
+            worker.put('sensor_update', (0,), {})
+            await asyncio.sleep(0)
+            for number in range(1, events):
+                worker.put('sensor_update', (number,), {})
+            self.assertEqual(worker.queue.qsize(), min(events - 1, 3))
+            plugin.release.set()
+            await asyncio.wait_for(worker.queue.join(), 5)
+            await worker.stop()
+        self.loop.run_until_complete(feed())
+        return worker
+
+    def test_drop_oldest(self):
+        plugin = Plugin()
+        worker = self.run_worker(plugin, 'drop_oldest', 8)
+        self.assertEqual(plugin.handled, [0, 5, 6, 7])
+        self.assertEqual((worker.handled, worker.dropped), (4, 4))
+
+    def test_drop_newest(self):
+        plugin = Plugin()
+        worker = self.run_worker(plugin, 'drop_newest', 8)
+        self.assertEqual(plugin.handled, [0, 1, 2, 3])
+        self.assertEqual((worker.handled, worker.dropped), (4, 4))
+
+    def test_unknown_call_is_not_queued(self):
+        plugin = Plugin()
+        worker = self.run_worker(plugin, 'drop_oldest', 1)
+        worker.put('unknown_call', (), {})
+        self.assertEqual(worker.queue.qsize(), 0)
+
+    def test_invalid_policy(self):
+        with self.assertRaises(RuntimeError):
+            PluginWorker(Plugin(), self.loop, 3, 5, 'block')
+
+    def test_timeout(self):
+        plugin = Plugin(delay=10)
+        worker = self.run_worker(plugin, 'drop_oldest', 2, timeout=0.05)
+        self.assertEqual(plugin.handled, [])
+        self.assertEqual(plugin.cancelled, 2)
+        self.assertEqual((worker.handled, worker.timeouts, worker.dropped), (0, 2, 0))
+        self.assertEqual(worker.durations['sensor_update'].count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
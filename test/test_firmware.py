@@ -0,0 +1,60 @@
+"""
+Run the firmware against the simulated buses of firmwaremock.py.
+
+    python3 -m unittest discover -s test -p 'test_*.py'
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from firmwaremock import simulate  # noqa: E402
+
+
+class FirmwareTest(unittest.TestCase):
+
+    def check(self, result):
+        self.assertGreater(len(result.blocks), 0)
+        self.assertEqual(result.complete, len(result.blocks))
+        self.assertEqual(result.errors, 0)
+        for block in result.blocks:
+            self.assertEqual(block.values.keys(), result.expected.keys())
+            for owid, value in block.values.items():
+                # the binary protocol sends hundredths of a degree
+                self.assertAlmostEqual(value, result.expected[owid], delta=0.01)
+
+    def test_text(self):
+        result = simulate([(12, 8)], duration=10)
+        self.assertFalse(result.handshake)
+        self.check(result)
+
+    def test_binary(self):
+        result = simulate([(12, 8), (9, 4)], duration=10, protocol="binary")
+        self.assertTrue(result.handshake)
+        self.check(result)
+        self.assertTrue(all(block.sequence is not None for block in result.blocks))
+
+    def test_partial_host_line(self):
+        # the rest of the command arrives seconds later, the rounds go on meanwhile
+        result = simulate([(12, 8)], duration=10, host=[(0, "MODE BI"), (4000, "N1\n")])
+        self.assertTrue(result.handshake)
+        self.check(result)
+        self.assertGreaterEqual(result.text_blocks, 4)
+        self.assertGreaterEqual(len(result.blocks) - result.text_blocks, 4)
+
+    def test_buses_convert_in_parallel(self):
+        result = simulate([(12, 8), (12, 8), (9, 4)], duration=10)
+        self.check(result)
+        # one conversion per round instead of one per bus
+        self.assertLess(result.round_ms, result.sequential_ms * 0.6)
+
+    def test_round_interval(self):
+        result = simulate([(12, 2)], duration=20, interval=2000)
+        self.check(result)
+        self.assertAlmostEqual(result.round_ms, 2000, delta=200)
+
+
+if __name__ == '__main__':
+    unittest.main()
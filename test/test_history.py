@@ -0,0 +1,62 @@
+"""
+Tests of the sensor history ring buffer.
+
+    python3 -m unittest discover -s test -p 'test_*.py'
+"""
+
+import configparser
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tempermonitor.history import History, INITIAL_SIZE, history_size  # noqa: E402
+
+
+class HistoryTest(unittest.TestCase):
+
+    def test_grows_with_the_samples(self):
+        history = History(1000)
+        self.assertEqual(len(history._times), INITIAL_SIZE)
+        for second in range(INITIAL_SIZE + 1):
+            history.append(second, second)
+        self.assertEqual(len(history._times), 2 * INITIAL_SIZE)
+        for second in range(INITIAL_SIZE + 1, 5000):
+            history.append(second, second)
+        self.assertEqual(len(history._times), 1000)
+        self.assertEqual(len(history), 1000)
+        self.assertEqual(list(history.last(2)), [(4998, 4998), (4999, 4999)])
+        self.assertEqual(next(iter(history.range(0)))[0], 4000)
+
+    def test_window_stats(self):
+        history = History(100)
+        for second in range(200):
+            history.append(second, second % 10)
+        self.assertEqual(history.stats(10), (11, 0, 9, sum(range(10)) / 11 + 9 / 11))
+        self.assertEqual(list(history.range(195, 197)), [(195, 5), (196, 6)])
+
+    def test_clock_steps_back(self):
+        history = History(10)
+        for second in range(15):
+            history.append(second, second)
+        # wrapped, the samples 10..14 are now in the future
+        history.append(9.5, -1)
+        self.assertEqual(history.dropped, 5)
+        self.assertEqual(list(history.last(2)), [(9, 9), (9.5, -1)])
+        times = [timestamp for timestamp, _ in history.range(0)]
+        self.assertEqual(times, sorted(times))
+        self.assertEqual(list(history.range(9)), [(9, 9), (9.5, -1)])
+
+    def test_default_size(self):
+        config = configparser.ConfigParser()
+        config.read_string("[general]\n")
+        self.assertEqual(history_size(config), 3600)
+        config['general']['history_interval'] = '0.5'
+        self.assertEqual(history_size(config), 7200)
+        config['general']['history_size'] = '10'
+        self.assertEqual(history_size(config), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
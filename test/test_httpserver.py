@@ -0,0 +1,74 @@
+"""
+Tests of the minimal HTTP server.
+
+    python3 -m unittest discover -s test -p 'test_*.py'
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tempermonitor.httpserver import HTTPServer, Response  # noqa: E402
+
+
+class HTTPServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'http.sock')
+        self.loop = asyncio.new_event_loop()
+        self.server = HTTPServer({'/metrics': lambda request: Response(b"ok\n")},
+                                 path=self.path)
+        self.devnull = open(os.devnull, 'w')
+        self.stdout, sys.stdout = sys.stdout, self.devnull
+        self.loop.run_until_complete(self.server.start())
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.server.stop())
+        sys.stdout = self.stdout
+        self.devnull.close()
+        self.loop.close()
+        self.tmp.cleanup()
+
+    def request(self, data):
+        async def run():
+            reader, writer = await asyncio.open_unix_connection(self.path)
+            writer.write(data)
+            response = await asyncio.wait_for(reader.read(), 5)
+            writer.close()
+            return response
+        return self.loop.run_until_complete(run())
+
+    def test_get(self):
+        response = self.request(b"GET /metrics HTTP/1.1\r\nConnection: close\r\n\r\n")
+        self.assertTrue(response.startswith(b"HTTP/1.1 200 OK\r\n"))
+        self.assertTrue(response.endswith(b"\r\n\r\nok\n"))
+
+    def test_keep_alive(self):
+        response = self.request(b"GET /metrics HTTP/1.1\r\n\r\n" +
+                                b"HEAD /other HTTP/1.1\r\nConnection: close\r\n\r\n")
+        self.assertEqual(response.count(b"HTTP/1.1 "), 2)
+        self.assertIn(b"HTTP/1.1 404 Not Found\r\n", response)
+
+    def test_invalid_request_line(self):
+        response = self.request(b"garbage\r\n\r\nGET /metrics HTTP/1.1\r\n" +
+                                b"Connection: close\r\n\r\n")
+        self.assertTrue(response.startswith(b"HTTP/1.1 400 Bad Request\r\n"))
+
+    def test_overlong_request_line(self):
+        response = self.request(b"GET /" + b"x" * 100000 + b" HTTP/1.1\r\n\r\n")
+        self.assertTrue(response.startswith(b"HTTP/1.1 431 "))
+        self.assertIn(b"Connection: close\r\n", response)
+
+    def test_overlong_header(self):
+        response = self.request(b"GET /metrics HTTP/1.1\r\nCookie: " + b"x" * 100000 +
+                                b"\r\n\r\n")
+        self.assertTrue(response.startswith(b"HTTP/1.1 431 "))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""
+Tests of the rate limit and the digests of the mail plugin.
+
+    python3 -m unittest discover -s test -p 'test_*.py'
+"""
+
+import asyncio
+import configparser
+import email
+import os
+import sys
+import tempfile
+import types
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tempermonitor.plugins.mail import DIGEST_SUBJECT, Mail, RateLimit  # noqa: E402
+
+
+class RateLimitTest(unittest.TestCase):
+
+    def test_expiry(self):
+        limit = RateLimit()
+        self.assertTrue(limit.allow('a', 0, 60, 10))
+        self.assertFalse(limit.allow('a', 59, 60, 10))
+        self.assertTrue(limit.allow('b', 30, 60, 10))
+        self.assertTrue(limit.allow('a', 60, 60, 10))
+        # b expires at 90 only
+        self.assertFalse(limit.allow('b', 89, 60, 10))
+        self.assertEqual(limit.limited, 2)
+        self.assertEqual(list(limit.last), ['b', 'a'])
+
+    def test_eviction_order(self):
+        limit = RateLimit()
+        for number, key in enumerate('abcd'):
+            self.assertTrue(limit.allow(key, number, 60, 3))
+        # the oldest entry a was evicted, so it is allowed again
+        self.assertEqual(list(limit.last), ['b', 'c', 'd'])
+        self.assertFalse(limit.allow('b', 10, 60, 3))
+        self.assertTrue(limit.allow('a', 10, 60, 3))
+        self.assertEqual(list(limit.last), ['c', 'd', 'a'])
+
+
+class Delivery:
+    """
+    Records the submitted mails instead of sending them
+    """
+
+    def __init__(self):
+        self.mails = []
+
+    def submit(self, sender, recipients, message):
+        self.mails.append((recipients, email.message_from_string(message)))
+
+
+class DigestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        config = configparser.ConfigParser()
+        config.read_dict({'mail': {
+            'from': 'tempermonitor@localhost', 'to': 'ops@localhost',
+            'to_urgent': 'ops@localhost,oncall@localhost', 'min_delay_between_messages': '0',
+            'digest_window': '0.02', 'spool_dir': self.tmp.name}})
+        self.loop = asyncio.new_event_loop()
+        self.now = 1000
+        monitor = types.SimpleNamespace(config=config, loop=self.loop, clock=lambda: self.now)
+        self.mail = Mail(monitor)
+        self.delivery = self.mail.delivery = Delivery()
+        self.devnull = open(os.devnull, 'w')
+        self.stdout, sys.stdout = sys.stdout, self.devnull
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        self.devnull.close()
+        self.loop.close()
+        self.tmp.cleanup()
+
+    def send(self, subject, urgent=False):
+        self.loop.run_until_complete(self.mail.send_mail(subject, f"body of {subject}", urgent))
+
+    def wait(self, seconds):
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+
+    def test_one_digest_per_window(self):
+        self.send("too warm")
+        self.send("too warm")
+        self.send("sensor missing")
+        self.assertEqual(self.delivery.mails, [])
+        self.wait(0.2)
+        self.assertEqual(len(self.delivery.mails), 1)
+        recipients, message = self.delivery.mails[0]
+        self.assertEqual(recipients, ['ops@localhost'])
+        self.assertEqual(message['Subject'], DIGEST_SUBJECT.format(count=3))
+        body = message.get_payload(decode=True).decode()
+        self.assertIn("2x too warm", body)
+        self.assertIn("1x sensor missing", body)
+        self.assertEqual(self.mail.digests_sent, 1)
+
+        # the next window starts with the next notification
+        self.send("too warm")
+        self.wait(0.2)
+        self.assertEqual(len(self.delivery.mails), 2)
+        # a single notification is sent as it is
+        self.assertEqual(self.delivery.mails[1][1]['Subject'], "too warm")
+
+    def test_urgent_bypasses_the_digest(self):
+        self.send("too warm")
+        self.send("way too hot", urgent=True)
+        self.assertEqual(len(self.delivery.mails), 1)
+        recipients, message = self.delivery.mails[0]
+        self.assertEqual(recipients, ['ops@localhost', 'oncall@localhost'])
+        self.assertEqual(message['Subject'], "way too hot")
+        self.wait(0.2)
+        self.assertEqual([message['Subject'] for _, message in self.delivery.mails],
+                         ["way too hot", "too warm"])
+
+    def test_rate_limited_before_the_digest(self):
+        self.mail.config['mail']['min_delay_between_messages'] = '3600'
+        self.send("too warm")
+        self.now += 10
+        self.send("too warm")
+        # the urgent mail is not held back by the normal one with the same subject
+        self.send("too warm", urgent=True)
+        self.mail.flush_digests()
+        self.assertEqual([message['Subject'] for _, message in self.delivery.mails],
+                         ["too warm", "too warm"])
+        self.assertEqual(self.mail.digest_events, 1)
+        self.assertEqual(self.mail._mail_rate_limit.limited, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+"""
+Tests of the decoders of the serial protocols.
+
+    python3 -m unittest discover -s test -p 'test_*.py'
+"""
+
+import binascii
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tempermonitor.protocol import (  # noqa: E402
+    BinaryDecoder, TextDecoder, encode_frame, FRAME_DATA, FRAME_IDS, HANDSHAKE_ACK,
+    IDS_HEADER, DATA_HEADER, DATA_ENTRY, MAGIC, MAX_LINE, READ_ERROR, READ_ERROR_TEMPERATURE)
+
+IDS = ['28000000000000%02x' % number for number in range(3)]
+
+
+def ids_frame(sequence, ids=IDS):
+    return encode_frame(FRAME_IDS, IDS_HEADER.pack(sequence, len(ids)) +
+                        b"".join(binascii.unhexlify(owid) for owid in ids))
+
+
+def data_frame(sequence, values, device_time=1000):
+    return encode_frame(FRAME_DATA, DATA_HEADER.pack(sequence, device_time, len(values)) +
+                        b"".join(DATA_ENTRY.pack(index, value) for index, value in values))
+
+
+def text_block(values):
+    return b"".join("{} {}\n".format(owid, temp).encode() for owid, temp in values.items()) + b"\n"
+
+
+class TextDecoderTest(unittest.TestCase):
+    VALUES = {IDS[0]: 21.5, IDS[1]: 19.25}
+
+    def synced(self):
+        decoder = TextDecoder()
+        self.assertEqual(decoder.feed(b"\n"), [])
+        return decoder
+
+    def test_block(self):
+        decoder = self.synced()
+        blocks = decoder.feed(text_block(self.VALUES))
+        self.assertEqual(len(blocks), 1)
+        self.assertEqual(blocks[0].values, self.VALUES)
+        self.assertIsNone(blocks[0].sequence)
+        self.assertEqual(decoder.valid_lines, 2)
+
+    def test_split_across_chunks(self):
+        decoder = self.synced()
+        data = text_block(self.VALUES) * 2
+        blocks = []
+        for position in range(len(data)):
+            blocks += decoder.feed(data[position:position + 1])
+        self.assertEqual([block.values for block in blocks], [self.VALUES, self.VALUES])
+
+    def test_garbage_before_first_block(self):
+        decoder = TextDecoder()
+        blocks = decoder.feed(b"MicroPython v1.9\r\n>>> 2800000000000000 1\n" +
+                              b"\n" + text_block(self.VALUES))
+        self.assertEqual([block.values for block in blocks], [self.VALUES])
+        self.assertGreater(decoder.garbage_bytes, 0)
+        self.assertEqual(decoder.invalid_lines, 0)
+
+    def test_invalid_line(self):
+        decoder = self.synced()
+        blocks = decoder.feed(b"2800000000000000 21.5\nnot a value\n\n")
+        self.assertEqual(blocks[0].values, {IDS[0]: 21.5})
+        self.assertEqual(decoder.invalid_lines, 1)
+        self.assertEqual(decoder.last_line, b"not a value")
+
+    def test_resync_after_overlong_line(self):
+        decoder = self.synced()
+        self.assertEqual(decoder.feed(b"x" * (MAX_LINE + 1)), [])
+        self.assertFalse(decoder.synced)
+        # the first block after the garbage is only used to sync again
+        blocks = decoder.feed(b"\n" + text_block(self.VALUES))
+        self.assertEqual([block.values for block in blocks], [self.VALUES])
+
+    def test_handshake(self):
+        decoder = TextDecoder()
+        decoder.expect_handshake = True
+        frame = ids_frame(1)
+        blocks = decoder.feed(b"\n" + text_block(self.VALUES) + b"> " + HANDSHAKE_ACK + b"\n" +
+                              frame)
+        self.assertEqual([block.values for block in blocks], [self.VALUES])
+        self.assertTrue(decoder.handshake)
+        self.assertEqual(decoder.remaining(), frame)
+        self.assertEqual(decoder.remaining(), b"")
+
+    def test_no_handshake_expected(self):
+        decoder = self.synced()
+        decoder.feed(HANDSHAKE_ACK + b"\n\n")
+        self.assertFalse(decoder.handshake)
+
+
+class BinaryDecoderTest(unittest.TestCase):
+
+    def test_block(self):
+        decoder = BinaryDecoder()
+        blocks = decoder.feed(ids_frame(1) + data_frame(2, [(0, 2150), (1, -525),
+                                                            (2, READ_ERROR)]))
+        self.assertEqual(len(blocks), 1)
+        self.assertEqual(blocks[0].values, {IDS[0]: 21.5, IDS[1]: -5.25,
+                                            IDS[2]: READ_ERROR_TEMPERATURE})
+        self.assertEqual(blocks[0].sequence, 2)
+        self.assertEqual(blocks[0].device_time, 1000)
+        self.assertEqual((decoder.frames, decoder.lost_frames, decoder.crc_errors), (2, 0, 0))
+
+    def test_split_across_chunks(self):
+        decoder = BinaryDecoder()
+        data = ids_frame(1) + data_frame(2, [(0, 2000)]) + data_frame(3, [(1, 2100)])
+        blocks = []
+        for position in range(len(data)):
+            blocks += decoder.feed(data[position:position + 1])
+        self.assertEqual([block.values for block in blocks],
+                         [{IDS[0]: 20.0}, {IDS[1]: 21.0}])
+        self.assertEqual(decoder.garbage_bytes, 0)
+
+    def test_garbage_before_frame(self):
+        decoder = BinaryDecoder()
+        # including a lone first byte of the magic
+        blocks = decoder.feed(b"garbage" + MAGIC[:1] + b"x" + ids_frame(1) +
+                              data_frame(2, [(0, 2000)]))
+        self.assertEqual([block.values for block in blocks], [{IDS[0]: 20.0}])
+        self.assertEqual(decoder.garbage_bytes, len(b"garbage") + 2)
+
+    def test_crc_error(self):
+        decoder = BinaryDecoder()
+        corrupted = bytearray(data_frame(2, [(0, 2000)]))
+        corrupted[-6] ^= 0xff
+        blocks = decoder.feed(ids_frame(1) + bytes(corrupted) + data_frame(3, [(0, 2100)]))
+        self.assertEqual([block.values for block in blocks], [{IDS[0]: 21.0}])
+        self.assertEqual(decoder.crc_errors, 1)
+        # the corrupted frame counts as lost
+        self.assertEqual(decoder.lost_frames, 1)
+
+    def test_resync_after_bogus_length(self):
+        decoder = BinaryDecoder()
+        blocks = decoder.feed(MAGIC + b"D\xff\xff" + ids_frame(1) + data_frame(2, [(0, 2000)]))
+        self.assertEqual([block.values for block in blocks], [{IDS[0]: 20.0}])
+
+    def test_lost_sequence_numbers(self):
+        decoder = BinaryDecoder()
+        decoder.feed(ids_frame(1) + data_frame(2, [(0, 2000)]) + data_frame(5, [(0, 2000)]))
+        self.assertEqual(decoder.lost_frames, 2)
+
+    def test_sequence_wraps(self):
+        decoder = BinaryDecoder()
+        decoder.feed(ids_frame(0xfffe) + data_frame(0xffff, [(0, 2000)]) +
+                     data_frame(0, [(0, 2000)]))
+        self.assertEqual(decoder.lost_frames, 0)
+
+    def test_data_without_ids(self):
+        decoder = BinaryDecoder()
+        self.assertEqual(decoder.feed(data_frame(1, [(0, 2000)])), [])
+        self.assertEqual(decoder.unmapped_frames, 1)
+
+    def test_stale_ids(self):
+        decoder = BinaryDecoder()
+        blocks = decoder.feed(ids_frame(1, IDS[:1]) + data_frame(2, [(0, 2000), (1, 2100)]))
+        self.assertEqual(blocks, [])
+        self.assertEqual(decoder.unmapped_frames, 1)
+
+    def test_unknown_frame_type(self):
+        decoder = BinaryDecoder()
+        blocks = decoder.feed(ids_frame(1) + encode_frame(ord('X'), b"future") +
+                              data_frame(3, [(0, 2000)]))
+        self.assertEqual([block.values for block in blocks], [{IDS[0]: 20.0}])
+        self.assertEqual(decoder.crc_errors, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
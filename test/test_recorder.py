@@ -0,0 +1,68 @@
+"""
+Tests of the rotating capture of the recorder.
+
+    python3 -m unittest discover -s test -p 'test_*.py'
+"""
+
+import asyncio
+import configparser
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tempermonitor.capture import open_capture, read_records  # noqa: E402
+from tempermonitor.recorder import Recorder, extract, read_index, segment_key  # noqa: E402
+
+
+class RecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.config = configparser.ConfigParser()
+        self.config.read_dict({'recorder': {'directory': self.tmp.name, 'max_segments': '3'}})
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        self.tmp.cleanup()
+
+    def run_recorder(self, records):
+        recorder = Recorder(self.config, 'bus', self.loop)
+        for timestamp, data in records:
+            recorder.record(timestamp, data)
+        self.loop.run_until_complete(recorder.stop())
+        return recorder
+
+    def extract(self):
+        output = os.path.join(self.tmp.name, 'out.cap')
+        count = extract(os.path.join(self.tmp.name, 'bus'), 0, 2000, output)
+        with open_capture(output) as capture:
+            return count, list(read_records(capture))
+
+    def test_restart_in_the_same_second(self):
+        self.run_recorder([(1000.1, b"first\n")])
+        self.run_recorder([(1000.6, b"second\n")])
+        directory = os.path.join(self.tmp.name, 'bus')
+        self.assertEqual(sorted(os.listdir(directory)),
+                         ['index', 'segment-1000-1.gz', 'segment-1000.gz'])
+        self.assertTrue(all(offset == 0 for _, _, _, offset in read_index(directory)))
+        count, records = self.extract()
+        self.assertEqual(count, 2)
+        self.assertEqual(records, [(1000.1, b"first\n"), (1000.6, b"second\n")])
+
+    def test_oldest_segments_expire(self):
+        for start in (1000, 1000, 900, 1001):
+            self.run_recorder([(start + 0.5, b"x")])
+        directory = os.path.join(self.tmp.name, 'bus')
+        segments = sorted((name for name in os.listdir(directory) if segment_key(name)),
+                          key=segment_key)
+        self.assertEqual(segments, ['segment-1000.gz', 'segment-1000-1.gz', 'segment-1001.gz'])
+        self.assertEqual({entry[2] for entry in read_index(directory)}, set(segments))
+        self.assertEqual(self.extract()[0], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+"""
+Tests of reloading the config of a running monitor.
+
+    python3 -m unittest discover -s test -p 'test_*.py'
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import tty
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tempermonitor.tempermonitor import TempMonitor  # noqa: E402
+
+CONFIG = """
+[general]
+plugins={plugins}
+
+[serial]
+port={port}
+baudrate=115200
+timeout=100
+
+[collectd]
+socketpath={directory}/collectd.sock
+hostname=reload
+interval=1
+transport={transport}
+
+[mail]
+from=reload@localhost
+to=reload@localhost
+to_urgent=reload@localhost
+min_delay_between_messages=3600
+"""
+
+SENSOR = """
+[{owid}]
+name={name}
+calibration=0
+"""
+
+
+class ReloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.configfile = os.path.join(self.tmp.name, 'reload.ini')
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.devnull = open(os.devnull, 'w')
+        self.stdout, sys.stdout = sys.stdout, self.devnull
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.write_config({'01': 'floor', '02': 'ceil'})
+        self.monitor = TempMonitor(self.loop, self.configfile)
+        self.monitor.load_plugins()
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.monitor.teardown())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        sys.stdout = self.stdout
+        self.devnull.close()
+        os.close(self.master)
+        os.close(self.slave)
+        self.tmp.cleanup()
+
+    def write_config(self, sensors, plugins='', transport='unixsock', extra=''):
+        text = CONFIG.format(plugins=plugins, port=os.ttyname(self.slave),
+                             directory=self.tmp.name, transport=transport)
+        for owid, name in sensors.items():
+            text += SENSOR.format(owid=owid, name=name)
+        with open(self.configfile, 'w') as config:
+            config.write(text + extra)
+
+    def reload(self):
+        self.loop.run_until_complete(self.monitor.reload())
+
+    def test_rename_add_and_replace(self):
+        floor = self.monitor.sensors['01']
+        ceil = self.monitor.sensors['02']
+        floor.update(20, 1000)
+        ceil.history.append(1000, 30)
+
+        # 01 is renamed, 02 is swapped for 03 with the same name, 04 is new
+        self.write_config({'01': 'floor2', '03': 'ceil', '04': 'new'})
+        self.reload()
+        sensors = self.monitor.sensors
+        self.assertEqual(sorted(sensors), ['01', '03', '04'])
+        self.assertIs(sensors['01'], floor)
+        self.assertEqual((floor.name, floor.temperature), ('floor2', 20))
+        self.assertIs(sensors['03'].history, ceil.history)
+        self.assertEqual(sensors['04'].name, 'new')
+        self.assertEqual(len(sensors['04'].history), 0)
+        self.assertEqual(self.monitor.config['01']['name'], 'floor2')
+
+    def test_plugins(self):
+        self.write_config({'01': 'floor', '02': 'ceil'}, plugins='collectd')
+        self.reload()
+        self.assertEqual([plugin.name for plugin in self.monitor.plugins], ['collectd'])
+        self.write_config({'01': 'floor', '02': 'ceil'})
+        self.reload()
+        self.assertEqual(self.monitor.plugins, [])
+
+    def check_rejected(self):
+        sensors = dict(self.monitor.sensors)
+        names = {owid: sensor.name for owid, sensor in sensors.items()}
+        self.reload()
+        self.assertEqual(self.monitor.sensors, sensors)
+        self.assertEqual({owid: sensor.name for owid, sensor in sensors.items()}, names)
+        self.assertEqual(self.monitor.config['01']['name'], 'floor')
+        self.assertNotIn('05', self.monitor.config)
+        self.assertEqual(self.monitor.plugins, [])
+
+    def test_invalid_sensor_is_rejected(self):
+        self.write_config({'01': 'renamed', '02': 'ceil'}, extra="[05]\nname=broken\n")
+        self.check_rejected()
+
+    def test_invalid_plugin_settings_are_rejected(self):
+        self.write_config({'01': 'renamed', '02': 'ceil', '05': 'new'}, plugins='collectd',
+                          transport='carrier-pigeon')
+        self.check_rejected()
+
+    def test_invalid_rule_is_rejected(self):
+        self.write_config({'01': 'renamed', '02': 'ceil', '05': 'new'},
+                          extra="[groups]\nfloor=floor\n\n"
+                                "[rule:broken]\nvalue=avg(floor) *\nabove=1\n")
+        self.check_rejected()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+"""
+Replay a capture into a slow plugin.
+
+    python3 -m unittest discover -s test -p 'test_*.py'
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tempermonitor.capture import CAPTURE_MAGIC, encode_records  # noqa: E402
+from tempermonitor.plugins import Plugin  # noqa: E402
+from tempermonitor.tempermonitor import TempMonitor  # noqa: E402
+
+OWID = '2800000000000001'
+
+CONFIG = """
+[general]
+plugins=slowreplay
+
+[serial]
+port=/dev/null
+baudrate=115200
+timeout=5
+
+[collectd]
+socketpath={directory}/collectd.sock
+hostname=replay
+interval=1
+
+[mail]
+from=replay@localhost
+to=replay@localhost
+to_urgent=replay@localhost
+min_delay_between_messages=3600
+
+[{owid}]
+name=sensor
+calibration=0
+"""
+
+
+class SlowReplay(Plugin):
+    """
+    Takes longer for every block than the replay waits between them
+    """
+
+    def __init__(self, monitor):
+        self.monitor = monitor
+        self.seen = []
+
+    async def sensor_update(self):
+        temperature = self.monitor.sensors[OWID].temperature
+        await asyncio.sleep(0.01)
+        self.seen.append(temperature)
+
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.configfile = os.path.join(self.tmp.name, 'replay.ini')
+        with open(self.configfile, 'w') as config:
+            config.write(CONFIG.format(directory=self.tmp.name, owid=OWID))
+        self.devnull = open(os.devnull, 'w')
+        self.stdout, sys.stdout = sys.stdout, self.devnull
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        self.devnull.close()
+        self.tmp.cleanup()
+
+    def replay(self, speed):
+        values = [20 + number / 10 for number in range(20)]
+        blocks = ["{} {}\n\n".format(OWID, value).encode() for value in values]
+        # the first line end only syncs the decoder, some records hold several blocks
+        records = [(1000, b"\n")]
+        for number in range(0, len(blocks), 4):
+            records.append((1000 + number * 0.01, blocks[number]))
+            records.append((1000 + number * 0.01 + 0.005, b"".join(blocks[number + 1:number + 4])))
+        capture = os.path.join(self.tmp.name, 'capture')
+        with open(capture, 'wb') as output:
+            output.write(CAPTURE_MAGIC + encode_records(records))
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            monitor = TempMonitor(loop, self.configfile, replay=capture, replay_speed=speed)
+            monitor.load_plugins()
+            timeout = loop.call_later(10, loop.stop)
+            loop.run_forever()
+            timeout.cancel()
+            plugin = monitor.plugins[0]
+            loop.run_until_complete(monitor.teardown())
+        finally:
+            loop.close()
+            asyncio.set_event_loop(None)
+        return values, plugin.seen
+
+    def test_slow_plugin_sees_every_block_once(self):
+        for speed in (10, None):
+            with self.subTest(speed=speed):
+                values, seen = self.replay(speed)
+                self.assertEqual(seen, values)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+"""
+Tests of the compiled alert rules.
+
+    python3 -m unittest discover -s test -p 'test_*.py'
+"""
+
+import configparser
+import os
+import sys
+import types
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tempermonitor.rules import Rule, RuleEngine, compile_expression  # noqa: E402
+
+GROUPS = {'floor': ['f1', 'f2'], 'ceil': ['c1', 'c2']}
+VALUES = {('ceil', 'avg'): 10, ('floor', 'avg'): 4, ('ceil', 'max'): 12}
+
+
+def evaluate(text, values=VALUES):
+    function, _ = compile_expression(text, GROUPS)
+    return function(values)
+
+
+class ExpressionTest(unittest.TestCase):
+
+    def test_sums_are_evaluated_left_to_right(self):
+        self.assertEqual(evaluate("avg(ceil) - avg(floor) + 2"), 8)
+        self.assertEqual(evaluate("2 - avg(ceil) - avg(floor)"), -12)
+        self.assertEqual(evaluate("-avg(ceil) + 1.5"), -8.5)
+        self.assertEqual(evaluate("max(ceil)"), 12)
+
+    def test_keys(self):
+        _, keys = compile_expression("avg(ceil) - avg(floor) + 1", GROUPS)
+        self.assertEqual(keys, {('ceil', 'avg'), ('floor', 'avg')})
+
+    def test_missing_aggregate(self):
+        self.assertIsNone(evaluate("min(ceil)"))
+        self.assertIsNone(evaluate("avg(ceil) - min(floor)"))
+
+    def test_rejected(self):
+        for text in ("", "avg(ceil) * 2", "avg(ceil) avg(floor)", "avg(ceil) +",
+                     "avg(ceil", "median(ceil)", "avg(nosuch)", "avg(ceil) > 3"):
+            with self.subTest(text=text):
+                with self.assertRaises(RuntimeError):
+                    compile_expression(text, GROUPS)
+
+
+class RuleTest(unittest.TestCase):
+
+    def rule(self, **options):
+        options.setdefault('value', 'avg(ceil)')
+        return Rule('test', options, GROUPS)
+
+    def run_rule(self, rule, samples):
+        """
+        Evaluate (time, avg(ceil)[, max(ceil)]) samples, returns the fired values
+        """
+        fired = []
+        for now, value, *maximum in samples:
+            values = {('ceil', 'avg'): value, ('ceil', 'max'): maximum[0] if maximum else value}
+            fired.append(rule.evaluate(values, now))
+        return fired
+
+    def test_invalid(self):
+        for options in ({'above': '1', 'below': '2'}, {}, {'above': 'warm'},
+                        {'above': '1', 'when': 'max(ceil) >= 3'},
+                        {'above': '1', 'urgent': 'maybe'},
+                        {'above': '1', 'value': 'avg(ceil) ^ 2'}):
+            with self.subTest(options=options):
+                with self.assertRaises(RuntimeError):
+                    self.rule(**options)
+
+    def test_above_and_below(self):
+        self.assertEqual(self.run_rule(self.rule(above='30'), [(0, 30), (1, 31)]), [None, 31])
+        self.assertEqual(self.run_rule(self.rule(below='10'), [(0, 10), (1, 9)]), [None, 9])
+
+    def test_hysteresis(self):
+        rule = self.rule(above='30', hysteresis='2')
+        fired = self.run_rule(rule, [(0, 29), (1, 31), (2, 29), (3, 28.5), (4, 28), (5, 29)])
+        # active from 31 until the value drops to 30 - 2
+        self.assertEqual(fired, [None, 31, 29, 28.5, None, None])
+        self.assertFalse(rule.active)
+
+    def test_for_resets_on_recovery(self):
+        rule = self.rule(above='30', **{'for': '60'})
+        fired = self.run_rule(rule, [(0, 31), (30, 31), (40, 29), (50, 31), (100, 31),
+                                     (110, 31), (120, 32)])
+        self.assertEqual(fired, [None, None, None, None, None, 31, 32])
+
+    def test_when(self):
+        rule = self.rule(above='30', when='max(ceil) > 35', **{'for': '10'})
+        fired = self.run_rule(rule, [(0, 31, 34), (10, 31, 36), (20, 31, 36), (30, 31, 34),
+                                     (40, 31, 36)])
+        # the condition gates the rule like a recovery, the duration starts over
+        self.assertEqual(fired, [None, None, 31, None, None])
+        self.assertEqual(rule.keys, {('ceil', 'avg'), ('ceil', 'max')})
+
+
+class RuleEngineTest(unittest.TestCase):
+
+    def test_legacy_rules(self):
+        config = configparser.ConfigParser()
+        config.read_dict({'warning': {'ceiling_critical_level': '45',
+                                      'ceiling_warning_level': '40',
+                                      'floor_ceiling_diff': '15',
+                                      'min_ceiling_warning': '35'}})
+        engine = RuleEngine(config, GROUPS)
+        sensors = {name: types.SimpleNamespace(valid=True, temperature=temperature)
+                   for name, temperature in (('f1', 20), ('f2', 22), ('c1', 38), ('c2', 46))}
+        sensors['f2'].valid = False
+        engine.bind(sensors)
+        values = engine.update(0)
+        self.assertEqual(values['floor', 'count'], 1)
+        self.assertEqual(values['ceil', 'avg'], 42)
+        self.assertEqual(values['ceil', 'var'], 16)
+        fired = {rule.name: value for rule, value in engine.evaluate(values, 0)}
+        self.assertEqual(fired, {'ceiling_critical': 46, 'ceiling_warning': 42,
+                                 'floor_ceiling_diff': 22})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+Tests of the connection handling of a serial bus.
+
+    python3 -m unittest discover -s test -p 'test_*.py'
+"""
+
+import asyncio
+import configparser
+import os
+import sys
+import types
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tempermonitor.serialbus import SerialBus  # noqa: E402
+from test_protocol import data_frame, ids_frame  # noqa: E402
+
+
+class SerialBusTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.calls = []
+        self.devnull = open(os.devnull, 'w')
+        self.stdout, sys.stdout = sys.stdout, self.devnull
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        self.devnull.close()
+        self.loop.close()
+
+    def bus(self, **options):
+        conf = {'port': 'bogus://device', 'baudrate': '115200', 'timeout': '5',
+                'reconnect_delay': '0.01', 'reconnect_jitter': '0'}
+        conf.update(options)
+        config = configparser.ConfigParser()
+        config.read_dict({'serial': conf})
+
+        async def call_plugin(call, **kwargs):
+            self.calls.append((call, kwargs))
+
+        async def ignore(*args):
+            pass
+        monitor = types.SimpleNamespace(config=config, loop=self.loop, call_plugin=call_plugin,
+                                        sensor_reading=ignore, block_done=ignore)
+        return SerialBus(monitor, 'serial')
+
+    def run_bus(self, bus, seconds):
+        async def run():
+            bus.start()
+            await asyncio.sleep(seconds)
+            running = not bus._task.done()
+            await bus.stop()
+            return running
+        return self.loop.run_until_complete(run())
+
+    def test_invalid_baudrate(self):
+        for baudrate in ('fast', '0'):
+            with self.subTest(baudrate=baudrate):
+                with self.assertRaises(RuntimeError):
+                    self.bus(baudrate=baudrate)
+
+    def test_rejected_port_is_retried(self):
+        # pyserial raises ValueError for an unknown URL scheme
+        bus = self.bus()
+        self.assertTrue(self.run_bus(bus, 0.1))
+        self.assertEqual(bus.link_state, 'down')
+        self.assertGreater(bus.connect_failures, 1)
+        self.assertIn('connection failed', self.calls[0][1]['reason'])
+
+    def test_task_death_is_reported(self):
+        bus = self.bus()
+
+        async def reconnect():
+            raise TypeError("bug")
+        bus.reconnect = reconnect
+        self.assertFalse(self.run_bus(bus, 0.05))
+        self.assertEqual(bus.link_state, 'down')
+        self.assertEqual(self.calls[-1][0], 'link_state')
+        self.assertIn("reader task died", self.calls[-1][1]['reason'])
+
+    def test_lost_frames_are_reported(self):
+        bus = self.bus()
+        bus.binary = True
+
+        def receive(data):
+            self.loop.run_until_complete(bus.handle_blocks(bus.decode(data)))
+        receive(ids_frame(1) + data_frame(2, [(0, 2000)]) + data_frame(5, [(0, 2000)]))
+        receive(data_frame(6, [(0, 2000)]))
+        receive(data_frame(8, [(0, 2000)]))
+        self.assertEqual([kwargs['count'] for call, kwargs in self.calls
+                          if call == 'err_frames_lost'], [2, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+"""
+Check the startup time and the lazy imports of the daemon with startup.py.
+
+    python3 -m unittest discover -s test -p 'test_*.py'
+"""
+
+import os
+import socket
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from startup import MAX_STARTUP_MS, PLUGIN_SETS, check, measure  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+class StartupTest(unittest.TestCase):
+
+    def test_plugin_sets(self):
+        for plugins in PLUGIN_SETS:
+            with self.subTest(plugins=plugins):
+                result = measure(plugins, runs=3, prometheus_port=free_port(),
+                                 api_port=free_port())
+                self.assertEqual(check(result, MAX_STARTUP_MS), [])
+
+    def test_check(self):
+        result = {'plugins': 'warnings', 'startup_ms': MAX_STARTUP_MS + 1,
+                  'modules': ['smtplib']}
+        self.assertEqual(len(check(result, MAX_STARTUP_MS)), 2)
+        result = {'plugins': 'mail', 'startup_ms': 1, 'modules': ['smtplib']}
+        self.assertEqual(check(result, MAX_STARTUP_MS), [])
+
+
+if __name__ == '__main__':
+    unittest.main()